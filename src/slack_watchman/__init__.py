@@ -1,4 +1,6 @@
+# pylint: disable=too-many-lines
 import argparse
+import contextlib
 import datetime
 import os
 import sys
@@ -6,14 +8,24 @@ import time
 import traceback
 from importlib import metadata
 from importlib.metadata import PackageMetadata
-from typing import List
+from typing import List, Dict
 
 import yaml
 
 from slack_watchman import (
     signature_downloader,
+    canvas_scanner,
     exceptions,
-    watchman_processor
+    export_scanner,
+    history_scanner,
+    matcher,
+    planner,
+    profile_scanner,
+    rate_limiter,
+    scheduler,
+    stream_scanner,
+    watchman_processor,
+    work_queue
 )
 from slack_watchman.clients.slack_client import SlackClient
 from slack_watchman.loggers import (
@@ -30,16 +42,22 @@ from slack_watchman.models import (
     conversation,
     auth_vars
 )
+from slack_watchman.budget import RunBudget
+from slack_watchman.file_content import DEFAULT_MAX_FILE_BYTES, ArchiveLimits, FileContentReader
+from slack_watchman.models.work_unit import WorkUnit
+from slack_watchman.state import StateStore
+from slack_watchman.utils import convert_to_dict, convert_timestamp
 
 OUTPUT_LOGGER: JSONLogger
 
 
-def validate_conf(cookie_auth: bool) -> auth_vars.AuthVars:
+def validate_conf(cookie_auth: bool, require_auth: bool = True) -> auth_vars.AuthVars:
     """ Validates configuration and authentication settings for Slack Watchman.
     Authentication tokens from environment variables take precedence over config file values.
 
     Args:
         cookie_auth: Whether session:cookie auth is being used
+        require_auth: Whether authentication details are needed. Scanning an export doesn't use them
     Returns:
         AuthVars object containing the authentication details
     Raises:
@@ -80,6 +98,11 @@ def validate_conf(cookie_auth: bool) -> auth_vars.AuthVars:
         """ Retrieve value from environment or config."""
         return os.environ.get(key) or conf_details.get(conf_key or key.lower())
 
+    # App-level token for Socket Mode, only needed when streaming events
+    auth_info.app_token = get_env_or_conf('SLACK_WATCHMAN_APP_TOKEN', 'app_token')
+
+    if not require_auth:
+        return auth_info
     if not cookie_auth:
         auth_info.token = get_env_or_conf("SLACK_WATCHMAN_TOKEN", 'token')
         if not auth_info.token:
@@ -111,57 +134,668 @@ def suppress_disabled_signatures(signatures: List[signature.Signature],
         return signatures
 
 
+def calculate_timeframe(tm: str) -> str:
+    """ Get the date to search from for a --timeframe choice, relative to now
+
+    Args:
+        tm: Timeframe choice: d = 24 hours w = 7 days, m = 30 days, a = all time
+    Returns:
+        Date string in the format YYYY-mm-dd
+    """
+
+    seconds = {'d': 86400, 'w': 604800, 'm': 2592000}.get(tm, 1576800000)
+    return time.strftime('%Y-%m-%d', time.localtime(int(time.time()) - seconds))
+
+
+def load_signatures(auth_info: auth_vars.AuthVars) -> List[signature.Signature]:
+    """ Download the signatures, removing any that are disabled in the config file
+
+    Args:
+        auth_info: Configuration details, including the disabled signatures
+    Returns:
+        List of enabled signatures
+    """
+
+    OUTPUT_LOGGER.log('INFO', 'Downloading and importing signatures...')
+    signature_list = signature_downloader.SignatureDownloader(OUTPUT_LOGGER).download_signatures()
+    signature_list = suppress_disabled_signatures(signature_list, auth_info.disabled_signatures)
+    if auth_info.disabled_signatures:
+        OUTPUT_LOGGER.log('INFO', f'The following signatures have been suppressed: {auth_info.disabled_signatures}')
+    OUTPUT_LOGGER.log('SUCCESS', f'{len(signature_list)} signatures loaded')
+    return signature_list
+
+
+def select_signatures(signature_list: List[signature.Signature],
+                      everything: bool,
+                      secrets: bool,
+                      pii: bool) -> List[signature.Signature]:
+    """ Select the signatures to search with, based on the categories chosen
+
+    Args:
+        signature_list: All enabled signatures
+        everything: Whether to search for PII and secrets
+        secrets: Whether to search for secrets
+        pii: Whether to search for PII
+    Returns:
+        List of signatures to search with
+    """
+
+    if everything or not pii and not secrets:
+        OUTPUT_LOGGER.log('INFO', 'Searching for PII and Secrets')
+        return signature_list
+    elif secrets:
+        OUTPUT_LOGGER.log('INFO', 'Searching for Secrets')
+        return [sig for sig in signature_list if sig.category == 'secrets']
+    else:
+        OUTPUT_LOGGER.log('INFO', 'Searching for PII')
+        return [sig for sig in signature_list if sig.category == 'pii']
+
+
+def log_finding(work_unit: WorkUnit, finding: Dict) -> None:
+    """ Output a finding
+
+    Args:
+        work_unit: Work unit the finding was found by
+        finding: The finding
+    """
+
+    OUTPUT_LOGGER.log(
+        'NOTIFY',
+        convert_to_dict(finding),
+        scope=work_unit.scope,
+        severity=work_unit.signature.severity,
+        detect_type=work_unit.signature.name,
+        notify_type='result')
+
+
+# pylint: disable=too-many-locals, too-many-arguments, too-many-branches
 def search(slack_connection: SlackClient,
-           loaded_signature: signature.Signature,
+           signatures: List[signature.Signature],
            timeframe: int or str,
-           scope: str,
-           verbose: bool) -> None:
-    """ Search either messages or files for matches from signatures.
-    Findings are then filtered by RegEx, and any matches are output to
-    the chosen logging mechanism.
+           verbose: bool,
+           *,
+           parallel_matching: bool = False,
+           regex_budget: float = matcher.DEFAULT_PATTERN_BUDGET,
+           state_store: StateStore = None,
+           emit_mode: str = 'all',
+           directory: watchman_processor.DirectoryCache = None,
+           matcher_pool: matcher.MatcherPool = None,
+           resume: bool = False,
+           shard_index: int = 0,
+           shard_count: int = 1,
+           budget: RunBudget = None,
+           order_by_yield: bool = False,
+           team_ids: List[str] = None,
+           history_channels: List[conversation.Conversation | conversation.ConversationSuccinct] = None,
+           workspace_url: str = None,
+           expand_threads: bool = False,
+           read_file_content: bool = False,
+           max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+           file_workers: int = 4,
+           archive_limits: ArchiveLimits = None,
+           all_matches: bool = False) -> None:
+    """ Search messages and files for matches from signatures.
+    Findings are filtered by RegEx, and any matches are output to
+    the chosen logging mechanism as soon as they are found.
+
+    Args:
+        slack_connection: Slack API object
+        signatures: Signature objects which define what to search for
+        timeframe: How far back to search for
+        verbose: Whether to use verbose logging or not
+        parallel_matching: Whether to match messages in a pool of processes, one per CPU core
+        regex_budget: Maximum number of seconds a pattern can take to search a single message
+        state_store: Store of watermarks and findings from previous runs, used to only search for new results
+        emit_mode: Which findings to output: `all`, `new` or `new-resolved`. Modes other than `all`
+            need a state store
+        directory: Cache of users and conversations to enrich findings with, kept between searches
+        matcher_pool: Pool of processes to match messages in, kept between searches. If not given and
+            parallel_matching is set, a pool is created for this search
+        resume: Carry on from the checkpoint left in the state store by an interrupted search
+        shard_index: Index of the shard to search, when the search is split across several nodes
+        shard_count: Number of shards the search is split into
+        budget: Limits on the time, requests and findings for the search. When reached, the search
+            stops cleanly, outputs what was found and reports the searches skipped or cut short
+        order_by_yield: Run the searches that found the most per page in previous runs first, within
+            each severity. Needs a state store
+        team_ids: Workspaces in an Enterprise Grid organisation to search, taking turns between them.
+            Defaults to the workspace of the token
+        history_channels: Read every message in these conversations and match it against every
+            signature, rather than searching
+        workspace_url: URL of the workspace, used to link to messages found by reading history
+        expand_threads: Whether to read the replies in threads when reading history
+        read_file_content: Whether to download text files that match and match their content
+            against the signature patterns
+        max_file_bytes: Files larger than this are not downloaded
+        file_workers: Number of files downloaded at once
+        archive_limits: Limits on decompressing `.zip`, `.tar.gz` and `.gz` files when reading file
+            content. Archives aren't read if not given
+        all_matches: Output every distinct match in a message or file, rather than only the first
+            match of each pattern
+    """
+
+    def log_resolved(work_unit: WorkUnit, finding: Dict) -> None:
+        OUTPUT_LOGGER.log(
+            'NOTIFY',
+            {
+                **finding,
+                'posted_at': convert_timestamp(finding.get('posted_at')),
+                'first_seen': convert_timestamp(finding.get('first_seen')),
+                'last_seen': convert_timestamp(finding.get('last_seen')),
+                'status': 'resolved'
+            },
+            scope=work_unit.scope,
+            severity=work_unit.signature.severity,
+            detect_type=work_unit.signature.name,
+            notify_type='resolved')
+
+    if resume and state_store:
+        checkpoint = state_store.get_checkpoint()
+        if checkpoint:
+            # Resumed with the original timeframe, so the pages line up with the checkpoint
+            timeframe = checkpoint.get('timeframe', timeframe)
+            OUTPUT_LOGGER.log('INFO', f'Resuming interrupted search from checkpoint, searching after {timeframe}')
+        else:
+            OUTPUT_LOGGER.log('INFO', 'No checkpoint found to resume from, starting a new search')
+            resume = False
+
+    if history_channels is not None:
+        work_units = history_scanner.plan_channel_work_units(history_channels)
+        OUTPUT_LOGGER.log('INFO', f'Reading the history of {len(work_units)} conversations')
+    else:
+        work_units = watchman_processor.plan_work_units(signatures, team_ids=team_ids)
+    if shard_count > 1:
+        total_units = len(work_units)
+        work_units = watchman_processor.shard_work_units(work_units, shard_index, shard_count)
+        OUTPUT_LOGGER.log('INFO', f'Searching shard {shard_index} of {shard_count}: '
+                                  f'{len(work_units)} of {total_units} searches')
+    if history_channels is None:
+        # Highest severity first, so critical findings are output first and are searched before any budget runs out
+        query_yields = state_store.get_query_yields() if order_by_yield and state_store else None
+        work_units = watchman_processor.prioritise_work_units(work_units, query_yields)
+
+    pattern_guard = matcher.PatternGuard(regex_budget)
+    own_pool = parallel_matching and matcher_pool is None
+    if own_pool:
+        matcher_pool = matcher.MatcherPool(signatures, budget=regex_budget)
+    if matcher_pool:
+        OUTPUT_LOGGER.log('INFO', f'Matching messages using {matcher_pool.processes} processes')
+    scanner_args = {
+        'on_finding': log_finding,
+        'directory': directory,
+        'matcher_pool': matcher_pool,
+        'pattern_guard': pattern_guard,
+        'state_store': state_store,
+        'emit_mode': emit_mode,
+        'on_resolved': log_resolved,
+        'budget': budget,
+        'file_reader': FileContentReader(slack_connection, max_file_bytes, archive_limits=archive_limits)
+        if read_file_content else None,
+        'content_workers': file_workers,
+        'all_matches': all_matches,
+        # Slack rate limits each workspace separately, so more workspaces can be searched at once
+        'fetch_workers': min(4 * len(team_ids or [None]), 16)
+    }
+    try:
+        if history_channels is not None:
+            scanner = history_scanner.HistoryScanner(
+                slack_connection, OUTPUT_LOGGER, verbose, timeframe, signatures=signatures,
+                workspace_url=workspace_url, expand_threads=expand_threads, **scanner_args)
+        else:
+            scanner = watchman_processor.SignatureScanner(
+                slack_connection, OUTPUT_LOGGER, verbose, timeframe, **scanner_args)
+        scanner.run(work_units, resume=resume)
+    finally:
+        if own_pool:
+            matcher_pool.close()
+
+    report_pattern_costs(pattern_guard)
+    report_budget(scanner)
+    if state_store and not scanner.completed:
+        OUTPUT_LOGGER.log('WARNING', 'Not every search completed. Run again with --resume to carry on '
+                                     'from the checkpoint')
+
+    for sig in signatures:
+        for scope in sig.scope or []:
+            stats = scanner.stats.get((sig.id, scope))
+            if stats and stats.get('matches'):
+                OUTPUT_LOGGER.log('SUCCESS', f'{sig.name}: {stats.get("matches")} total {scope} found '
+                                             f'after filtering {stats.get("potential_matches")} potential matches')
+
+
+# pylint: disable=too-many-arguments
+def scan_canvases(slack_connection: SlackClient,
+                  channels: List[conversation.Conversation | conversation.ConversationSuccinct],
+                  signatures: List[signature.Signature],
+                  verbose: bool,
+                  *,
+                  workspace_url: str = None,
+                  regex_budget: float = matcher.DEFAULT_PATTERN_BUDGET,
+                  state_store: StateStore = None,
+                  emit_mode: str = 'all',
+                  directory: watchman_processor.DirectoryCache = None,
+                  workers: int = 4,
+                  max_bytes: int = DEFAULT_MAX_FILE_BYTES,
+                  all_matches: bool = False) -> canvas_scanner.CanvasScanner:
+    """ Read the canvas of each channel and match its content against the signatures with
+    the messages scope. Canvases that haven't changed since the last run are skipped
+
+    Args:
+        slack_connection: Slack API object
+        channels: Channels to read the canvases of
+        signatures: Signature objects which define what to search for
+        verbose: Whether to use verbose logging or not
+        workspace_url: URL of the workspace, used to link to canvases
+        regex_budget: Maximum number of seconds a pattern can take to search a single chunk of a canvas
+        state_store: Store of canvas watermarks and findings from previous runs
+        emit_mode: Which findings to output: `all` or `new`. `new` needs a state store
+        directory: Cache of users to enrich findings with
+        workers: Number of canvases read at once
+        max_bytes: Maximum number of bytes read from each canvas
+        all_matches: Output every distinct match in a canvas, rather than only the first match of each pattern
+    Returns:
+        CanvasScanner used for the scan
+    """
+
+    pattern_guard = matcher.PatternGuard(regex_budget)
+    scanner = canvas_scanner.CanvasScanner(
+        slack_connection, OUTPUT_LOGGER, verbose, signatures, log_finding, workspace_url=workspace_url,
+        directory=directory, pattern_guard=pattern_guard, state_store=state_store, emit_mode=emit_mode,
+        workers=workers, max_bytes=max_bytes, all_matches=all_matches)
+    scanner.run(channels)
+
+    report_pattern_costs(pattern_guard)
+    OUTPUT_LOGGER.log('INFO', f'{scanner.stats.get("read")} canvases read, {scanner.stats.get("unchanged")} '
+                              f'unchanged since the last run, {scanner.stats.get("failed")} failed')
+    if scanner.stats.get('matches'):
+        OUTPUT_LOGGER.log('SUCCESS', f'{scanner.stats.get("matches")} total matches found in canvases')
+    return scanner
+
+
+def scan_profiles(signatures: List[signature.Signature],
+                  verbose: bool,
+                  *,
+                  user_dicts: List[Dict] = None,
+                  channel_dicts: List[Dict] = None,
+                  regex_budget: float = matcher.DEFAULT_PATTERN_BUDGET,
+                  state_store: StateStore = None,
+                  emit_mode: str = 'all',
+                  all_matches: bool = False) -> profile_scanner.ProfileScanner:
+    """ Match the user profiles and channel topics and purposes already enumerated against
+    the signatures with the messages scope. No requests are made to the Slack API
+
+    Args:
+        signatures: Signature objects which define what to search for
+        verbose: Whether to use verbose logging or not
+        user_dicts: Users from users.list
+        channel_dicts: Channels from conversations.list
+        regex_budget: Maximum number of seconds a pattern can take to search a single field
+        state_store: Store of findings from previous runs
+        emit_mode: Which findings to output: `all` or `new`. `new` needs a state store
+        all_matches: Output every distinct match in a field, rather than only the first match of each pattern
+    Returns:
+        ProfileScanner used for the scan
+    """
+
+    pattern_guard = matcher.PatternGuard(regex_budget)
+    scanner = profile_scanner.ProfileScanner(
+        OUTPUT_LOGGER, verbose, signatures, log_finding, pattern_guard=pattern_guard, state_store=state_store,
+        emit_mode=emit_mode, all_matches=all_matches)
+    scanner.run(user_dicts, channel_dicts)
+
+    report_pattern_costs(pattern_guard)
+    if scanner.stats.get('matches'):
+        OUTPUT_LOGGER.log('SUCCESS', f'{scanner.stats.get("matches")} total matches found in user profiles '
+                                     f'and channel topics and purposes')
+    return scanner
+
+
+def stream_events(signatures: List[signature.Signature],
+                  verbose: bool,
+                  *,
+                  directory: watchman_processor.DirectoryCache,
+                  event_feed: str = None,
+                  app_token: str = None,
+                  workspace_url: str = None,
+                  regex_budget: float = matcher.DEFAULT_PATTERN_BUDGET,
+                  state_store: StateStore = None,
+                  emit_mode: str = 'all',
+                  all_matches: bool = False) -> stream_scanner.StreamScanner:
+    """ Match messages and files from a stream of events against the signatures as they
+    arrive, until the stream ends or is interrupted
+
+    Args:
+        signatures: Signature objects which define what to search for
+        verbose: Whether to use verbose logging or not
+        directory: Cache of users and conversations to enrich findings with, primed before the stream starts
+        event_feed: Path of a local feed of JSON events, one on each line, or `-` for stdin. If not given,
+            events are received over Socket Mode
+        app_token: App-level token to connect to Socket Mode with
+        workspace_url: URL of the workspace, used to link to messages
+        regex_budget: Maximum number of seconds a pattern can take to search a single message
+        state_store: Store of findings from previous runs
+        emit_mode: Which findings to output: `all` or `new`. `new` needs a state store
+        all_matches: Output every distinct match in a message, rather than only the first match of each pattern
+    Returns:
+        StreamScanner used for the stream
+    Raises:
+        MissingEnvVarError: If streaming over Socket Mode without an app-level token
+    """
+
+    pattern_guard = matcher.PatternGuard(regex_budget)
+    scanner = stream_scanner.StreamScanner(
+        OUTPUT_LOGGER, verbose, signatures, log_finding, directory, workspace_url=workspace_url,
+        pattern_guard=pattern_guard, state_store=state_store, emit_mode=emit_mode, all_matches=all_matches)
+    with contextlib.ExitStack() as stack:
+        if event_feed:
+            OUTPUT_LOGGER.log('INFO', f'Reading events from: {event_feed}')
+            feed = sys.stdin if event_feed == '-' else stack.enter_context(open(event_feed, encoding='utf-8'))
+            events = stream_scanner.iter_event_feed(feed)
+        else:
+            if not app_token:
+                raise exceptions.MissingEnvVarError('SLACK_WATCHMAN_APP_TOKEN')
+            OUTPUT_LOGGER.log('INFO', 'Receiving events over Socket Mode')
+            events = stream_scanner.SocketModeClient(SlackClient(token=app_token), OUTPUT_LOGGER).iter_events()
+        try:
+            scanner.run(events)
+        except KeyboardInterrupt:
+            OUTPUT_LOGGER.log('INFO', 'Stopped streaming events')
+
+    report_pattern_costs(pattern_guard)
+    OUTPUT_LOGGER.log('INFO', f'{scanner.stats.get("events")} events received, {scanner.stats.get("messages")} '
+                              f'messages and {scanner.stats.get("files")} files matched. Slowest event took '
+                              f'{scanner.max_latency * 1000:.1f}ms')
+    if scanner.stats.get('matches'):
+        OUTPUT_LOGGER.log('SUCCESS', f'{scanner.stats.get("matches")} total matches found in streamed events')
+    return scanner
+
+
+def plan(slack_connection: SlackClient,
+         signatures: List[signature.Signature],
+         timeframe: str,
+         *,
+         state_store: StateStore = None,
+         shard_index: int = 0,
+         shard_count: int = 1,
+         team_ids: List[str] = None) -> planner.ScanPlan:
+    """ Output the expected cost of a search without running it: the results and pages
+    for each query, the requests to each API method, and the runtime at Slack's rate limits
 
     Args:
         slack_connection: Slack API object
-        loaded_signature: Signature object which defines what to search for
+        signatures: Signature objects which define what to search for
         timeframe: How far back to search for
-        scope: Where to search in Slack, e.g. files or messages
+        state_store: Store of watermarks from previous runs, so only new results are counted
+        shard_index: Index of the shard to plan, when the search is split across several nodes
+        shard_count: Number of shards the search is split into
+        team_ids: Workspaces in an Enterprise Grid organisation to plan for
+    Returns:
+        ScanPlan of the expected cost
+    """
+
+    work_units = watchman_processor.plan_work_units(signatures, team_ids=team_ids)
+    if shard_count > 1:
+        work_units = watchman_processor.shard_work_units(work_units, shard_index, shard_count)
+    work_units = watchman_processor.prioritise_work_units(work_units)
+    OUTPUT_LOGGER.log('INFO', f'Planning {len(work_units)} searches, using one request per search to count results')
+
+    scan_plan = planner.plan_scan(slack_connection, work_units, timeframe, state_store=state_store)
+    for estimate in scan_plan.estimates:
+        OUTPUT_LOGGER.log('INFO', f'{estimate.unit.signature.name} - {estimate.unit.scope} after {estimate.after} '
+                                  f'using query: {estimate.unit.query}: {estimate.total} results, '
+                                  f'{estimate.pages} pages')
+
+    minutes_by_method = scan_plan.minutes_by_method()
+    for method, count in sorted(scan_plan.requests.items(), key=lambda item: rate_limiter.METHOD_TIERS[item[0]]):
+        tier = rate_limiter.METHOD_TIERS[method]
+        OUTPUT_LOGGER.log('INFO', f'{method} (Tier {tier}, {rate_limiter.RATE_LIMIT_TIERS[tier]} requests a minute): '
+                                  f'{"up to " if method in ("users.info", "conversations.info") else ""}'
+                                  f'{count} requests, {minutes_by_method[method]:.1f} minutes')
+    OUTPUT_LOGGER.log('SUCCESS', f'Plan: {len(work_units)} searches, {scan_plan.total_results} results, '
+                                 f'{sum(estimate.pages for estimate in scan_plan.estimates)} pages. Expected '
+                                 f'runtime up to {datetime.timedelta(seconds=round(scan_plan.minutes * 60))}, '
+                                 f'less as users and conversations are only looked up once')
+    return scan_plan
+
+
+def scan_export(path: str,
+                signatures: List[signature.Signature],
+                timeframe: str,
+                verbose: bool,
+                *,
+                regex_budget: float = matcher.DEFAULT_PATTERN_BUDGET,
+                state_store: StateStore = None,
+                emit_mode: str = 'all',
+                all_matches: bool = False) -> export_scanner.ExportScanner:
+    """ Scan a Slack export ZIP file offline, matching every message against the signatures
+    with the messages scope. Findings are output in the same format as a search
+
+    Args:
+        path: Path to the export ZIP file
+        signatures: Signature objects which define what to search for
+        timeframe: Only scan days on or after this date
+        verbose: Whether to use verbose logging or not
+        regex_budget: Maximum number of seconds a pattern can take to search a single message
+        state_store: Store of findings from previous runs
+        emit_mode: Which findings to output: `all` or `new`. `new` needs a state store
+        all_matches: Output every distinct match in a message, rather than only the first match of each pattern
+    Returns:
+        ExportScanner used for the scan
+    """
+
+    pattern_guard = matcher.PatternGuard(regex_budget)
+    scanner = export_scanner.ExportScanner(
+        path, OUTPUT_LOGGER, verbose, signatures, log_finding, timeframe=timeframe,
+        pattern_guard=pattern_guard, state_store=state_store, emit_mode=emit_mode, all_matches=all_matches)
+    scanner.run()
+
+    report_pattern_costs(pattern_guard)
+    OUTPUT_LOGGER.log('INFO', f'{scanner.messages_read} messages read from {scanner.files_read} daily files')
+    for sig in signatures:
+        stats = scanner.stats.get((sig.id, 'messages'))
+        if stats and stats.get('matches'):
+            OUTPUT_LOGGER.log('SUCCESS', f'{sig.name}: {stats.get("matches")} total messages found '
+                                         f'after filtering {stats.get("potential_matches")} potential matches')
+    return scanner
+
+
+def coordinate(shared_queue: work_queue.WorkQueue,
+               signatures: List[signature.Signature],
+               timeframe: str,
+               *,
+               resume: bool = False,
+               poll_seconds: float = 10) -> None:
+    """ Add the work units for a search to a shared work queue, then output the findings
+    workers write back to it until every unit has been searched
+
+    Args:
+        shared_queue: Queue shared with the workers
+        signatures: Signature objects which define what to search for
+        timeframe: How far back to search for
+        resume: Carry on with the scan already in the queue, rather than starting a new one
+        poll_seconds: Seconds to wait between checking the queue
+    """
+
+    info = shared_queue.get_info()
+    if resume and info:
+        OUTPUT_LOGGER.log('INFO', f'Resuming the scan already in the work queue: {shared_queue.path}')
+    else:
+        work_units = watchman_processor.prioritise_work_units(watchman_processor.plan_work_units(signatures))
+        shared_queue.start(work_units, {'timeframe': timeframe, 'last_output': 0})
+        OUTPUT_LOGGER.log('INFO', f'Added {len(work_units)} searches to the work queue: {shared_queue.path}')
+
+    last_output = (info or {}).get('last_output', 0) if resume else 0
+    last_counts = None
+    while True:
+        # Checked before reading the findings, so nothing written back is missed
+        finished = shared_queue.is_finished()
+        findings = shared_queue.findings_after(last_output)
+        for last_output, finding in findings:
+            OUTPUT_LOGGER.log(
+                'NOTIFY',
+                finding.get('finding'),
+                scope=finding.get('scope'),
+                severity=finding.get('severity'),
+                detect_type=finding.get('signature_name'),
+                notify_type='result')
+        if findings:
+            shared_queue.set_info('last_output', last_output)
+
+        counts = shared_queue.counts()
+        if counts != last_counts:
+            OUTPUT_LOGGER.log('INFO', f'Work queue: {counts.get("done")} done, {counts.get("leased")} in progress, '
+                                      f'{counts.get("pending")} pending, {counts.get("failed")} failed')
+            last_counts = counts
+        if finished:
+            break
+        time.sleep(poll_seconds)
+
+    for unit_key, error in shared_queue.failed_units():
+        OUTPUT_LOGGER.log('WARNING', f'Search failed on every attempt: {unit_key}: {error}')
+
+
+# pylint: disable=too-many-locals, too-many-arguments
+def work(slack_connection: SlackClient,
+         signatures: List[signature.Signature],
+         shared_queue: work_queue.WorkQueue,
+         verbose: bool,
+         *,
+         parallel_matching: bool = False,
+         regex_budget: float = matcher.DEFAULT_PATTERN_BUDGET,
+         directory: watchman_processor.DirectoryCache = None,
+         read_file_content: bool = False,
+         max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+         file_workers: int = 4,
+         archive_limits: ArchiveLimits = None,
+         batch_size: int = 4,
+         poll_seconds: float = 10,
+         all_matches: bool = False) -> None:
+    """ Search work units leased from a shared work queue, writing the findings back to it,
+    until every unit in the queue has been searched
+
+    Args:
+        slack_connection: Slack API object
+        signatures: Signature objects the work units are for
+        shared_queue: Queue shared with the coordinator
         verbose: Whether to use verbose logging or not
+        parallel_matching: Whether to match messages in a pool of processes, one per CPU core
+        regex_budget: Maximum number of seconds a pattern can take to search a single message
+        directory: Cache of users and conversations to enrich findings with
+        read_file_content: Whether to download text files that match and match their content
+            against the signature patterns
+        max_file_bytes: Files larger than this are not downloaded
+        file_workers: Number of files downloaded at once
+        archive_limits: Limits on decompressing archives when reading file content. Archives aren't
+            read if not given
+        batch_size: Number of work units to lease at a time
+        poll_seconds: Seconds to wait when there are no units to lease
+        all_matches: Report every distinct match in a message or file, rather than only the first
+            match of each pattern
     """
 
-    if scope == 'messages':
-        OUTPUT_LOGGER.log('INFO', f'Searching for posts containing {loaded_signature.name}')
-        messages = watchman_processor.find_messages(
-            slack_connection,
-            OUTPUT_LOGGER,
-            loaded_signature,
-            verbose,
-            timeframe)
-        if messages:
-            for message in messages:
-                OUTPUT_LOGGER.log(
-                    'NOTIFY',
-                    message,
-                    scope=scope,
-                    severity=loaded_signature.severity,
-                    detect_type=loaded_signature.name,
-                    notify_type='result')
-    if scope == 'files':
-        OUTPUT_LOGGER.log('INFO', f'Searching for posts containing {loaded_signature.name}')
-        files = watchman_processor.find_files(
-            slack_connection,
-            OUTPUT_LOGGER,
-            loaded_signature,
-            verbose,
-            timeframe)
-        if files:
-            for file in files:
-                OUTPUT_LOGGER.log(
-                    'NOTIFY',
-                    file,
-                    scope=scope,
-                    severity=loaded_signature.severity,
-                    detect_type=loaded_signature.name,
-                    notify_type='result')
+    worker_id = work_queue.new_worker_id()
+    signatures_by_id = {sig.id: sig for sig in signatures}
+    directory = directory or watchman_processor.DirectoryCache(slack_connection, verbose)
+    pattern_guard = matcher.PatternGuard(regex_budget)
+    matcher_pool = matcher.MatcherPool(signatures, budget=regex_budget) if parallel_matching else None
+    file_reader = FileContentReader(slack_connection, max_file_bytes, archive_limits=archive_limits) \
+        if read_file_content else None
+    OUTPUT_LOGGER.log('INFO', f'Working on the work queue {shared_queue.path} as {worker_id}')
+
+    try:
+        while True:
+            info = shared_queue.get_info()
+            if info and shared_queue.is_finished():
+                break
+            leased = shared_queue.lease(worker_id, batch_size) if info else []
+            if not leased:
+                time.sleep(poll_seconds)
+                continue
+
+            work_units = []
+            for unit_key, signature_id, scope, query in leased:
+                if signature_id in signatures_by_id:
+                    work_units.append(WorkUnit(signature=signatures_by_id[signature_id], scope=scope, query=query))
+                else:
+                    shared_queue.release(worker_id, unit_key, f'Signature not loaded by worker: {signature_id}')
+
+            findings = {unit.key: [] for unit in work_units}
+
+            def collect_finding(work_unit: WorkUnit, finding: Dict) -> None:
+                findings[work_unit.key].append({
+                    'watchman_id': finding.get('watchman_id'),
+                    'signature_name': work_unit.signature.name,
+                    'severity': work_unit.signature.severity,
+                    'scope': work_unit.scope,
+                    'finding': convert_to_dict(finding)
+                })
+
+            scanner = watchman_processor.SignatureScanner(
+                slack_connection,
+                OUTPUT_LOGGER,
+                verbose,
+                info.get('timeframe'),
+                on_finding=collect_finding,
+                directory=directory,
+                matcher_pool=matcher_pool,
+                pattern_guard=pattern_guard,
+                file_reader=file_reader,
+                content_workers=file_workers,
+                all_matches=all_matches)
+            with work_queue.LeaseKeeper(shared_queue, worker_id, [unit.key for unit in work_units]):
+                scanner.run(work_units)
+
+            for unit in work_units:
+                if scanner.unit_completed(unit.key):
+                    if not shared_queue.complete(worker_id, unit.key, findings[unit.key]):
+                        OUTPUT_LOGGER.log('WARNING', f'Lease was taken over by another worker before the search '
+                                                     f'finished: {unit.key}')
+                else:
+                    shared_queue.release(worker_id, unit.key, 'Search did not complete')
+    finally:
+        if matcher_pool:
+            matcher_pool.close()
+
+    report_pattern_costs(pattern_guard)
+    OUTPUT_LOGGER.log('SUCCESS', 'Every search in the work queue has finished')
+
+
+def report_budget(scanner: watchman_processor.SignatureScanner) -> None:
+    """ Output the searches that were skipped or cut short because the run budget was reached
+
+    Args:
+        scanner: Scanner used for the search
+    """
+
+    for label, stopped in [('skipped', scanner.skipped), ('truncated', scanner.truncated)]:
+        if not stopped:
+            continue
+        by_signature = {}
+        for unit, reason in stopped.values():
+            signature_name = unit.signature.name if unit.signature else 'Conversation history'
+            by_signature.setdefault((signature_name, unit.scope, reason), []).append(unit.query)
+        OUTPUT_LOGGER.log('WARNING', f'Run budget reached: {len(stopped)} searches {label}')
+        for (signature_name, scope, reason), queries in by_signature.items():
+            OUTPUT_LOGGER.log('WARNING', f'{label.capitalize()}: {signature_name} ({scope}) - {reason}. '
+                                         f'Queries: {", ".join(queries)}')
+
+
+def report_pattern_costs(pattern_guard: matcher.PatternGuard) -> None:
+    """ Output the most expensive patterns, and any patterns that were quarantined
+    for exceeding their time budget
+
+    Args:
+        pattern_guard: Guard used during the scan
+    """
+
+    costs, quarantined = pattern_guard.report()
+    for cost in costs[:5]:
+        OUTPUT_LOGGER.log('DEBUG', f'Pattern cost: {cost.signature_id}: {cost.pattern} - {cost.calls} searches, '
+                                   f'{cost.total_seconds:.3f}s total, {cost.max_seconds:.3f}s max')
+    for cost in quarantined:
+        OUTPUT_LOGGER.log('WARNING', f'Pattern quarantined after exceeding the {pattern_guard.budget}s time budget, '
+                                     f'some matches may have been missed: {cost.signature_id}: {cost.pattern} '
+                                     f'({cost.max_seconds:.3f}s on a single message)')
 
 
 def unauthenticated_probe(workspace_domain: str,
@@ -239,6 +873,114 @@ def main():
                             help='Use cookie auth using Slack d cookie. '
                                  'REQUIRES either SLACK_WATCHMAN_COOKIE and SLACK_WATCHMAN_URL environment variables '
                                  'set, or both values set in watchman.conf')
+        parser.add_argument('--parallel-matching', dest='parallel_matching', action='store_true',
+                            help='Match messages against signatures in a pool of processes, one per CPU core. '
+                                 'Speeds up large scans on machines with multiple cores')
+        parser.add_argument('--regex-budget', dest='regex_budget', type=float,
+                            default=matcher.DEFAULT_PATTERN_BUDGET,
+                            help='Maximum number of seconds a signature pattern can take to search a single message. '
+                                 'Patterns that exceed this are quarantined for the rest of the run. '
+                                 f'Default: {matcher.DEFAULT_PATTERN_BUDGET}')
+        parser.add_argument('--all-matches', dest='all_matches', action='store_true',
+                            help='Output every distinct match in a message, file, canvas or profile field as its '
+                                 'own finding, rather than only the first match of each signature pattern')
+        parser.add_argument('--state-dir', dest='state_dir',
+                            help='Directory to keep state between runs in. When set, each search only looks for '
+                                 'results newer than the last time it was run, within the --timeframe')
+        parser.add_argument('--emit', dest='emit_mode', choices=watchman_processor.EMIT_MODES, default='all',
+                            help='Which findings to output: all = every finding, new = only findings not seen by a '
+                                 'previous run, new-resolved = new findings, and previous findings that were not '
+                                 'found again. new and new-resolved REQUIRE --state-dir. Default: all')
+        parser.add_argument('--resume', dest='resume', action='store_true',
+                            help='Carry on from the checkpoint left by an interrupted scan, skipping searches '
+                                 'and pages already processed and findings already output. REQUIRES --state-dir')
+        parser.add_argument('--shard-index', dest='shard_index', type=int, default=0,
+                            help='Index of the shard to search, from 0 to --shard-count - 1, when splitting a scan '
+                                 'across several nodes. Default: 0')
+        parser.add_argument('--shard-count', dest='shard_count', type=int, default=1,
+                            help='Number of nodes the scan is split across. Each node searches a stable subset of '
+                                 'the signature searches. Default: 1')
+        queue_group = parser.add_mutually_exclusive_group()
+        queue_group.add_argument('--coordinator', dest='coordinator_queue', metavar='QUEUE_FILE',
+                                 help='Add the searches to a shared work queue file, e.g. on shared storage, and '
+                                      'output the findings workers write back to it. Use --resume to carry on '
+                                      'with the scan already in the queue')
+        queue_group.add_argument('--worker', dest='worker_queue', metavar='QUEUE_FILE',
+                                 help='Search work leased from a shared work queue file created by --coordinator, '
+                                      'writing the findings back to it')
+        parser.add_argument('--lease-seconds', dest='lease_seconds', type=float,
+                            default=work_queue.DEFAULT_LEASE_SECONDS,
+                            help='Seconds a worker holds a search for without renewing it before another worker '
+                                 f'can take it over. Default: {work_queue.DEFAULT_LEASE_SECONDS}')
+        parser.add_argument('--max-duration', dest='max_duration', type=float,
+                            help='Maximum number of minutes to search for. When reached, no more results are '
+                                 'fetched, and everything found so far is output')
+        parser.add_argument('--max-requests', dest='max_requests', type=int,
+                            help='Maximum number of Slack API requests to make while searching. When reached, no '
+                                 'more results are fetched, and everything found so far is output')
+        parser.add_argument('--max-findings-per-signature', dest='max_findings_per_signature', type=int,
+                            help='Maximum number of findings to output for each signature')
+        parser.add_argument('--team-ids', dest='team_ids',
+                            help='Comma separated IDs of the workspaces to search in an Enterprise Grid '
+                                 'organisation, or "all" for every workspace the token has access to. '
+                                 'Workspaces are searched in one run, taking turns between them')
+        parser.add_argument('--file-content', dest='file_content', action='store_true',
+                            help='Download text files that match a signature and match their content against '
+                                 'the signature patterns. Files are streamed, and never held whole in memory')
+        parser.add_argument('--max-file-size', dest='max_file_size', type=float, default=10,
+                            help='Maximum size in MB of files to download with --file-content. Default: 10')
+        parser.add_argument('--file-workers', dest='file_workers', type=int, default=4,
+                            help='Number of files to download at once with --file-content. Default: 4')
+        parser.add_argument('--file-archives', dest='file_archives', action='store_true',
+                            help='With --file-content, also read .zip, .tar.gz and .gz files and match the '
+                                 'text files in them. Archives are decompressed in the --parallel-matching pool')
+        parser.add_argument('--archive-max-size', dest='archive_max_size', type=float, default=100,
+                            help='Maximum number of MB to decompress from each archive. Default: 100')
+        parser.add_argument('--archive-max-members', dest='archive_max_members', type=int, default=1000,
+                            help='Maximum number of files to read from each archive. Default: 1000')
+        parser.add_argument('--archive-max-ratio', dest='archive_max_ratio', type=float, default=100,
+                            help='Maximum compression ratio of an archive. Decompression stops when the data '
+                                 'decompressed is this many times the size of the archive. Default: 100')
+        parser.add_argument('--history', dest='history', action='store_true',
+                            help='Read every message in each channel with conversations.history and match it '
+                                 'against every signature, rather than searching. Channels are read in parallel '
+                                 'within Slack\'s rate limits')
+        parser.add_argument('--threads', dest='threads', action='store_true',
+                            help='With --history, also read the replies in each thread. Threads without a reply '
+                                 'since the last scan are skipped')
+        parser.add_argument('--canvases', dest='canvases', action='store_true',
+                            help='After searching, read the canvas of each channel and match its content against '
+                                 'the signatures. Canvases are read --file-workers at a time, up to --max-file-size. '
+                                 'With --state-dir, canvases that haven\'t changed since the last run are skipped')
+        parser.add_argument('--profiles', dest='profiles', action='store_true',
+                            help='Match the profile fields of users enumerated with --users, and the topic and '
+                                 'purpose of channels enumerated with --channels, --history or --canvases, against '
+                                 'the signatures. No extra API requests are made')
+        parser.add_argument('--plan', dest='plan', action='store_true',
+                            help='Count the results for each search and output the expected pages, API requests '
+                                 'and runtime, without running the scan')
+        parser.add_argument('--order-by-yield', dest='order_by_yield', action='store_true',
+                            help='Within each severity, run the searches that found the most in previous runs '
+                                 'first. Requires --state-dir')
+        parser.add_argument('--daemon', dest='daemon', action='store_true',
+                            help='Keep running and search on a schedule set by --interval or --cron. Signatures, '
+                                 'connections and caches are kept between searches. Send SIGHUP to reload '
+                                 'watchman.conf and the signatures')
+        schedule_group = parser.add_mutually_exclusive_group()
+        schedule_group.add_argument('--interval', dest='interval', type=float, default=60,
+                                    help='Minutes to wait between searches in daemon mode. Default: 60')
+        schedule_group.add_argument('--cron', dest='cron',
+                                    help='Cron expression for when to search in daemon mode, e.g. "0 */6 * * *"')
+        parser.add_argument('--stream', dest='stream', action='store_true',
+                            help='Receive message and file events over Socket Mode and match them as they are '
+                                 'posted, rather than searching. Needs an app-level token in '
+                                 'SLACK_WATCHMAN_APP_TOKEN and the stream extra')
+        parser.add_argument('--event-feed', dest='event_feed', metavar='PATH',
+                            help='Match events from a local file with one JSON event on each line, or - for stdin, '
+                                 'as they are read, rather than searching')
+        parser.add_argument('--export-zip', dest='export_zip', metavar='PATH',
+                            help='Scan a Slack export ZIP file offline rather than using the API. '
+                                 'No token is needed')
         parser.add_argument('--probe', dest='probe_domain',
                             help='Perform an un-authenticated probe on a workspace for available'
                                  ' authentication options and other information. '
@@ -256,6 +998,75 @@ def main():
         pii = args.pii
         cookie = args.cookie
         probe_domain = args.probe_domain
+        parallel_matching = args.parallel_matching
+        regex_budget = args.regex_budget
+        state_dir = args.state_dir
+        emit_mode = args.emit_mode
+        daemon = args.daemon
+        resume = args.resume
+        shard_index = args.shard_index
+        shard_count = args.shard_count
+        coordinator_queue = args.coordinator_queue
+        max_duration = args.max_duration
+        max_requests = args.max_requests
+        max_findings_per_signature = args.max_findings_per_signature
+        worker_queue = args.worker_queue
+
+        if emit_mode != 'all' and not state_dir:
+            parser.error(f'--emit {emit_mode} requires --state-dir')
+        if resume and not (state_dir or coordinator_queue):
+            parser.error('--resume requires --state-dir')
+        if args.history and (emit_mode == 'new-resolved' or args.plan or args.team_ids or args.order_by_yield):
+            parser.error('--history can\'t be used with --emit new-resolved, --plan, --team-ids or --order-by-yield')
+        if (args.history or args.plan) and args.file_content:
+            parser.error('--file-content can\'t be used with --history or --plan')
+        if args.file_workers < 1 or args.max_file_size <= 0:
+            parser.error('--file-workers and --max-file-size must be greater than 0')
+        if args.file_archives and not (args.file_content and parallel_matching):
+            parser.error('--file-archives requires --file-content and --parallel-matching')
+        if min(args.archive_max_size, args.archive_max_members, args.archive_max_ratio) <= 0:
+            parser.error('--archive-max-size, --archive-max-members and --archive-max-ratio must be greater than 0')
+        archive_limits = ArchiveLimits(int(args.archive_max_size * 1024 * 1024), args.archive_max_members,
+                                       args.archive_max_ratio) if args.file_archives else None
+        if args.canvases and any([emit_mode == 'new-resolved', args.plan, coordinator_queue, worker_queue]):
+            parser.error('--canvases can\'t be used with --emit new-resolved, --plan, --coordinator or --worker')
+        if args.profiles and not any([args.users, args.channels, args.history, args.canvases]):
+            parser.error('--profiles requires --users, --channels, --history or --canvases')
+        if args.profiles and any([emit_mode == 'new-resolved', args.plan, coordinator_queue, worker_queue]):
+            parser.error('--profiles can\'t be used with --emit new-resolved, --plan, --coordinator or --worker')
+        if args.stream and args.event_feed:
+            parser.error('--stream and --event-feed can\'t be used together')
+        if (args.stream or args.event_feed) and any([
+                emit_mode == 'new-resolved', resume, daemon, args.history, args.canvases, args.profiles, args.plan,
+                args.team_ids, args.order_by_yield, coordinator_queue, worker_queue, shard_count > 1,
+                args.file_content]):
+            parser.error('--stream and --event-feed can only be used with --timeframe, --output, --all, --secrets, '
+                         '--pii, --users, --channels, --cookie, --debug, --verbose, --regex-budget, --state-dir '
+                         'and --emit new')
+        if args.threads and not args.history:
+            parser.error('--threads requires --history')
+        if args.order_by_yield and not state_dir:
+            parser.error('--order-by-yield requires --state-dir')
+        if (coordinator_queue or worker_queue) and any([state_dir, daemon, shard_count > 1, args.team_ids,
+                                                        args.history]):
+            parser.error('--coordinator and --worker can\'t be used with --state-dir, --daemon, --shard-count, '
+                         '--team-ids or --history')
+        if args.export_zip and any([cookie, args.users, args.channels, emit_mode == 'new-resolved', resume, daemon,
+                                    args.history, args.plan, args.team_ids, args.order_by_yield,
+                                    coordinator_queue, worker_queue, shard_count > 1, args.file_content,
+                                    args.canvases, args.profiles, args.stream, args.event_feed]):
+            parser.error('--export-zip can only be used with --timeframe, --output, --all, --secrets, --pii, '
+                         '--debug, --verbose, --regex-budget, --state-dir and --emit new')
+        if args.export_zip and not os.path.isfile(args.export_zip):
+            parser.error(f'--export-zip file not found: {args.export_zip}')
+        if shard_count < 1 or not 0 <= shard_index < shard_count:
+            parser.error('--shard-index must be between 0 and --shard-count - 1')
+        schedule = None
+        if daemon:
+            try:
+                schedule = scheduler.create_schedule(args.interval, args.cron)
+            except ValueError as e:
+                parser.error(str(e))
 
         OUTPUT_LOGGER = init_logger(logging_type, debug)
 
@@ -263,22 +1074,28 @@ def main():
             if vars(args).get(deprecated_arg):
                 OUTPUT_LOGGER.log('WARNING', f'Argument `--{deprecated_arg}` is deprecated, and has been ignored')
 
-        if tm == 'd':
-            now = int(time.time())
-            timeframe = time.strftime('%Y-%m-%d', time.localtime(now - 86400))
-        elif tm == 'w':
-            now = int(time.time())
-            timeframe = time.strftime('%Y-%m-%d', time.localtime(now - 604800))
-        elif tm == 'm':
-            now = int(time.time())
-            timeframe = time.strftime('%Y-%m-%d', time.localtime(now - 2592000))
-        else:
-            now = int(time.time())
-            timeframe = time.strftime('%Y-%m-%d', time.localtime(now - 1576800000))
-
         if probe_domain:
             unauthenticated_probe(probe_domain, project_metadata)
 
+        if args.export_zip:
+            auth_info = validate_conf(cookie, require_auth=False)
+            OUTPUT_LOGGER.log('SUCCESS', 'Slack Watchman started execution')
+            OUTPUT_LOGGER.log('INFO', f'Version: {project_metadata.get("version")}')
+            OUTPUT_LOGGER.log('INFO', 'Created by: PaperMtn <papermtn@protonmail.com>')
+            OUTPUT_LOGGER.log('INFO', f'Scanning export: {args.export_zip}')
+            search_signatures = select_signatures(load_signatures(auth_info), everything, secrets, pii)
+            state_store = StateStore(state_dir) if state_dir else None
+            try:
+                scan_export(args.export_zip, search_signatures, calculate_timeframe(tm), verbose,
+                            regex_budget=regex_budget, state_store=state_store, emit_mode=emit_mode,
+                            all_matches=args.all_matches)
+            finally:
+                if state_store:
+                    state_store.close()
+            OUTPUT_LOGGER.log('SUCCESS', f'Slack Watchman finished execution - Execution time:'
+                                         f' {str(datetime.timedelta(seconds=time.time() - start_time))}')
+            return
+
         auth_info = validate_conf(cookie)
         slack_con = watchman_processor.initiate_slack_connection(auth_info)
 
@@ -287,18 +1104,18 @@ def main():
             slack_con.get_user_info(auth_data.get('user_id')).get('user'), True)
 
         workspace_information = workspace.create_from_dict(slack_con.get_workspace_info().get('team'))
+        team_ids = None
+        if args.team_ids == 'all':
+            team_ids = [team.get('id') for team in slack_con.get_teams()]
+        elif args.team_ids:
+            team_ids = [team_id.strip() for team_id in args.team_ids.split(',') if team_id.strip()]
 
         OUTPUT_LOGGER.log('SUCCESS', 'Slack Watchman started execution')
         OUTPUT_LOGGER.log('INFO', f'Version: {project_metadata.get("version")}')
         OUTPUT_LOGGER.log('INFO', 'Created by: PaperMtn <papermtn@protonmail.com>')
         OUTPUT_LOGGER.log('INFO', f'Searching workspace: {workspace_information.name}')
         OUTPUT_LOGGER.log('INFO', f'Workspace URL: {workspace_information.url}')
-        OUTPUT_LOGGER.log('INFO', 'Downloading and importing signatures...')
-        signature_list = signature_downloader.SignatureDownloader(OUTPUT_LOGGER).download_signatures()
-        signature_list = suppress_disabled_signatures(signature_list, auth_info.disabled_signatures)
-        if auth_info.disabled_signatures:
-            OUTPUT_LOGGER.log('INFO', f'The following signatures have been suppressed: {auth_info.disabled_signatures}')
-        OUTPUT_LOGGER.log('SUCCESS', f'{len(signature_list)} signatures loaded')
+        signature_list = load_signatures(auth_info)
         if cookie:
             OUTPUT_LOGGER.log('SUCCESS', 'Successfully authenticated using cookie')
             OUTPUT_LOGGER.log('SUCCESS', f"This user's SESSION_TOKEN: {slack_con.session_token}")
@@ -307,6 +1124,14 @@ def main():
                           f'- {calling_user.email} ID: {calling_user.id}')
         OUTPUT_LOGGER.log('USER', calling_user, detect_type='User', notify_type='user')
         OUTPUT_LOGGER.log('WORKSPACE', workspace_information, detect_type='Workspace', notify_type='workspace')
+        if team_ids is not None:
+            if not team_ids:
+                raise ValueError('No Enterprise Grid workspaces found to search')
+            OUTPUT_LOGGER.log('INFO', f'Searching {len(team_ids)} Enterprise Grid workspaces')
+            for team_id in team_ids:
+                OUTPUT_LOGGER.log('WORKSPACE',
+                                  workspace.create_from_dict(slack_con.get_workspace_info(team_id).get('team')),
+                                  detect_type='Workspace', notify_type='workspace')
         OUTPUT_LOGGER.log('INFO', 'Finding workspace authentication options')
         workspace_auth = watchman_processor.find_auth_information(domain_url=workspace_information.url)
         if workspace_auth:
@@ -315,9 +1140,12 @@ def main():
         else:
             OUTPUT_LOGGER.log('INFO', 'No workspace authentication information found')
 
+        # Kept so the profiles and channel topics can be scanned without downloading them again
+        user_dicts, channel_dicts = None, None
         if users:
             OUTPUT_LOGGER.log('INFO', 'Enumerating users...')
-            user_list = watchman_processor.get_users(slack_con, verbose)
+            user_dicts = watchman_processor.list_users(slack_con)
+            user_list = [user.create_from_dict(u, verbose) for u in user_dicts]
             OUTPUT_LOGGER.log('SUCCESS', f'{len(user_list)} users discovered')
             OUTPUT_LOGGER.log('INFO', 'Writing to csv')
             export_csv('slack_users', user_list)
@@ -327,7 +1155,8 @@ def main():
 
         if channels:
             OUTPUT_LOGGER.log('INFO', 'Enumerating channels...')
-            channel_list = watchman_processor.get_channels(slack_con, verbose)
+            channel_dicts = watchman_processor.list_channels(slack_con)
+            channel_list = [conversation.create_from_dict(c, verbose) for c in channel_dicts]
             OUTPUT_LOGGER.log('SUCCESS', f'{len(channel_list)} channels discovered')
             OUTPUT_LOGGER.log('INFO', 'Writing to csv')
             export_csv('slack_channels', channel_list)
@@ -343,36 +1172,111 @@ def main():
                     }
                     OUTPUT_LOGGER.log('CANVAS', canvas_information, detect_type='Canvas',
                                       notify_type='canvas')
-        if everything or not pii and not secrets:
-            OUTPUT_LOGGER.log('INFO', 'Searching for PII and Secrets')
-            for signature_object in signature_list:
-                for scope in signature_object.scope:
-                    search(
-                        slack_con,
-                        signature_object,
-                        timeframe,
-                        scope,
-                        verbose)
-        elif secrets:
-            OUTPUT_LOGGER.log('INFO', 'Searching for Secrets')
-            for signature_object in [sig for sig in signature_list if sig.category == 'secrets']:
-                for scope in signature_object.scope:
-                    search(
-                        slack_con,
-                        signature_object,
-                        timeframe,
-                        scope,
-                        verbose)
-        else:
-            OUTPUT_LOGGER.log('INFO', 'Searching for PII')
-            for signature_object in [sig for sig in signature_list if sig.category == 'pii']:
-                for scope in signature_object.scope:
-                    search(
-                        slack_con,
-                        signature_object,
-                        timeframe,
-                        scope,
-                        verbose)
+        state_store = None
+        if state_dir:
+            state_store = StateStore(state_dir)
+            OUTPUT_LOGGER.log('INFO', f'Using state from: {state_store.path}')
+
+        search_signatures = select_signatures(signature_list, everything, secrets, pii)
+        directory = watchman_processor.DirectoryCache(slack_con, verbose)
+        # In daemon mode the pool is kept between searches, so the patterns are only compiled once
+        matcher_pool = matcher.MatcherPool(search_signatures, budget=regex_budget) \
+            if daemon and parallel_matching else None
+
+        def run_search():
+            nonlocal resume
+            read_channel_dicts, read_channel_list = channel_dicts, None
+            if args.history or args.canvases:
+                OUTPUT_LOGGER.log('INFO', 'Enumerating channels to read...')
+                read_channel_dicts = watchman_processor.list_channels(slack_con)
+                read_channel_list = [conversation.create_from_dict(c, verbose) for c in read_channel_dicts]
+            search(
+                slack_con,
+                search_signatures,
+                calculate_timeframe(tm),
+                verbose,
+                parallel_matching=parallel_matching,
+                regex_budget=regex_budget,
+                state_store=state_store,
+                emit_mode=emit_mode,
+                directory=directory,
+                matcher_pool=matcher_pool,
+                resume=resume,
+                shard_index=shard_index,
+                shard_count=shard_count,
+                budget=RunBudget(max_duration * 60 if max_duration is not None else None,
+                                 max_requests,
+                                 max_findings_per_signature),
+                order_by_yield=args.order_by_yield,
+                team_ids=team_ids,
+                history_channels=read_channel_list if args.history else None,
+                workspace_url=workspace_information.url,
+                expand_threads=args.threads,
+                read_file_content=args.file_content,
+                max_file_bytes=int(args.max_file_size * 1024 * 1024),
+                file_workers=args.file_workers,
+                archive_limits=archive_limits,
+                all_matches=args.all_matches)
+            if args.canvases:
+                scan_canvases(slack_con, read_channel_list, search_signatures, verbose,
+                              workspace_url=workspace_information.url, regex_budget=regex_budget,
+                              state_store=state_store, emit_mode=emit_mode, directory=directory,
+                              workers=args.file_workers, max_bytes=int(args.max_file_size * 1024 * 1024),
+                              all_matches=args.all_matches)
+            if args.profiles:
+                scan_profiles(search_signatures, verbose, user_dicts=user_dicts, channel_dicts=read_channel_dicts,
+                              regex_budget=regex_budget, state_store=state_store, emit_mode=emit_mode,
+                              all_matches=args.all_matches)
+            # Only the first search in daemon mode carries on from the checkpoint
+            resume = False
+
+        def reload_config():
+            nonlocal auth_info, slack_con, search_signatures, directory, matcher_pool
+            new_auth_info = validate_conf(cookie)
+            if (new_auth_info.token, new_auth_info.cookie, new_auth_info.url) != \
+                    (auth_info.token, auth_info.cookie, auth_info.url):
+                OUTPUT_LOGGER.log('INFO', 'Authentication details changed, reconnecting')
+                slack_con = watchman_processor.initiate_slack_connection(new_auth_info)
+            auth_info = new_auth_info
+            search_signatures = select_signatures(load_signatures(auth_info), everything, secrets, pii)
+            directory = watchman_processor.DirectoryCache(slack_con, verbose)
+            if matcher_pool:
+                matcher_pool.close()
+                matcher_pool = matcher.MatcherPool(search_signatures, budget=regex_budget)
+
+        try:
+            if args.plan:
+                plan(slack_con, search_signatures, calculate_timeframe(tm), state_store=state_store,
+                     shard_index=shard_index, shard_count=shard_count, team_ids=team_ids)
+            elif coordinator_queue:
+                shared_queue = work_queue.WorkQueue(coordinator_queue, args.lease_seconds)
+                coordinate(shared_queue, search_signatures, calculate_timeframe(tm), resume=resume)
+                shared_queue.close()
+            elif worker_queue:
+                shared_queue = work_queue.WorkQueue(worker_queue, args.lease_seconds)
+                work(slack_con, signature_list, shared_queue, verbose, parallel_matching=parallel_matching,
+                     regex_budget=regex_budget, directory=directory, read_file_content=args.file_content,
+                     max_file_bytes=int(args.max_file_size * 1024 * 1024), file_workers=args.file_workers,
+                     archive_limits=archive_limits, all_matches=args.all_matches)
+                shared_queue.close()
+            elif args.stream or args.event_feed:
+                OUTPUT_LOGGER.log('INFO', 'Caching users and channels to enrich findings with...')
+                directory.prime(
+                    user_dicts if user_dicts is not None else watchman_processor.list_users(slack_con),
+                    channel_dicts if channel_dicts is not None else watchman_processor.list_channels(slack_con))
+                stream_events(search_signatures, verbose, directory=directory, event_feed=args.event_feed,
+                              app_token=auth_info.app_token, workspace_url=workspace_information.url,
+                              regex_budget=regex_budget, state_store=state_store, emit_mode=emit_mode,
+                              all_matches=args.all_matches)
+            elif daemon:
+                scheduler.Daemon(run_search, schedule, OUTPUT_LOGGER, reload=reload_config).run()
+            else:
+                run_search()
+        finally:
+            if matcher_pool:
+                matcher_pool.close()
+            if state_store:
+                state_store.close()
 
         OUTPUT_LOGGER.log('SUCCESS', f'Slack Watchman finished execution - Execution time:'
                                      f' {str(datetime.timedelta(seconds=time.time() - start_time))}')
@@ -0,0 +1,77 @@
+import threading
+import time
+from typing import Dict, Optional
+
+
+class RunBudget:
+    """ Limits on how much a single scan can do. Once the time or request budget is used up,
+    no more search pages are fetched, but everything already fetched is still matched,
+    enriched and emitted, so the scan stops cleanly with partial results.
+
+    Attributes:
+        max_duration: Maximum number of seconds the scan can run for
+        max_requests: Maximum number of Slack API requests the scan can make
+        max_findings_per_signature: Maximum number of findings emitted for each signature
+    """
+
+    def __init__(self,
+                 max_duration: float = None,
+                 max_requests: int = None,
+                 max_findings_per_signature: int = None):
+        """
+        Args:
+            max_duration: Maximum number of seconds the scan can run for
+            max_requests: Maximum number of Slack API requests the scan can make
+            max_findings_per_signature: Maximum number of findings emitted for each signature
+        """
+        self.max_duration = max_duration
+        self.max_requests = max_requests
+        self.max_findings_per_signature = max_findings_per_signature
+        self._started_at = time.monotonic()
+        self._first_request = 0
+        self._findings: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def start(self, request_count: int = 0) -> None:
+        """ Start the budget from now
+
+        Args:
+            request_count: Number of requests the Slack client had already made
+        """
+        self._started_at = time.monotonic()
+        self._first_request = request_count
+
+    def exhausted(self, request_count: int = 0) -> Optional[str]:
+        """ Whether the time or request budget has been used up
+
+        Args:
+            request_count: Number of requests the Slack client has made
+        Returns:
+            Reason the budget is used up, or None if it isn't
+        """
+
+        if self.max_duration is not None and time.monotonic() - self._started_at >= self.max_duration:
+            return f'maximum duration of {self.max_duration:g} seconds reached'
+        if self.max_requests is not None and request_count - self._first_request >= self.max_requests:
+            return f'maximum of {self.max_requests} requests reached'
+        return None
+
+    def signature_full(self, signature_id: str) -> bool:
+        """ Whether the signature has used up its findings budget """
+        return self.max_findings_per_signature is not None and \
+            self._findings.get(signature_id, 0) >= self.max_findings_per_signature
+
+    def allow_finding(self, signature_id: str) -> bool:
+        """ Count a finding against the signature's budget
+
+        Args:
+            signature_id: ID of the signature the finding is for
+        Returns:
+            True if the finding is within the budget and can be emitted
+        """
+
+        with self._lock:
+            if self.signature_full(signature_id):
+                return False
+            self._findings[signature_id] = self._findings.get(signature_id, 0) + 1
+            return True
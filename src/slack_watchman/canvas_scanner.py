@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from slack_watchman import matcher
+from slack_watchman.clients.slack_client import SlackClient
+from slack_watchman.file_content import DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE, DEFAULT_MAX_FILE_BYTES, \
+    iter_text_chunks
+from slack_watchman.loggers import JSONLogger, StdoutLogger
+from slack_watchman.models import conversation, post, signature
+from slack_watchman.models.work_unit import WorkUnit
+from slack_watchman.state import StateStore
+from slack_watchman.watchman_id import file_content_watchman_id
+from slack_watchman.watchman_processor import DirectoryCache
+
+# Watermarks for canvases are stored under this signature ID and scope, with the canvas ID as the query
+_WATERMARK_ID = 'canvas'
+CANVAS_SCOPE = 'canvases'
+
+
+@dataclass(slots=True)
+class _CanvasResult:
+    """ The matches found in a single canvas """
+    channel: conversation.Conversation | conversation.ConversationSuccinct
+    file_dict: Optional[Dict]
+    updated: Optional[float]
+    matches: List[Tuple[signature.Signature, str]]
+
+
+# pylint: disable=too-many-instance-attributes
+class CanvasScanner:
+    """ Reads the canvas of each channel and matches its content against every signature
+    with the messages scope.
+
+    Canvases are read concurrently by a pool of threads. Each canvas is looked up with
+    `files.info` through the client's rate limiter, and its content is streamed and matched
+    in overlapping chunks. When a state store is given, the `updated` time of each canvas is
+    kept as its watermark, and canvases that haven't changed since they were last read are
+    skipped after the lookup, without downloading them.
+
+    Findings are reported against a work unit for the signature that matched, with the
+    canvases scope and the channel ID as its query.
+    """
+
+    # pylint: disable=too-many-positional-arguments, too-many-arguments
+    def __init__(self,
+                 slack: SlackClient,
+                 logger: JSONLogger | StdoutLogger,
+                 verbose: bool,
+                 signatures: List[signature.Signature],
+                 on_finding: Callable[[WorkUnit, Dict], None],
+                 workspace_url: str = None,
+                 directory: DirectoryCache = None,
+                 pattern_guard: matcher.PatternGuard = None,
+                 state_store: StateStore = None,
+                 emit_mode: str = 'all',
+                 workers: int = 4,
+                 max_bytes: int = DEFAULT_MAX_FILE_BYTES,
+                 all_matches: bool = False):
+        """
+        Args:
+            slack: Slack API object
+            logger: Logging object
+            verbose: Whether to use verbose logging or not
+            signatures: Signatures to match canvases against. Only those with the messages scope are used
+            on_finding: Called with the work unit and finding for each unique finding
+            workspace_url: URL of the workspace, used to link to canvases
+            directory: Cache of users to enrich findings with
+            pattern_guard: Records the cost of each pattern and quarantines any that exceed their budget
+            state_store: Store of canvas watermarks and findings from previous runs
+            emit_mode: Which findings to output: `all` or `new`. `new` needs a state store
+            workers: Number of canvases read at once
+            max_bytes: Maximum number of bytes read from each canvas
+            all_matches: Report every distinct match in a canvas, rather than only the first match of each
+                pattern in each chunk
+        """
+        if emit_mode not in ['all', 'new']:
+            raise ValueError(f'Emit mode {emit_mode} can\'t be used when reading canvases')
+        self.slack = slack
+        self.logger = logger
+        self.verbose = verbose
+        self.signatures = [sig for sig in signatures if 'messages' in (sig.scope or [])]
+        self.on_finding = on_finding
+        self.workspace_url = workspace_url
+        self.directory = directory or DirectoryCache(slack, verbose)
+        self.pattern_guard = pattern_guard or matcher.PatternGuard()
+        self.engine = matcher.get_engine()
+        self.state_store = state_store
+        self.emit_mode = emit_mode
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.all_matches = all_matches
+        self.stats: Dict[str, int] = {'read': 0, 'unchanged': 0, 'failed': 0, 'matches': 0}
+        self._patterns = {sig.id: matcher.compile_patterns(sig.patterns, self.engine) for sig in self.signatures}
+        self._seen_ids = set()
+
+    def run(self, channels: List[conversation.Conversation | conversation.ConversationSuccinct]) -> None:
+        """ Read the canvases of the channels, blocking until every finding has been emitted
+
+        Args:
+            channels: Channels to read the canvases of. Channels without a canvas are skipped
+        """
+
+        channels = [channel for channel in channels if channel.canvas_id and not channel.canvas_empty]
+        self.logger.log('INFO', f'Reading {len(channels)} canvases using {self.workers} threads')
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._read_canvas, channel): channel for channel in channels}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.stats['failed'] += 1
+                    self.logger.log('WARNING', f'Couldn\'t read the canvas in channel {futures[future].id}: {e}')
+                    continue
+                self._emit(result)
+
+    def _unchanged(self, canvas_id: str, updated: Optional[float]) -> bool:
+        if not self.state_store or not updated:
+            return False
+        watermark = self.state_store.get_watermark(_WATERMARK_ID, canvas_id, CANVAS_SCOPE)
+        return watermark is not None and updated <= watermark
+
+    def _read_canvas(self, channel: conversation.Conversation | conversation.ConversationSuccinct) -> _CanvasResult:
+        file_dict = self.slack.get_file_info(channel.canvas_id).get('file') or {}
+        updated = float(file_dict.get('updated') or file_dict.get('created') or 0) or None
+        if self._unchanged(channel.canvas_id, updated):
+            return _CanvasResult(channel=channel, file_dict=None, updated=updated, matches=[])
+
+        url = file_dict.get('url_private_download') or file_dict.get('url_private')
+        matches = []
+        if url:
+            data = self.slack.iter_file_content(url, DEFAULT_CHUNK_SIZE)
+            try:
+                for chunk in iter_text_chunks(data, DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP, self.max_bytes):
+                    # Matches within the overlap between chunks are found twice
+                    matches.extend(match for match in self._match_chunk(chunk) if match not in matches)
+            finally:
+                data.close()
+        return _CanvasResult(channel=channel, file_dict=file_dict, updated=updated, matches=matches)
+
+    def _match_chunk(self, chunk: str) -> List[Tuple[signature.Signature, str]]:
+        matches = []
+        for sig in self.signatures:
+            for _, match_string in matcher.match_texts(
+                    self._patterns[sig.id], [chunk], self.pattern_guard, sig.id, self.engine, self.all_matches):
+                matches.append((sig, match_string))
+        return matches
+
+    def _canvas_url(self, channel_id: str) -> Optional[str]:
+        return f'{self.workspace_url.rstrip("/")}/canvas/{channel_id}' if self.workspace_url else None
+
+    def _emit(self, result: _CanvasResult) -> None:
+        channel = result.channel
+        if result.file_dict is None:
+            self.stats['unchanged'] += 1
+            return
+        self.stats['read'] += 1
+
+        file_object, creator = None, None
+        for sig, match_string in result.matches:
+            watchman_id = file_content_watchman_id(match_string, channel.canvas_id)
+            if watchman_id in self._seen_ids:
+                continue
+            self._seen_ids.add(watchman_id)
+            if file_object is None:
+                # Only looked up once the canvas has a finding
+                if result.file_dict.get('user'):
+                    creator = self.directory.get_user(result.file_dict.get('user'))
+                file_object = post.create_file_from_dict({**result.file_dict, 'user': creator})
+            unit = WorkUnit(signature=sig, scope=CANVAS_SCOPE, query=channel.id)
+            self._emit_finding(unit, {
+                'match_string': match_string,
+                'file': file_object,
+                'user': creator,
+                'channel_name': channel.name,
+                'canvas_url': self._canvas_url(channel.id),
+                'watchman_id': watchman_id
+            }, result.updated)
+
+        if self.state_store and result.updated:
+            # Only moved on once the findings have been emitted, so a failed run reads the canvas again
+            self.state_store.set_watermark(_WATERMARK_ID, channel.canvas_id, CANVAS_SCOPE, result.updated)
+
+    def _emit_finding(self, unit: WorkUnit, finding: Dict[str, Any], posted_at: Optional[float]) -> None:
+        self.stats['matches'] += 1
+        is_new = True
+        if self.state_store:
+            is_new = self.state_store.record_finding(
+                watchman_id=finding.get('watchman_id'),
+                signature_id=unit.signature.id,
+                signature_name=unit.signature.name,
+                severity=unit.signature.severity,
+                scope=unit.state_scope,
+                posted_at=posted_at)
+        if self.emit_mode == 'all' or is_new:
+            self.on_finding(unit, finding)
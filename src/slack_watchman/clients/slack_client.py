@@ -1,8 +1,9 @@
 import json
 import re
+import threading
 import time
 import urllib.parse
-from typing import List, Dict
+from typing import List, Dict, Iterator
 
 import requests
 from requests.adapters import HTTPAdapter
@@ -10,28 +11,50 @@ from requests.exceptions import HTTPError
 from urllib3.util import Retry
 
 from slack_watchman import exceptions
+from slack_watchman.rate_limiter import RateLimiter
 
 
+def get_timestamp(item: Dict) -> float:
+    """ Get the epoch timestamp of a message or file returned by the Slack API
+
+    Args:
+        item: Message or file dict
+    Returns:
+        Epoch timestamp, or 0 if the item doesn't have one
+    """
+
+    return float(item.get('ts') or item.get('timestamp') or item.get('created') or 0)
+
+
+# pylint: disable=too-many-instance-attributes
 class SlackClient:
     """ Class to interact with the Slack API
 
+    Requests are made through a rate limiter, which can be shared by clients, so
+    concurrent searches stay within Slack's rate limits.
+
     Attributes:
         token: Slack API token
         cookie: Slack API cookie
         url: Slack workspace URL
+        rate_limiter: Rate limiter requests are made through
     """
 
     def __init__(self,
                  token: str = None,
                  cookie: str = None,
-                 url: str = None):
+                 url: str = None,
+                 rate_limiter: RateLimiter = None):
         self.token = token
+        self.rate_limiter = rate_limiter or RateLimiter()
         self.session_token = None
         self.url = url
         self.base_url = 'https://slack.com/api'
         self.count = 100
         self.limit = 100
         self.pretty = 1
+        self._request_count = 0
+        self._request_count_lock = threading.Lock()
         self.user_agent = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5)\
                                         AppleWebKit/537.36 (KHTML, like Gecko) Cafari/537.36'
         if cookie:
@@ -73,8 +96,16 @@ class SlackClient:
         except (re.error, IndexError, TypeError) as e:
             raise exceptions.InvalidCookieError(self.url) from e
 
+    @property
+    def request_count(self) -> int:
+        """ Number of requests made to the Slack API by this client """
+        return self._request_count
+
     # pylint: disable=too-many-positional-arguments
     def _make_request(self, url, params=None, data=None, method='GET', verify_ssl=True):
+        with self._request_count_lock:
+            self._request_count += 1
+        self.rate_limiter.acquire(url, (params or {}).get('team_id'))
         try:
             relative_url = '/'.join((self.base_url, url))
             response = self.session.request(
@@ -111,12 +142,14 @@ class SlackClient:
         except Exception as e:
             raise e
 
-    def _get_pages(self, url, scope, params):
+    def _get_pages(self, url, scope, params, start_page=1):
+        if start_page > 1:
+            params['page'] = str(start_page)
         first_page = self._make_request(url, params).json()
         yield first_page
         num_pages = first_page.get(scope).get('pagination').get('page_count')
 
-        for page in range(2, num_pages + 1):
+        for page in range(start_page + 1, num_pages + 1):
             params['page'] = str(page)
             next_page = self._make_request(url, params=params).json()
             yield next_page
@@ -138,17 +171,161 @@ class SlackClient:
         """
 
         results = []
+        for page in self.iter_page_api_search(query, url, scope, timeframe):
+            results.extend(page)
+
+        return results
+
+    # pylint: disable=too-many-positional-arguments
+    def iter_page_api_search(self,
+                             query: str,
+                             url: str,
+                             scope: str,
+                             timeframe: str or int,
+                             sort: str = None,
+                             oldest: float = None,
+                             start_page: int = 1,
+                             team_id: str = None) -> Iterator[List[Dict]]:
+        """ Wrapper for Slack API methods that use page number based pagination, which
+        yields the matches from each page as soon as it has been fetched
+
+        Args:
+            query: Search to carry out in Slack API
+            url: API endpoint to use
+            scope: What to search for, e.g. files or messages
+            timeframe: How far back to search
+            sort: Field to sort results by, e.g. timestamp. Results are sorted newest first
+            oldest: Epoch timestamp to stop at. Matches at or before this are dropped, and if
+                results are sorted by timestamp no further pages are fetched once it is reached
+            start_page: Page number to start from, e.g. to carry on from an interrupted search
+            team_id: ID of the workspace to search, when using an Enterprise Grid organisation token
+        Returns:
+            Iterator of lists of dict objects, one list per page of responses starting from
+            `start_page`, so the position of a list gives its page number
+        """
+
         params = {
             'query': f'after:{timeframe} {query}',
             'pretty': self.pretty,
             'count': self.count
         }
+        if sort:
+            params['sort'] = sort
+            params['sort_dir'] = 'desc'
+        if team_id:
+            params['team_id'] = team_id
+
+        for page in self._get_pages(url, scope, params, start_page):
+            matches = page.get(scope).get('matches')
+            if oldest is None:
+                yield matches
+                continue
+
+            newer = [match for match in matches if get_timestamp(match) > oldest]
+            yield newer
+            if sort == 'timestamp' and len(newer) < len(matches):
+                return
+
+    def get_search_total(self,
+                         query: str,
+                         url: str,
+                         scope: str,
+                         timeframe: str or int,
+                         team_id: str = None) -> int:
+        """ Get the total number of results for a search, using a single request for one result
 
-        for page in self._get_pages(url, scope, params):
-            for value in page.get(scope).get('matches'):
-                results.append(value)
+        Args:
+            query: Search to carry out in Slack API
+            url: API endpoint to use
+            scope: What to search for, e.g. files or messages
+            timeframe: How far back to search
+            team_id: ID of the workspace to search, when using an Enterprise Grid organisation token
+        Returns:
+            Total number of results the search would return
+        """
 
-        return results
+        params = {
+            'query': f'after:{timeframe} {query}',
+            'pretty': self.pretty,
+            'count': 1
+        }
+        if team_id:
+            params['team_id'] = team_id
+        results = self._make_request(url, params=params).json().get(scope, {})
+        return int(results.get('pagination', {}).get('total_count', results.get('total', 0)))
+
+    def iter_conversation_history(self,
+                                  channel_id: str,
+                                  oldest: float = None,
+                                  latest: float = None,
+                                  team_id: str = None) -> Iterator[List[Dict]]:
+        """ Page through the messages posted in a conversation, newest first, yielding
+        each page as soon as it has been fetched
+
+        Args:
+            channel_id: ID of the conversation
+            oldest: Only include messages posted after this epoch timestamp
+            latest: Only include messages posted before this epoch timestamp
+            team_id: ID of the workspace the conversation is in, when using an Enterprise Grid organisation token
+        Returns:
+            Iterator of lists of message dicts, one list per page
+        """
+
+        params = {
+            'channel': channel_id,
+            'limit': 200
+        }
+        if oldest:
+            params['oldest'] = str(oldest)
+        if latest:
+            params['latest'] = str(latest)
+        if team_id:
+            params['team_id'] = team_id
+
+        yield from self._iter_message_pages('conversations.history', params)
+
+    # pylint: disable=too-many-positional-arguments
+    def iter_conversation_replies(self,
+                                  channel_id: str,
+                                  thread_ts: str,
+                                  oldest: float = None,
+                                  latest: float = None,
+                                  team_id: str = None) -> Iterator[List[Dict]]:
+        """ Page through the replies in a thread, yielding each page as soon as it has been fetched.
+        The first page starts with the message the thread is on
+
+        Args:
+            channel_id: ID of the conversation the thread is in
+            thread_ts: Timestamp of the message the thread is on
+            oldest: Only include replies posted after this epoch timestamp
+            latest: Only include replies posted before this epoch timestamp
+            team_id: ID of the workspace the conversation is in, when using an Enterprise Grid organisation token
+        Returns:
+            Iterator of lists of message dicts, one list per page
+        """
+
+        params = {
+            'channel': channel_id,
+            'ts': thread_ts,
+            'limit': 200
+        }
+        if oldest:
+            params['oldest'] = str(oldest)
+        if latest:
+            params['latest'] = str(latest)
+        if team_id:
+            params['team_id'] = team_id
+
+        yield from self._iter_message_pages('conversations.replies', params)
+
+    def _iter_message_pages(self, url: str, params: Dict) -> Iterator[List[Dict]]:
+        while True:
+            response = self._make_request(url, params=params).json()
+            yield response.get('messages', [])
+            cursor = (response.get('response_metadata') or {}).get('next_cursor')
+            if not response.get('has_more') or not cursor:
+                return
+            params['cursor'] = cursor
 
     def cursor_api_search(self, url: str, scope: str) -> List[Dict]:
         """ Wrapper for Slack API methods that use cursor based pagination
@@ -214,15 +391,71 @@ class SlackClient:
 
         return self._make_request('conversations.info', params=params).json()
 
-    def get_workspace_info(self) -> str or None:
+    def get_workspace_info(self, team_id: str = None) -> str or None:
         """ Returns the information of the workspace the token is associated with
 
+        Args:
+            team_id: ID of the workspace to return instead, when using an Enterprise Grid organisation token
         Returns:
             JSON object with workspace information
         """
 
+        if team_id:
+            return self._make_request('team.info', params={'team': team_id}).json()
         return self._make_request('team.info').json()
 
+    def get_teams(self) -> List[Dict]:
+        """ Returns the workspaces an Enterprise Grid organisation token has been granted access to
+
+        Returns:
+            List of dict objects with the ID and name of each workspace
+        """
+
+        return self.cursor_api_search('auth.teams.list', 'teams')
+
+    def open_socket_connection(self) -> str:
+        """ Get a WebSocket URL to receive events over Socket Mode. The client must use an
+        app-level token with the connections:write scope
+
+        Returns:
+            WebSocket URL, valid for a single connection
+        """
+
+        return self._make_request('apps.connections.open', method='POST').json().get('url')
+
+    def get_file_info(self, file_id: str) -> json:
+        """ Get the details of a file, including canvases
+
+        Args:
+            file_id: ID of the file to return
+        Returns:
+            JSON object with file information
+        """
+
+        params = {
+            'file': file_id
+        }
+
+        return self._make_request('files.info', params=params).json()
+
+    def iter_file_content(self, url: str, chunk_size: int = 65536) -> Iterator[bytes]:
+        """ Download a file from its private download URL, yielding the content in chunks
+        as it arrives rather than holding the whole file in memory. Downloads aren't Web
+        API methods, so they aren't rate limited. The download stops when the iterator is closed
+
+        Args:
+            url: The file's `url_private_download` URL
+            chunk_size: Maximum number of bytes in each chunk
+        Returns:
+            Iterator of chunks of bytes
+        """
+
+        with self._request_count_lock:
+            self._request_count += 1
+        with self.session.get(url, cookies=self.cookie_dict, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size=chunk_size)
+
     def get_auth_test(self) -> str or None:
         """ Carries out an auth test against the calling token, and replies with
         user information
@@ -87,3 +87,13 @@ class SlackAPIRateLimit(Exception):
     def __init__(self):
         self.message = 'Slack API rate limit reached - cooling off'
         super().__init__(self.message)
+
+
+class ArchiveLimitError(Exception):
+    """ Exception raised when decompressing an archive goes over one of its limits
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.message = f'Archive limit reached: {self.limit}'
+        super().__init__(self.message)
@@ -0,0 +1,265 @@
+import json
+import multiprocessing
+import os
+import re
+import zipfile
+import zlib
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+from slack_watchman import matcher
+from slack_watchman.clients.slack_client import get_timestamp
+from slack_watchman.loggers import JSONLogger, StdoutLogger
+from slack_watchman.message_text import flatten_message
+from slack_watchman.models import conversation, post, signature, user
+from slack_watchman.models.work_unit import WorkUnit
+from slack_watchman.state import StateStore
+from slack_watchman.watchman_id import message_watchman_id
+
+# Daily message files in an export are stored as <conversation>/<YYYY-MM-DD>.json
+_MEMBER_PATTERN = re.compile(r'^(?:.*/)?([^/]+)/(\d{4}-\d{2}-\d{2})\.json$')
+
+# Files in the root of an export listing each type of conversation
+CONVERSATION_FILES = ['channels.json', 'groups.json', 'mpims.json', 'dms.json']
+
+# Errors raised reading a daily file that is corrupt, or isn't a JSON list of messages
+_MEMBER_ERRORS = (ValueError, TypeError, OSError, EOFError, zipfile.BadZipFile, zlib.error)
+
+# Archive opened once in each pool worker process by _init_export_worker
+_WORKER_ARCHIVE: Dict[str, zipfile.ZipFile] = {}
+
+
+def _init_export_worker(path: str,
+                        patterns_by_signature: Dict[str, List[str]],
+                        budget: float,
+                        engine_name: str) -> None:
+    matcher.init_worker(patterns_by_signature, budget, engine_name)
+    _WORKER_ARCHIVE['archive'] = zipfile.ZipFile(path)  # pylint: disable=consider-using-with
+
+
+def _scan_member(member: str,
+                 quarantined: Dict[str, List[str]],
+                 all_matches: bool = False) -> Tuple[List[Tuple[str, Dict, str, str]],
+                                                     List[matcher.PatternCost], int]:
+    # Only one daily file is held in memory at a time, and only the matching messages are sent back
+    with _WORKER_ARCHIVE['archive'].open(member) as member_file:
+        messages = json.load(member_file)
+    messages = [message for message in messages if isinstance(message, dict)]
+    # Flattened once, and matched against every signature
+    flat_texts = [flatten_message(message) for message in messages]
+    texts = [flat_text.text for flat_text in flat_texts]
+
+    state = matcher.worker_state()
+    guard = matcher.PatternGuard(state.get('budget'))
+    matches = []
+    for signature_id, patterns in state.get('patterns', {}).items():
+        for pattern in quarantined.get(signature_id, []):
+            guard.record(signature_id, pattern, 0.0, calls=0, quarantined=True)
+        for index, match_string in matcher.match_texts(patterns, texts, guard, signature_id, state.get('engine'),
+                                                       all_matches):
+            matches.append((signature_id, messages[index], match_string, flat_texts[index].locate_match(match_string)))
+    return matches, [cost for cost in guard.costs.values() if cost.calls], len(messages)
+
+
+def list_export_members(archive: zipfile.ZipFile, after: str = None) -> List[Tuple[str, str]]:
+    """ List the daily message files in a Slack export
+
+    Args:
+        archive: The opened export ZIP file
+        after: Only list files for days on or after this date, as YYYY-MM-DD
+    Returns:
+        List of (member name, conversation directory name) tuples
+    """
+
+    members = []
+    for name in archive.namelist():
+        match = _MEMBER_PATTERN.match(name)
+        if match and (not after or match.group(2) >= after):
+            members.append((name, match.group(1)))
+    return members
+
+
+# pylint: disable=too-many-instance-attributes
+class ExportScanner:
+    """ Scans a Slack export ZIP file offline, without a token, matching every message
+    against every signature with the messages scope.
+
+    Nothing is extracted to disk. The daily message files are spread across a pool of
+    processes, each of which opens the archive once and reads one file at a time straight
+    from it, so memory use is set by the size of a single day in a single conversation
+    rather than the size of the export. Only a bounded number of files are queued to the
+    pool at once, and only matching messages are sent back.
+
+    Findings use the same `watchman_id` and finding schema as a scan using the API, and are
+    reported against a work unit for the signature that matched, with the conversation
+    name as its query. Users and conversations are enriched from the lists in the export.
+    """
+
+    # pylint: disable=too-many-positional-arguments, too-many-arguments
+    def __init__(self,
+                 path: str,
+                 logger: JSONLogger | StdoutLogger,
+                 verbose: bool,
+                 signatures: List[signature.Signature],
+                 on_finding: Callable[[WorkUnit, Dict], None],
+                 timeframe: str = None,
+                 processes: int = None,
+                 pattern_guard: matcher.PatternGuard = None,
+                 engine: matcher.StdlibEngine | matcher.RegexModuleEngine = None,
+                 state_store: StateStore = None,
+                 emit_mode: str = 'all',
+                 all_matches: bool = False):
+        """
+        Args:
+            path: Path to the export ZIP file
+            logger: Logging object
+            verbose: Whether to use verbose logging or not
+            signatures: Signatures to match messages against. Only those with the messages scope are used
+            on_finding: Called with the work unit and finding for each unique finding
+            timeframe: Only scan days on or after this date, as YYYY-MM-DD
+            processes: Number of processes in the pool. Defaults to the number of CPU cores
+            pattern_guard: Records the cost of each pattern and quarantines any that exceed their budget
+            engine: RegEx engine to match with. Defaults to the result of get_engine()
+            state_store: Store of findings from previous runs
+            emit_mode: Which findings to output: `all` or `new`. `new` needs a state store
+            all_matches: Report every distinct match in a message, rather than only the first match of each pattern
+        """
+        if emit_mode not in ['all', 'new']:
+            raise ValueError(f'Emit mode {emit_mode} can\'t be used when scanning an export')
+        self.path = path
+        self.logger = logger
+        self.verbose = verbose
+        self.signatures = {sig.id: sig for sig in signatures if 'messages' in (sig.scope or [])}
+        self.on_finding = on_finding
+        self.timeframe = timeframe
+        self.processes = processes or os.cpu_count() or 1
+        self.pattern_guard = pattern_guard or matcher.PatternGuard()
+        self.engine = engine or matcher.get_engine()
+        self.state_store = state_store
+        self.emit_mode = emit_mode
+        self.all_matches = all_matches
+        self.stats: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self.files_read = 0
+        self.messages_read = 0
+        self.seen_ids: Set[str] = set()
+        self._users: Dict[str, Dict] = {}
+        self._conversations: Dict[str, Dict] = {}
+        self._user_cache: Dict[str, user.User | user.UserSuccinct] = {}
+        self._conversation_cache: Dict[str, conversation.Conversation | conversation.ConversationSuccinct] = {}
+
+    def _load_json(self, archive: zipfile.ZipFile, name: str) -> List[Dict]:
+        match = next((info for info in archive.infolist() if os.path.basename(info.filename) == name), None)
+        if match is None:
+            return []
+        with archive.open(match) as member_file:
+            return json.load(member_file)
+
+    def _load_directory(self, archive: zipfile.ZipFile) -> None:
+        self._users = {u.get('id'): u for u in self._load_json(archive, 'users.json')}
+        for file_name in CONVERSATION_FILES:
+            for conv in self._load_json(archive, file_name):
+                # Public channels are stored under their name, other conversations under their ID
+                self._conversations[conv.get('id')] = conv
+                if conv.get('name'):
+                    self._conversations[conv.get('name')] = conv
+
+    def _get_user(self, user_id: str) -> user.User | user.UserSuccinct | str:
+        if user_id not in self._users:
+            return user_id
+        if user_id not in self._user_cache:
+            self._user_cache[user_id] = user.create_from_dict(self._users[user_id], self.verbose)
+        return self._user_cache[user_id]
+
+    def _get_conversation(self, name: str) -> conversation.Conversation | conversation.ConversationSuccinct:
+        if name not in self._conversation_cache:
+            # Partial exports can leave out the list a conversation is in, so only its directory name is known
+            conv_dict = self._conversations.get(name) or {'name': name}
+            self._conversation_cache[name] = conversation.create_from_dict(conv_dict, self.verbose)
+        return self._conversation_cache[name]
+
+    def run(self) -> None:
+        """ Scan the export, blocking until every daily file has been matched """
+
+        with zipfile.ZipFile(self.path) as archive:
+            self._load_directory(archive)
+            members = list_export_members(archive, self.timeframe)
+        self.logger.log('INFO', f'Scanning {len(members)} daily message files from export {self.path} '
+                                f'using {self.processes} processes')
+        if not members or not self.signatures:
+            return
+
+        patterns_by_signature = {sig.id: list(sig.patterns or []) for sig in self.signatures.values()}
+        # Enough files are queued to keep every process busy, without reading ahead through the whole export
+        max_in_flight = self.processes * 4
+        in_flight: Dict[Future, Tuple[str, str]] = {}
+        with ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_export_worker,
+                initargs=(self.path, patterns_by_signature, self.pattern_guard.budget, self.engine.name)) as executor:
+            for member, conversation_name in members:
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._collect(future, *in_flight.pop(future))
+                quarantined = {signature_id: self.pattern_guard.quarantined_patterns(signature_id)
+                               for signature_id in self.signatures}
+                in_flight[executor.submit(_scan_member, member, quarantined, self.all_matches)] = (
+                    member, conversation_name)
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._collect(future, *in_flight.pop(future))
+
+    def _collect(self, future: Future, member: str, conversation_name: str) -> None:
+        try:
+            matches, costs, message_count = future.result()
+        except _MEMBER_ERRORS as e:
+            # One corrupt daily file shouldn't stop the rest of the export being scanned
+            self.logger.log('WARNING', f'Couldn\'t read {member} from export {self.path}: {e}')
+            return
+        self.pattern_guard.merge(costs)
+        self.files_read += 1
+        self.messages_read += message_count
+        # Every message in the file was matched against every signature
+        for signature_id in self.signatures:
+            self.stats.setdefault((signature_id, 'messages'),
+                                  {'potential_matches': 0, 'matches': 0})['potential_matches'] += message_count
+        # Each message is only enriched once, however many matches it has
+        enriched: Dict[str, post.Message] = {}
+        for signature_id, message, match_string, match_location in matches:
+            sig = self.signatures[signature_id]
+            watchman_id = message_watchman_id(match_string, message.get('ts'))
+            if watchman_id in self.seen_ids:
+                continue
+            self.seen_ids.add(watchman_id)
+            if message.get('ts') not in enriched:
+                enriched[message.get('ts')] = self._enrich_message(message, conversation_name)
+            self._emit(WorkUnit(signature=sig, scope='messages', query=conversation_name), {
+                'match_string': match_string,
+                'match_location': match_location,
+                'message': enriched[message.get('ts')],
+                'watchman_id': watchman_id
+            }, get_timestamp(message))
+
+    def _enrich_message(self, message: Dict[str, Any], conversation_name: str) -> post.Message:
+        u = self._get_user(message.get('user')) if message.get('user') else message.get('username')
+        return post.create_message_from_dict({
+            **message,
+            'user': u,
+            'conversation': self._get_conversation(conversation_name)
+        })
+
+    def _emit(self, unit: WorkUnit, finding: Dict, posted_at: float) -> None:
+        self.stats[(unit.signature.id, 'messages')]['matches'] += 1
+        is_new = True
+        if self.state_store:
+            is_new = self.state_store.record_finding(
+                watchman_id=finding.get('watchman_id'),
+                signature_id=unit.signature.id,
+                signature_name=unit.signature.name,
+                severity=unit.signature.severity,
+                scope=unit.state_scope,
+                posted_at=posted_at or None)
+        if self.emit_mode == 'all' or is_new:
+            self.on_finding(unit, finding)
@@ -0,0 +1,404 @@
+import codecs
+import gzip
+import itertools
+import os
+import tarfile
+import tempfile
+import zipfile
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from slack_watchman import matcher
+from slack_watchman.clients.slack_client import SlackClient
+from slack_watchman.exceptions import ArchiveLimitError
+
+# Slack filetypes whose content is text that can be matched against signature patterns
+TEXT_FILETYPES = {
+    'text', 'csv', 'tsv', 'json', 'yaml', 'xml', 'html', 'markdown', 'ini', 'properties', 'config',
+    'env', 'log', 'sql', 'diff', 'shell', 'powershell', 'bat', 'python', 'javascript', 'typescript',
+    'java', 'kotlin', 'go', 'ruby', 'php', 'perl', 'rust', 'c', 'cpp', 'csharp', 'swift', 'scala',
+    'groovy', 'terraform', 'dockerfile', 'toml', 'plain'
+}
+
+# Maximum size of file to download, in bytes
+DEFAULT_MAX_FILE_BYTES = 10 * 1024 * 1024
+
+# Number of characters matched at once
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Number of characters from the end of each chunk that are matched again at the start of the next,
+# so a match that crosses the boundary is still found. Should be longer than the longest match expected
+DEFAULT_CHUNK_OVERLAP = 1024
+
+# Number of bytes read from an archive member at a time while decompressing
+_READ_SIZE = 64 * 1024
+
+# Errors raised when an archive is corrupt or isn't the type its name suggests
+_ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, gzip.BadGzipFile, zlib.error, EOFError)
+
+
+@dataclass(slots=True)
+class ArchiveLimits:
+    """ Limits on decompressing an archive, so a small upload such as a zip bomb
+    can't expand into more data than a scan can handle
+
+    Attributes:
+        max_total_bytes: Maximum number of bytes decompressed from all members
+        max_members: Maximum number of members read
+        max_ratio: Maximum ratio of bytes decompressed to the size of the archive
+    """
+
+    max_total_bytes: int = 100 * 1024 * 1024
+    max_members: int = 1000
+    max_ratio: float = 100.0
+
+
+def is_text_file(file_dict: Dict) -> bool:
+    """ Whether a file's content is text that can be matched, based on its Slack filetype or mimetype
+
+    Args:
+        file_dict: File dict returned by the Slack API
+    Returns:
+        True if the file is text
+    """
+
+    return (file_dict.get('filetype') or '').lower() in TEXT_FILETYPES or \
+        (file_dict.get('mimetype') or '').lower().startswith('text/')
+
+
+def archive_type(file_name: str) -> Optional[str]:
+    """ The type of archive a file is, based on its name
+
+    Args:
+        file_name: Name of the file
+    Returns:
+        `tar.gz`, `zip` or `gz`, or None if the file isn't an archive that can be read
+    """
+
+    name = (file_name or '').lower()
+    if name.endswith(('.tar.gz', '.tgz')):
+        return 'tar.gz'
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith('.gz'):
+        return 'gz'
+    return None
+
+
+def iter_text_chunks(data: Iterable[bytes],
+                     chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     overlap: int = DEFAULT_CHUNK_OVERLAP,
+                     max_bytes: int = None) -> Iterator[str]:
+    """ Decode a stream of bytes as UTF-8 into overlapping chunks of text. Bytes are decoded
+    incrementally, so a character split between two pieces of data is decoded correctly, and
+    only about one chunk is held in memory at a time.
+
+    Each chunk starts with the last `overlap` characters of the previous chunk, so a match up
+    to that long which crosses the boundary is found in one of the chunks. A match that falls
+    within the overlap is found in both, so matches should be deduplicated.
+
+    Args:
+        data: Iterable of bytes, e.g. from a streamed download
+        chunk_size: Number of new characters in each chunk
+        overlap: Number of characters carried over from the previous chunk
+        max_bytes: Stop reading once this many bytes have been read
+    Returns:
+        Iterator of chunks of text
+    """
+
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    buffer = ''
+    tail = ''
+    read = 0
+    for piece in data:
+        if max_bytes is not None:
+            piece = piece[:max_bytes - read]
+        read += len(piece)
+        buffer += decoder.decode(piece)
+        while len(buffer) >= chunk_size:
+            chunk = tail + buffer[:chunk_size]
+            yield chunk
+            tail = chunk[-overlap:] if overlap else ''
+            buffer = buffer[chunk_size:]
+        if max_bytes is not None and read >= max_bytes:
+            break
+    buffer += decoder.decode(b'', final=True)
+    if buffer:
+        yield tail + buffer
+
+
+class _DecompressionCounter:
+    """ Counts the members and bytes decompressed from an archive, raising ArchiveLimitError
+    as soon as one of the limits is reached """
+
+    def __init__(self, limits: ArchiveLimits, archive_size: int):
+        self.limits = limits
+        self.archive_size = max(archive_size, 1)
+        self.members = 0
+        self.total_bytes = 0
+
+    def add_member(self) -> None:
+        """ Count a member about to be read """
+        self.members += 1
+        if self.members > self.limits.max_members:
+            raise ArchiveLimitError(f'more than {self.limits.max_members} members')
+
+    def read(self, member_file: IO[bytes]) -> Iterator[bytes]:
+        """ Read a member in pieces, counting the bytes decompressed """
+        while data := member_file.read(_READ_SIZE):
+            self.total_bytes += len(data)
+            if self.total_bytes > self.limits.max_total_bytes:
+                raise ArchiveLimitError(f'more than {self.limits.max_total_bytes} bytes decompressed')
+            if self.total_bytes > self.limits.max_ratio * self.archive_size:
+                raise ArchiveLimitError(f'compression ratio over {self.limits.max_ratio:g}')
+            yield data
+
+
+def iter_archive_members(path: str, file_name: str, limits: ArchiveLimits) -> Iterator[Tuple[str, Iterator[bytes]]]:
+    """ Stream the members of a `.zip`, `.tar.gz` or `.gz` archive, decompressing them as
+    they are read. Each member must be read, or skipped, before moving on to the next. Bytes
+    of a `.tar.gz` member that are skipped are still decompressed, and count towards the limits
+
+    Args:
+        path: Path to the archive
+        file_name: Name of the file, used to tell what type of archive it is
+        limits: Limits on the members and bytes decompressed
+    Returns:
+        Iterator of (member name, iterator of decompressed bytes) tuples
+    Raises:
+        ArchiveLimitError: As soon as one of the limits is reached
+    """
+
+    kind = archive_type(file_name)
+    counter = _DecompressionCounter(limits, os.path.getsize(path))
+    if kind == 'gz':
+        with gzip.open(path, 'rb') as member_file:
+            counter.add_member()
+            yield file_name[:-3], counter.read(member_file)
+    elif kind == 'tar.gz':
+        # Stream mode reads the archive in order, without seeking back
+        with tarfile.open(path, mode='r|gz') as archive:
+            for member in archive:
+                if member.isfile():
+                    counter.add_member()
+                    data = counter.read(archive.extractfile(member))
+                    yield member.name, data
+                    # The stream has to be decompressed past a member to reach the next header, even if
+                    # the member was skipped, so whatever wasn't read still counts towards the limits
+                    for _ in data:
+                        pass
+    elif kind == 'zip':
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    counter.add_member()
+                    with archive.open(info) as member_file:
+                        yield info.filename, counter.read(member_file)
+
+
+# pylint: disable=too-many-positional-arguments, too-many-arguments
+def scan_archive(path: str,
+                 file_name: str,
+                 limits: ArchiveLimits,
+                 chunk_size: int,
+                 overlap: int,
+                 patterns: List[Tuple[str, Any]],
+                 guard: matcher.PatternGuard = None,
+                 signature_id: str = None,
+                 engine: matcher.StdlibEngine | matcher.RegexModuleEngine = None,
+                 all_matches: bool = False) -> Tuple[List[str], Optional[str]]:
+    """ Match the text members of an archive against a signature's patterns. Members are
+    decompressed and matched in overlapping chunks, and binary members are skipped
+
+    Args:
+        path: Path to the archive
+        file_name: Name of the file, used to tell what type of archive it is
+        limits: Limits on the members and bytes decompressed
+        chunk_size: Number of characters matched at once
+        overlap: Number of characters matched again at the start of each chunk
+        patterns: (pattern, compiled pattern) tuples to match with
+        guard: Records the cost of each pattern and enforces the time budget
+        signature_id: ID of the signature the patterns belong to
+        engine: RegEx engine the patterns were compiled with
+        all_matches: Find every distinct match of each pattern in a chunk, rather than only the first
+    Returns:
+        Tuple of the distinct match strings, and why the archive wasn't read to the end, or None if it was
+    """
+
+    return _ArchiveScan(chunk_size, overlap, patterns, guard, signature_id, engine, all_matches).run(
+        path, file_name, limits)
+
+
+@dataclass(slots=True)
+class _ArchiveScan:
+    """ Matches the text members of an archive against a signature's patterns """
+    chunk_size: int
+    overlap: int
+    patterns: List[Tuple[str, Any]]
+    guard: matcher.PatternGuard = None
+    signature_id: str = None
+    engine: matcher.StdlibEngine | matcher.RegexModuleEngine = None
+    all_matches: bool = False
+
+    def run(self, path: str, file_name: str, limits: ArchiveLimits) -> Tuple[List[str], Optional[str]]:
+        """ Match every text member of the archive, stopping at the first limit reached """
+        match_strings = []
+        try:
+            for _, data in iter_archive_members(path, file_name, limits):
+                for match_string in self._match_member(data):
+                    if match_string not in match_strings:
+                        match_strings.append(match_string)
+        except ArchiveLimitError as e:
+            return match_strings, e.limit
+        except _ARCHIVE_ERRORS as e:
+            return match_strings, f'invalid archive: {e}'
+        return match_strings, None
+
+    def _match_member(self, data: Iterator[bytes]) -> Iterator[str]:
+        first = next(data, b'')
+        if b'\0' in first:
+            return
+        for chunk in iter_text_chunks(itertools.chain([first], data), self.chunk_size, self.overlap):
+            for _, match_string in matcher.match_texts(self.patterns, [chunk], self.guard, self.signature_id,
+                                                       self.engine, self.all_matches):
+                yield match_string
+
+
+# pylint: disable=too-many-positional-arguments, too-many-arguments
+def _scan_archive_in_worker(signature_id: str,
+                            quarantined: List[str],
+                            path: str,
+                            file_name: str,
+                            limits: ArchiveLimits,
+                            chunk_size: int,
+                            overlap: int,
+                            all_matches: bool = False) -> Tuple[List[str], Optional[str], List[matcher.PatternCost]]:
+    state = matcher.worker_state()
+    guard = matcher.PatternGuard(state.get('budget'))
+    for pattern in quarantined:
+        guard.record(signature_id, pattern, 0.0, calls=0, quarantined=True)
+    match_strings, stopped = scan_archive(
+        path, file_name, limits, chunk_size, overlap,
+        state.get('patterns', {}).get(signature_id, []), guard, signature_id, state.get('engine'), all_matches)
+    return match_strings, stopped, [cost for cost in guard.costs.values() if cost.calls]
+
+
+class FileContentReader:
+    """ Downloads the content of files found by a search, so it can be matched against
+    the signature patterns. Text files are streamed and decoded in overlapping chunks, and
+    never held whole in memory. Files that aren't text, or are larger than the size cap, are skipped.
+
+    When archive limits are given, `.zip`, `.tar.gz` and `.gz` files are read too. An archive
+    is streamed to a temporary file, as a zip file can only be read from its end, and then
+    its members are decompressed and matched as they are read, within the limits. If a matcher
+    pool is given, decompression and matching run in one of its processes, so they don't hold
+    up the threads downloading files.
+    """
+
+    # pylint: disable=too-many-positional-arguments, too-many-arguments
+    def __init__(self,
+                 slack: SlackClient,
+                 max_bytes: int = DEFAULT_MAX_FILE_BYTES,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 overlap: int = DEFAULT_CHUNK_OVERLAP,
+                 archive_limits: ArchiveLimits = None):
+        """
+        Args:
+            slack: Slack API object used to download the files
+            max_bytes: Files larger than this are skipped. For archives this is the compressed size
+            chunk_size: Number of characters matched at once
+            overlap: Number of characters matched again at the start of each chunk
+            archive_limits: Limits on decompressing archives. Archives aren't read if not given
+        """
+        self.slack = slack
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.archive_limits = archive_limits
+
+    def is_archive(self, file_dict: Dict) -> bool:
+        """ Whether a file is an archive that will be read """
+        return self.archive_limits is not None and archive_type(file_dict.get('name')) is not None
+
+    def should_read(self, file_dict: Dict) -> bool:
+        """ Whether a file is text or an archive, within the size cap, and can be downloaded """
+        return bool(file_dict.get('url_private_download')) and \
+            (is_text_file(file_dict) or self.is_archive(file_dict)) and \
+            (file_dict.get('size') or 0) <= self.max_bytes
+
+    def _download(self, file_dict: Dict) -> Iterator[bytes]:
+        data = self.slack.iter_file_content(file_dict.get('url_private_download'), self.chunk_size)
+        try:
+            yield from data
+        finally:
+            data.close()
+
+    def iter_chunks(self, file_dict: Dict) -> Iterator[str]:
+        """ Download a text file and yield its content in overlapping chunks of text
+
+        Args:
+            file_dict: File dict returned by the Slack API
+        Returns:
+            Iterator of chunks of text. Empty if the file shouldn't be read, or is an archive
+        """
+
+        if not self.should_read(file_dict) or self.is_archive(file_dict):
+            return
+        # The size reported by Slack is checked first, but is also enforced while downloading
+        yield from iter_text_chunks(self._download(file_dict), self.chunk_size, self.overlap, self.max_bytes)
+
+    @contextmanager
+    def _download_to_file(self, file_dict: Dict) -> Iterator[str]:
+        handle, path = tempfile.mkstemp(prefix='slack-watchman-')
+        try:
+            read = 0
+            with os.fdopen(handle, 'wb') as temp_file:
+                for data in self._download(file_dict):
+                    read += len(data)
+                    if read > self.max_bytes:
+                        raise ArchiveLimitError(f'archive larger than {self.max_bytes} bytes')
+                    temp_file.write(data)
+            yield path
+        finally:
+            os.remove(path)
+
+    # pylint: disable=too-many-positional-arguments, too-many-arguments
+    def scan_archive(self,
+                     file_dict: Dict,
+                     signature_id: str,
+                     patterns: List[Tuple[str, Any]],
+                     guard: matcher.PatternGuard,
+                     engine: matcher.StdlibEngine | matcher.RegexModuleEngine = None,
+                     matcher_pool: matcher.MatcherPool = None,
+                     all_matches: bool = False) -> Tuple[List[str], Optional[str]]:
+        """ Download an archive and match its text members against a signature's patterns
+
+        Args:
+            file_dict: File dict returned by the Slack API
+            signature_id: ID of the signature to match
+            patterns: (pattern, compiled pattern) tuples to match with, when not using a matcher pool
+            guard: Records the cost of each pattern and enforces the time budget
+            engine: RegEx engine the patterns were compiled with
+            matcher_pool: Pool of processes to decompress and match in. If not given, this is done
+                in the calling thread
+            all_matches: Find every distinct match of each pattern in a chunk, rather than only the first
+        Returns:
+            Tuple of the distinct match strings, and why the archive wasn't read to the end, or None if it was
+        """
+
+        if not self.should_read(file_dict) or not self.is_archive(file_dict):
+            return [], None
+        try:
+            with self._download_to_file(file_dict) as path:
+                args = (path, file_dict.get('name'), self.archive_limits, self.chunk_size, self.overlap)
+                if not matcher_pool:
+                    return scan_archive(*args, patterns, guard, signature_id, engine, all_matches)
+                match_strings, stopped, costs = matcher_pool.call(
+                    _scan_archive_in_worker, signature_id, guard.quarantined_patterns(signature_id), *args,
+                    all_matches)
+                guard.merge(costs)
+                return match_strings, stopped
+        except ArchiveLimitError as e:
+            return [], e.limit
@@ -0,0 +1,239 @@
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from slack_watchman.clients.slack_client import SlackClient, get_timestamp
+from slack_watchman.loggers import JSONLogger, StdoutLogger
+from slack_watchman.models import conversation, signature
+from slack_watchman.models.work_unit import WorkUnit
+from slack_watchman.pipeline import Pipeline, Stage
+from slack_watchman.utils import convert_timestamp, is_date
+from slack_watchman.watchman_processor import Candidate, Page, SignatureScanner
+
+
+@dataclass(slots=True)
+class _Thread:
+    """ A thread found on a page of conversation history, whose replies are still to be fetched """
+    unit: WorkUnit
+    thread_ts: str
+    oldest: Optional[float]
+    page_key: Tuple[str, int]
+
+
+def plan_channel_work_units(channels: List[conversation.Conversation | conversation.ConversationSuccinct],
+                            team_id: str = None) -> List[WorkUnit]:
+    """ Plan a work unit for each conversation, to read every message posted in it
+
+    Args:
+        channels: Conversations to read
+        team_id: ID of the workspace the conversations are in, when using an Enterprise Grid organisation token
+    Returns:
+        List of WorkUnit objects for the history scope
+    """
+
+    return [WorkUnit(signature=None, scope='history', query=channel.id, team_id=team_id) for channel in channels]
+
+
+def history_watermark_id(signatures: List[signature.Signature]) -> str:
+    """ Get the ID history watermarks are stored under for a set of signatures. Each set has its
+    own watermarks, so history read with only some signatures is read again with the others
+
+    Args:
+        signatures: Signatures the history is matched against
+    Returns:
+        ID made from a hash of the signature IDs
+    """
+
+    digest = hashlib.md5(','.join(sorted({sig.id for sig in signatures})).encode()).hexdigest()
+    return f'history.{digest}'
+
+
+class HistoryScanner(SignatureScanner):
+    """ Reads every message in each conversation with `conversations.history`, rather than
+    searching, and matches every message against every signature with the messages scope.
+    This finds messages that don't contain any of the search strings, at a cost set by the
+    number of messages rather than the number of signatures.
+
+    Each work unit is a conversation, planned with `plan_channel_work_units`, and the
+    conversations are read in parallel by the fetch stage, through the client's rate
+    limiter. Findings are reported against a work unit for the signature that matched,
+    with the conversation ID as its query.
+
+    History is paged newest first, and the oldest message on the pages processed is kept in
+    the checkpoint, so a conversation that was part read when a scan was interrupted carries
+    on paging from there on resume, without fetching the pages already done again.
+
+    When threads are expanded, a threads stage between fetch and match fetches the replies
+    to each thread with `conversations.replies`, one thread per worker at a time, through
+    the rate limiter. Replies are tracked as part of the page the thread was found on.
+    A thread can get new replies long after it was started, so when threads are expanded the
+    history is read from the start of the timeframe rather than the watermark. Only messages
+    newer than the watermark are matched, threads without a reply since the watermark are
+    skipped, and only replies newer than the watermark are fetched.
+
+    Watermarks are kept for each set of signatures, see `history_watermark_id`.
+    """
+
+    # pylint: disable=too-many-positional-arguments, too-many-arguments
+    def __init__(self,
+                 slack: SlackClient,
+                 logger: JSONLogger | StdoutLogger,
+                 verbose: bool,
+                 timeframe: str,
+                 on_finding: Callable[[WorkUnit, Dict], None],
+                 signatures: List[signature.Signature],
+                 workspace_url: str = None,
+                 expand_threads: bool = False,
+                 thread_workers: int = 4,
+                 **kwargs):
+        """
+        Args:
+            slack: Slack API object
+            logger: Logging object
+            verbose: Whether to use verbose logging or not
+            timeframe: How far back to read, as YYYY-MM-DD
+            on_finding: Called with the work unit and finding for each unique finding
+            signatures: Signatures to match messages against. Only those with the messages scope are used
+            workspace_url: URL of the workspace, used to build permalinks to messages
+            expand_threads: Whether to fetch and match the replies in threads
+            thread_workers: Number of threads fetching thread replies
+            kwargs: Any other SignatureScanner arguments
+        Raises:
+            ValueError: If the `new-resolved` emit mode is used. Only conversations that are read
+                are covered, so findings elsewhere can't be resolved
+        """
+        if kwargs.get('emit_mode') == 'new-resolved':
+            raise ValueError('The new-resolved emit mode can\'t be used when reading conversation history')
+        super().__init__(slack, logger, verbose, timeframe, on_finding, **kwargs)
+        self.signatures = [sig for sig in signatures if 'messages' in (sig.scope or [])]
+        self.watermark_id = history_watermark_id(self.signatures)
+        self.workspace_url = workspace_url
+        self.expand_threads = expand_threads
+        self.latest = None
+        if expand_threads:
+            stages = list(self.pipeline.stages)
+            stages.insert(1, Stage('threads', self._fetch_replies, workers=thread_workers,
+                                   queue_size=stages[1].queue_size))
+            self.pipeline = Pipeline(stages, logger)
+
+    def run(self, work_units: Iterable[WorkUnit], resume: bool = False) -> None:
+        """ Read the conversations in the work units, blocking until every finding has been emitted
+
+        Args:
+            work_units: History work units to scan
+            resume: Carry on from the checkpoint in the state store, rather than starting a new one
+        """
+        checkpoint = self.state_store.get_checkpoint() if self.state_store and resume else None
+        # Messages posted after the scan started are left for the next scan
+        self.latest = (checkpoint or {}).get('latest') or time.time()
+        super().run(work_units, resume=resume)
+
+    def _checkpoint_info(self) -> Dict[str, Any]:
+        return {**super()._checkpoint_info(), 'latest': self.latest}
+
+    def _watermark_key(self, unit: WorkUnit) -> Tuple[str, str, str]:
+        return self.watermark_id, unit.query, unit.state_scope
+
+    def _signature_unit(self, sig: signature.Signature, unit: WorkUnit) -> WorkUnit:
+        return WorkUnit(signature=sig, scope='messages', query=unit.query, team_id=unit.team_id)
+
+    def _permalink(self, channel_id: str, message: Dict) -> Optional[str]:
+        ts = message.get('ts')
+        if not self.workspace_url or not ts:
+            return None
+        permalink = f'{self.workspace_url.rstrip("/")}/archives/{channel_id}/p{ts.replace(".", "")}'
+        if message.get('thread_ts') and message.get('thread_ts') != ts:
+            permalink += f'?thread_ts={message.get("thread_ts")}&cid={channel_id}'
+        return permalink
+
+    def _prepare_messages(self, unit: WorkUnit, items: List[Dict]) -> List[Dict]:
+        # History doesn't include the conversation or a permalink, which enrichment and output expect
+        for sig in self.signatures:
+            self._count(self._signature_unit(sig, unit), 'potential_matches', len(items))
+        return [{
+            **message,
+            'channel': {'id': unit.query},
+            'permalink': self._permalink(unit.query, message)
+        } for message in items]
+
+    def _threads(self, page: Page, items: List[Dict], watermark: Optional[float]) -> Iterator[_Thread]:
+        for message in items:
+            if not message.get('reply_count') or message.get('thread_ts', message.get('ts')) != message.get('ts'):
+                continue
+            if watermark and float(message.get('latest_reply') or 0) <= watermark:
+                # No replies since the last scan
+                continue
+            yield _Thread(unit=page.unit, thread_ts=message.get('ts'), oldest=watermark, page_key=page.key)
+
+    def _fetch(self, unit: WorkUnit) -> Iterator[Page | _Thread]:
+        reason = self._budget_exhausted(unit)
+        if reason:
+            self._stop_unit(self.skipped, unit, reason)
+            return
+        self.logger.log('DEBUG', f'Reading the history of conversation: {unit.query}')
+
+        watermark = self.state_store.get_watermark(*self._watermark_key(unit)) if self.state_store else None
+        timeframe_start = time.mktime(time.strptime(self.timeframe, '%Y-%m-%d')) if is_date(self.timeframe) else 0
+        self._window_starts[unit.key] = max(timeframe_start, watermark or 0)
+        # Threads are found by their latest reply, which can be newer than the watermark on any
+        # message in the timeframe, so the whole timeframe is read
+        oldest = timeframe_start if self.expand_threads else self._window_starts[unit.key]
+
+        progress = self._resume_progress(unit)
+        if progress.completed:
+            self.logger.log('DEBUG', f'Skipping conversation read before resuming: {unit.query}')
+            return
+
+        progress.newest = progress.newest or watermark
+        if progress.resume_before:
+            self.logger.log('DEBUG', f'Resuming conversation from before {convert_timestamp(progress.resume_before)}: '
+                                     f'{unit.query}')
+        number = progress.next_page - 1
+        for number, items in enumerate(self.slack.iter_conversation_history(
+                unit.query, oldest or None, progress.resume_before or self.latest, team_id=unit.team_id),
+                progress.next_page):
+            if items:
+                progress.page_oldest[number] = min(get_timestamp(item) for item in items)
+            progress.newest = max([progress.newest or 0] + [get_timestamp(item) for item in items]) or None
+            progress.pages_fetched += 1
+            # Messages from before the watermark were matched by a previous scan
+            new_items = [item for item in items if not watermark or get_timestamp(item) > watermark]
+            page = Page(unit=unit, items=self._prepare_messages(unit, new_items), number=number)
+            self._track(page.key, 1)
+            yield page
+            if self.expand_threads:
+                for thread in self._threads(page, items, watermark):
+                    self._track(page.key, 1)
+                    yield thread
+
+            reason = self._budget_exhausted(unit)
+            if reason:
+                self._stop_unit(self.truncated, unit, reason)
+                return
+
+        with self._progress_lock:
+            progress.last_page = number
+            self._save_progress(unit.key, progress)
+
+    def _fetch_replies(self, item: Page | _Thread) -> Iterator[Page]:
+        if isinstance(item, Page):
+            yield item
+            return
+
+        unit, number = item.unit, item.page_key[1]
+        for replies in self.slack.iter_conversation_replies(
+                unit.query, item.thread_ts, item.oldest, self.latest, team_id=unit.team_id):
+            # The message the thread is on is returned too, but has already been matched
+            replies = [reply for reply in replies if reply.get('ts') != item.thread_ts]
+            if replies:
+                self._track(item.page_key, 1)
+                yield Page(unit=unit, items=self._prepare_messages(unit, replies), number=number)
+        self._track(item.page_key, -1)
+
+    def _match(self, page: Page) -> Iterator[Candidate]:
+        for sig in self.signatures:
+            for candidate in self._match_messages(page, self._signature_unit(sig, page.unit)):
+                self._track(page.key, 1)
+                yield candidate
+        self._track(page.key, -1)
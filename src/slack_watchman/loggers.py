@@ -6,10 +6,11 @@ import logging.handlers
 import os
 import re
 import sys
+import threading
 import traceback
 from collections.abc import Mapping
 from logging import Logger
-from typing import Any, Dict, List, ClassVar, Protocol
+from typing import Any, Callable, Dict, List, ClassVar, Protocol, Tuple
 
 from colorama import Fore, Back, Style, init
 
@@ -21,10 +22,20 @@ class StdoutLogger:
 
     def __init__(self, **kwargs):
         self.debug = kwargs.get('debug')
+        self.output_lock = threading.Lock()
+        # Formats each type of notification, returning the message to output and its level
+        self.formatters: Dict[str, Callable[[Dict], Tuple[Any, str]]] = {
+            'workspace': self._format_workspace,
+            'workspace_auth': self._format_workspace_auth,
+            'workspace_probe': self._format_workspace_probe,
+            'user': self._format_user,
+            'canvas': self._format_canvas,
+            'result': self._format_result,
+            'resolved': self._format_resolved
+        }
         self.print_header()
         init()
 
-    # pylint: disable=too-many-branches
     def log(self,
             msg_level: str,
             message: Any,
@@ -44,89 +55,144 @@ class StdoutLogger:
         if dataclasses.is_dataclass(message):
             message = dataclasses.asdict(message)
 
-        if notify_type == "workspace":
-            message = f'WORKSPACE: \n' \
-                      f'    ID: {message.get("id")}  \n' \
-                      f'    NAME: {message.get("name")}  \n' \
-                      f'    DOMAIN: {message.get("domain")}  \n' \
-                      f'    URL: {message.get("url")}'
-            msg_level = 'WORKSPACE'
-        if notify_type == "workspace_auth":
-            message = f'WORKSPACE_AUTH: \n' \
-                      f'    APPROVED_DOMAINS: {message.get("formatted_email_domains")}  \n' \
-                      f'    OAUTH_PROVIDERS: {message.get("user_oauth")} \n' \
-                      f'    STANDARD_AUTH: {message.get("standard_auth_enabled")} \n' \
-                      f'    SSO_ENABLED: {message.get("sso_enabled")} \n' \
-                      f'    TWO_FACTOR_REQUIRED: {message.get("two_factor_required")}'
-            msg_level = 'WORKSPACE_AUTH'
-        if notify_type == "workspace_probe":
-            message = f'WORKSPACE_PROBE_INFORMATION: \n' \
-                      f'    TEAM_NAME: {message.get("team_name")}  \n' \
-                      f'    TEAM_ID: {message.get("team_id")}  \n' \
-                      f'    PAID_TEAM: {message.get("paid_team")}  \n' \
-                      f'    APPROVED_DOMAINS: {message.get("formatted_email_domains")}  \n' \
-                      f'    JOIN_URL: {message.get("join_url")}  \n' \
-                      f'    OAUTH_PROVIDERS: {message.get("user_oauth")} \n' \
-                      f'    STANDARD_AUTH: {message.get("standard_auth_enabled")} \n' \
-                      f'    SSO_ENABLED: {message.get("sso_enabled")} \n' \
-                      f'    TWO_FACTOR_REQUIRED: {message.get("two_factor_required")}'
-            msg_level = 'WORKSPACE_PROBE'
-        if notify_type == "user":
-            message = f'USER: \n' \
-                      f'    ID: {message.get("id")}  \n' \
-                      f'    NAME: {message.get("display_name")}  \n' \
-                      f'    EMAIL: {message.get("email")}  \n' \
-                      f'    JOB_TITLE: {message.get("title")} \n' \
-                      f'    ADMIN: {message.get("is_admin")} \n' \
-                      f'    OWNER: {message.get("is_owner")} \n' \
-                      f'    HAS_2FA: {message.get("has_2fa")}'
-            msg_level = 'USER'
-        if notify_type == "canvas":
-            message = f'CANVAS: \n' \
-                      f'    CHANNEL: {message.get("channel_name")}  \n' \
-                      f'    CANVAS_URL: {message.get("canvas_url")}'
-            msg_level = 'USER'
-        if notify_type == "result":
-            if message.get('message'):
-                if message.get('message').get('conversation').get('is_im'):
-                    conversation_type = 'Direct Message'
-                elif message.get('message').get('conversation').get('is_private'):
-                    conversation_type = 'Private Channel'
-                else:
-                    conversation_type = 'Public Channel'
-
-                if isinstance(message.get('message').get('user'), Mapping):
-                    user = f"{message.get('message', {}).get('user', {}).get('display_name')} -" \
-                           f" {message.get('message', {}).get('user', {}).get('email')}"
-                else:
-                    user = message.get('message').get('user')
-
-                message = 'POST_TYPE: Message' \
-                          f'    POSTED_ON: {message.get("message").get("created")} \n' \
-                          f'    POSTED_BY: {user} \n' \
-                          f'    CONVERSATION: {message.get("message").get("conversation").get("name")}' \
-                          f'    CONVERSATION_TYPE: {conversation_type}\n' \
-                          f'    URL: {message.get("message").get("permalink")} \n' \
-                          f'    POTENTIAL_SECRET: {message.get("match_string")} \n' \
-                          f'    -----'
-
-            elif message.get('file'):
-                message = 'POST_TYPE: File' \
-                          f'    POSTED_BY: {message.get("user", {}).get("display_name")} ' \
-                          f'- {message.get("user").get("email")}' \
-                          f'    CREATED: {message.get("file").get("created")} \n' \
-                          f'    FILE_NAME: {message.get("file").get("name")} \n' \
-                          f'    PRIVATE_URL: {message.get("file").get("url_private_download")} \n' \
-                          f'    PUBLIC_PERMALINK: {message.get("file").get("permalink_public")} \n' \
-                          f'    -----'
-            msg_level = 'RESULT'
-        try:
-            self.log_to_stdout(message, msg_level)
-        except Exception as e:
-            print(e)
-            self.log_to_stdout(message, msg_level)
+        formatter = self.formatters.get(notify_type)
+        if formatter:
+            message, msg_level = formatter(message)
+        with self.output_lock:
+            try:
+                self.log_to_stdout(message, msg_level)
+            except Exception as e:
+                print(e)
+                self.log_to_stdout(message, msg_level)
+
+    @staticmethod
+    def _format_workspace(message: Dict) -> Tuple[str, str]:
+        return f'WORKSPACE: \n' \
+               f'    ID: {message.get("id")}  \n' \
+               f'    NAME: {message.get("name")}  \n' \
+               f'    DOMAIN: {message.get("domain")}  \n' \
+               f'    URL: {message.get("url")}', 'WORKSPACE'
+
+    @staticmethod
+    def _format_workspace_auth(message: Dict) -> Tuple[str, str]:
+        return f'WORKSPACE_AUTH: \n' \
+               f'    APPROVED_DOMAINS: {message.get("formatted_email_domains")}  \n' \
+               f'    OAUTH_PROVIDERS: {message.get("user_oauth")} \n' \
+               f'    STANDARD_AUTH: {message.get("standard_auth_enabled")} \n' \
+               f'    SSO_ENABLED: {message.get("sso_enabled")} \n' \
+               f'    TWO_FACTOR_REQUIRED: {message.get("two_factor_required")}', 'WORKSPACE_AUTH'
+
+    @staticmethod
+    def _format_workspace_probe(message: Dict) -> Tuple[str, str]:
+        return f'WORKSPACE_PROBE_INFORMATION: \n' \
+               f'    TEAM_NAME: {message.get("team_name")}  \n' \
+               f'    TEAM_ID: {message.get("team_id")}  \n' \
+               f'    PAID_TEAM: {message.get("paid_team")}  \n' \
+               f'    APPROVED_DOMAINS: {message.get("formatted_email_domains")}  \n' \
+               f'    JOIN_URL: {message.get("join_url")}  \n' \
+               f'    OAUTH_PROVIDERS: {message.get("user_oauth")} \n' \
+               f'    STANDARD_AUTH: {message.get("standard_auth_enabled")} \n' \
+               f'    SSO_ENABLED: {message.get("sso_enabled")} \n' \
+               f'    TWO_FACTOR_REQUIRED: {message.get("two_factor_required")}', 'WORKSPACE_PROBE'
+
+    @staticmethod
+    def _format_user(message: Dict) -> Tuple[str, str]:
+        return f'USER: \n' \
+               f'    ID: {message.get("id")}  \n' \
+               f'    NAME: {message.get("display_name")}  \n' \
+               f'    EMAIL: {message.get("email")}  \n' \
+               f'    JOB_TITLE: {message.get("title")} \n' \
+               f'    ADMIN: {message.get("is_admin")} \n' \
+               f'    OWNER: {message.get("is_owner")} \n' \
+               f'    HAS_2FA: {message.get("has_2fa")}', 'USER'
+
+    @staticmethod
+    def _format_canvas(message: Dict) -> Tuple[str, str]:
+        return f'CANVAS: \n' \
+               f'    CHANNEL: {message.get("channel_name")}  \n' \
+               f'    CANVAS_URL: {message.get("canvas_url")}', 'USER'
+
+    def _format_result(self, message: Dict) -> Tuple[Any, str]:
+        if message.get('message'):
+            message = self._format_message_result(message)
+        elif message.get('file'):
+            message = self._format_file_result(message)
+        elif message.get('field'):
+            message = self._format_profile_result(message)
+        return message, 'RESULT'
+
+    @staticmethod
+    def _format_message_result(message: Dict) -> str:
+        conversation = message.get('message').get('conversation') or {}
+        if conversation.get('is_im'):
+            conversation_type = 'Direct Message'
+        elif conversation.get('is_private'):
+            conversation_type = 'Private Channel'
+        else:
+            conversation_type = 'Public Channel'
+
+        if isinstance(message.get('message').get('user'), Mapping):
+            user = f"{message.get('message', {}).get('user', {}).get('display_name')} -" \
+                   f" {message.get('message', {}).get('user', {}).get('email')}"
+        else:
+            user = message.get('message').get('user')
+
+        return 'POST_TYPE: Message' \
+               f'    POSTED_ON: {message.get("message").get("created")} \n' \
+               f'    POSTED_BY: {user} \n' \
+               f'    CONVERSATION: {conversation.get("name")}' \
+               f'    CONVERSATION_TYPE: {conversation_type}\n' \
+               f'    URL: {message.get("message").get("permalink")} \n' \
+               f'    POTENTIAL_SECRET: {message.get("match_string")} \n' \
+               f'    -----'
+
+    @staticmethod
+    def _format_file_result(message: Dict) -> str:
+        if message.get('user'):
+            posted_by = f'{message.get("user").get("display_name")} - {message.get("user").get("email")}'
+        else:
+            posted_by = None
+        lines = [
+            'POST_TYPE: File',
+            f'    POSTED_BY: {posted_by}',
+            f'    CREATED: {message.get("file").get("created")}',
+            f'    FILE_NAME: {message.get("file").get("name")}',
+            f'    PRIVATE_URL: {message.get("file").get("url_private_download")}',
+            f'    PUBLIC_PERMALINK: {message.get("file").get("permalink_public")}'
+        ]
+        # Canvas findings, and matches in the content of a file rather than its name
+        if message.get('canvas_url'):
+            lines.append(f'    CANVAS_URL: {message.get("canvas_url")}')
+        if message.get('match_location'):
+            lines.append(f'    LOCATION: {message.get("match_location")}')
+        if message.get('match_string'):
+            lines.append(f'    POTENTIAL_SECRET: {message.get("match_string")}')
+        lines.append('    -----')
+        return ' \n'.join(lines)
+
+    @staticmethod
+    def _format_profile_result(message: Dict) -> str:
+        if message.get('user'):
+            owner = f'USER: {message.get("user").get("display_name")} - {message.get("user").get("email")}'
+        else:
+            owner = f'CONVERSATION: {message.get("conversation").get("name")}'
+        return 'POST_TYPE: Profile \n' \
+               f'    {owner} \n' \
+               f'    FIELD: {message.get("field")} \n' \
+               f'    POTENTIAL_SECRET: {message.get("match_string")} \n' \
+               f'    -----'
 
-    # pylint: disable=too-many-statements
+    @staticmethod
+    def _format_resolved(message: Dict) -> Tuple[str, str]:
+        return 'RESOLVED: \n' \
+               f'    SIGNATURE: {message.get("signature_name")} \n' \
+               f'    SCOPE: {message.get("scope")} \n' \
+               f'    WATCHMAN_ID: {message.get("watchman_id")} \n' \
+               f'    FIRST_SEEN: {message.get("first_seen")} \n' \
+               f'    LAST_SEEN: {message.get("last_seen")} \n' \
+               f'    -----', 'RESULT'
+
+    # pylint: disable=too-many-branches, too-many-statements
     def log_to_stdout(self,
                       message: Any,
                       msg_level: str) -> None:
@@ -261,6 +327,7 @@ class StdoutLogger:
         print(' '.ljust(79) + Fore.GREEN)
 
 
+# pylint: disable=too-many-instance-attributes
 class JSONLogger(Logger):
     """ Custom logger class for JSON logging"""
 
@@ -283,6 +350,7 @@ class JSONLogger(Logger):
             '{"timestamp": "%(asctime)s", "level": "WORKSPACE_PROBE", "message": %(message)s}')
         self.canvas_format = logging.Formatter(
             '{"timestamp": "%(asctime)s", "level": "CANVAS", "message": %(message)s}')
+        self.output_lock = threading.Lock()
         self.logger = logging.getLogger(self.name)
         self.handler = logging.StreamHandler(sys.stdout)
         self.logger.addHandler(self.handler)
@@ -298,6 +366,15 @@ class JSONLogger(Logger):
             level: str,
             msg: str or Dict,
             **kwargs):
+        # The formatter is shared by all levels, so it is set and used under a
+        # lock in case messages are logged from multiple threads
+        with self.output_lock:
+            self._log(level, msg, **kwargs)
+
+    def _log(self,
+             level: str,
+             msg: str or Dict,
+             **kwargs):
         if level.upper() == 'NOTIFY':
             self.handler.setFormatter(self.notify_format)
             self.logger.info(
@@ -0,0 +1,366 @@
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from slack_watchman.models import signature
+
+try:
+    import regex
+except ImportError:  # pragma: no cover
+    regex = None
+
+# Maximum number of seconds a single pattern can take to search a single input
+DEFAULT_PATTERN_BUDGET = 1.0
+
+# Engine, budget and patterns set up once in each pool worker process by init_worker
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+class StdlibEngine:
+    """ RegEx engine using the standard library `re` module. A search can't be
+    interrupted, so a pattern that exceeds its budget is only quarantined once
+    the search has finished.
+    """
+
+    name = 're'
+    hard_timeout = False
+
+    @staticmethod
+    def compile(pattern: str) -> Any:
+        """ Compile a pattern """
+        return re.compile(pattern)
+
+    @staticmethod
+    def search(pattern: Any, text: str, timeout: float = None) -> Any:  # pylint: disable=unused-argument
+        """ Search the text with a compiled pattern """
+        return pattern.search(text)
+
+    @staticmethod
+    def finditer(pattern: Any, text: str, timeout: float = None) -> Iterator[Any]:  # pylint: disable=unused-argument
+        """ Find every match of a compiled pattern in the text """
+        return pattern.finditer(text)
+
+
+class RegexModuleEngine:
+    """ RegEx engine using the third party `regex` module, which is installed with
+    Slack Watchman. Searches are stopped as soon as they exceed their budget.
+    """
+
+    name = 'regex'
+    hard_timeout = True
+
+    @staticmethod
+    def compile(pattern: str) -> Any:
+        """ Compile a pattern """
+        return regex.compile(pattern)
+
+    @staticmethod
+    def search(pattern: Any, text: str, timeout: float = None) -> Any:
+        """ Search the text with a compiled pattern, raising TimeoutError if it takes longer than the timeout """
+        return pattern.search(text, timeout=timeout)
+
+    @staticmethod
+    def finditer(pattern: Any, text: str, timeout: float = None) -> Iterator[Any]:
+        """ Find every match of a compiled pattern in the text, raising TimeoutError if finding them
+        takes longer than the timeout """
+        return pattern.finditer(text, timeout=timeout)
+
+
+def get_engine(name: str = None) -> StdlibEngine | RegexModuleEngine:
+    """ Get the RegEx engine to match with. Defaults to the `regex` module, as it can
+    enforce time budgets, falling back to the standard library `re` module if it can't be imported.
+
+    Args:
+        name: Name of the engine to use, `re` or `regex`
+    Returns:
+        RegEx engine
+    """
+
+    if name == 'regex' or (name is None and regex is not None):
+        if regex is None:
+            raise ImportError('The regex package must be installed to use the regex engine')
+        return RegexModuleEngine()
+    return StdlibEngine()
+
+
+@dataclass(slots=True)
+class PatternCost:
+    """ Time spent searching with a single pattern """
+    signature_id: str
+    pattern: str
+    calls: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    quarantined: bool = False
+
+
+class PatternGuard:
+    """ Records how long each pattern spends searching, and quarantines any pattern
+    that exceeds the time budget on a single input. Quarantined patterns aren't used
+    again for the rest of the run, so one pathological pattern can't stall a scan.
+    """
+
+    def __init__(self, budget: float = DEFAULT_PATTERN_BUDGET):
+        """
+        Args:
+            budget: Maximum number of seconds a pattern can take on a single input.
+                None disables the budget
+        """
+        self.budget = budget
+        self.costs: Dict[Tuple[str, str], PatternCost] = {}
+        self._lock = threading.Lock()
+
+    def is_quarantined(self, signature_id: str, pattern: str) -> bool:
+        """ Whether the pattern has been quarantined """
+        cost = self.costs.get((signature_id, pattern))
+        return bool(cost and cost.quarantined)
+
+    def quarantined_patterns(self, signature_id: str) -> List[str]:
+        """ Patterns from the signature that have been quarantined """
+        return [cost.pattern for cost in self.costs.values()
+                if cost.signature_id == signature_id and cost.quarantined]
+
+    # pylint: disable=too-many-positional-arguments
+    def record(self,
+               signature_id: str,
+               pattern: str,
+               seconds: float,
+               calls: int = 1,
+               max_seconds: float = None,
+               quarantined: bool = False) -> None:
+        """ Record time spent searching with a pattern, quarantining it if a single
+        search went over budget
+
+        Args:
+            signature_id: ID of the signature the pattern belongs to
+            pattern: The pattern
+            seconds: Total time spent searching
+            calls: Number of searches the time was spent on
+            max_seconds: Longest single search. Defaults to `seconds`
+            quarantined: Quarantine the pattern regardless of the time taken, e.g. after a timeout
+        """
+
+        max_seconds = seconds if max_seconds is None else max_seconds
+        with self._lock:
+            cost = self.costs.setdefault((signature_id, pattern), PatternCost(signature_id, pattern))
+            cost.calls += calls
+            cost.total_seconds += seconds
+            cost.max_seconds = max(cost.max_seconds, max_seconds)
+            if quarantined or (self.budget is not None and max_seconds > self.budget):
+                cost.quarantined = True
+
+    def merge(self, costs: List[PatternCost]) -> None:
+        """ Merge costs recorded elsewhere, e.g. in a pool worker process """
+        for cost in costs:
+            self.record(cost.signature_id, cost.pattern, cost.total_seconds, cost.calls,
+                        cost.max_seconds, cost.quarantined)
+
+    def report(self) -> Tuple[List[PatternCost], List[PatternCost]]:
+        """ Get the cost of every pattern used, and the patterns that were quarantined
+
+        Returns:
+            Tuple of all pattern costs ordered by total time, most expensive first,
+            and the quarantined patterns
+        """
+
+        costs = sorted(self.costs.values(), key=lambda c: c.total_seconds, reverse=True)
+        return costs, [cost for cost in costs if cost.quarantined]
+
+
+def compile_patterns(patterns: List[str], engine: StdlibEngine | RegexModuleEngine = None) -> List[Tuple[str, Any]]:
+    """ Compile the RegEx patterns from a signature
+
+    Args:
+        patterns: List of RegEx strings
+        engine: RegEx engine to compile with. Defaults to the standard library `re` module
+    Returns:
+        List of (pattern, compiled pattern) tuples
+    """
+
+    engine = engine or StdlibEngine()
+    return [(pattern, engine.compile(pattern)) for pattern in patterns or []]
+
+
+def _find(engine: StdlibEngine | RegexModuleEngine,
+          compiled: Any,
+          text: str,
+          timeout: float,
+          all_matches: bool) -> List[str]:
+    if not all_matches:
+        match = engine.search(compiled, text, timeout=timeout)
+        return [match.group(0)] if match else []
+    # A single pass over the text, keeping the first of each distinct match
+    return list(dict.fromkeys(match.group(0) for match in engine.finditer(compiled, text, timeout=timeout)))
+
+
+# pylint: disable=too-many-positional-arguments, too-many-arguments
+def match_texts(patterns: List[Tuple[str, Any]],
+                texts: List[str],
+                guard: PatternGuard = None,
+                signature_id: str = None,
+                engine: StdlibEngine | RegexModuleEngine = None,
+                all_matches: bool = False) -> List[Tuple[int, str]]:
+    """ Match a batch of texts against compiled patterns
+
+    Args:
+        patterns: (pattern, compiled pattern) tuples to search with
+        texts: Texts to search
+        guard: Records the cost of each pattern and enforces the time budget. If not given,
+            searches aren't timed
+        signature_id: ID of the signature the patterns belong to, used by the guard
+        engine: RegEx engine the patterns were compiled with
+        all_matches: Return every distinct match of each pattern in a text, rather than only the first
+    Returns:
+        List of (index of the text in the batch, match string) tuples, one for each
+        pattern that matched a text, or for each distinct match if all_matches is set
+    """
+
+    engine = engine or StdlibEngine()
+    matches = []
+    for index, text in enumerate(texts):
+        for pattern, compiled in patterns:
+            if guard is None:
+                match_strings = _find(engine, compiled, text, None, all_matches)
+            else:
+                if guard.is_quarantined(signature_id, pattern):
+                    continue
+                # CPU time of this thread, so time spent waiting for the GIL while other
+                # threads run isn't counted against the pattern
+                start = time.thread_time()
+                try:
+                    match_strings = _find(engine, compiled, text, guard.budget, all_matches)
+                except TimeoutError:
+                    guard.record(signature_id, pattern, time.thread_time() - start, quarantined=True)
+                    continue
+                guard.record(signature_id, pattern, time.thread_time() - start)
+            matches.extend((index, match_string) for match_string in match_strings)
+    return matches
+
+
+def init_worker(patterns_by_signature: Dict[str, List[str]], budget: float, engine_name: str) -> None:
+    """ Set up a pool worker process, compiling the patterns for every signature once.
+    Used as the initializer of a process pool, or called from one
+
+    Args:
+        patterns_by_signature: Uncompiled patterns for each signature ID
+        budget: Maximum number of seconds a pattern can take on a single input
+        engine_name: Name of the RegEx engine to compile the patterns with
+    """
+    engine = get_engine(engine_name)
+    _WORKER_STATE['engine'] = engine
+    _WORKER_STATE['budget'] = budget
+    _WORKER_STATE['patterns'] = {
+        signature_id: compile_patterns(patterns, engine) for signature_id, patterns in patterns_by_signature.items()
+    }
+
+
+def worker_state() -> Dict[str, Any]:
+    """ The engine, budget and compiled patterns set up in this process by init_worker
+
+    Returns:
+        Dict with the `engine`, `budget` and `patterns` keys, or an empty dict if
+        init_worker hasn't been called in this process
+    """
+    return _WORKER_STATE
+
+
+def _match_batch(signature_id: str,
+                 texts: List[str],
+                 quarantined: List[str],
+                 all_matches: bool = False) -> Tuple[List[Tuple[int, str]], List[PatternCost]]:
+    # A fresh guard per batch means only the costs for this batch are sent back
+    guard = PatternGuard(_WORKER_STATE.get('budget'))
+    for pattern in quarantined:
+        guard.record(signature_id, pattern, 0.0, calls=0, quarantined=True)
+    matches = match_texts(
+        _WORKER_STATE.get('patterns', {}).get(signature_id, []),
+        texts,
+        guard,
+        signature_id,
+        _WORKER_STATE.get('engine'),
+        all_matches)
+    return matches, [cost for cost in guard.costs.values() if cost.calls]
+
+
+class MatcherPool:
+    """ Pool of processes that match batches of text against signature patterns.
+
+    Matching is CPU bound, so running it in threads alongside the API calls means it
+    competes for the GIL. The pool moves it into separate processes, one per CPU core by
+    default. The patterns for every signature are compiled once in each process when it
+    starts, so only the texts are sent to the pool and only match tuples are sent back.
+    """
+
+    def __init__(self,
+                 signatures: List[signature.Signature],
+                 processes: int = None,
+                 budget: float = DEFAULT_PATTERN_BUDGET,
+                 engine: StdlibEngine | RegexModuleEngine = None):
+        """
+        Args:
+            signatures: Signatures whose patterns will be matched
+            processes: Number of processes in the pool. Defaults to the number of CPU cores
+            budget: Maximum number of seconds a pattern can take on a single input
+            engine: RegEx engine to match with. Defaults to the result of get_engine()
+        """
+        self.processes = processes or os.cpu_count() or 1
+        engine = engine or get_engine()
+        # Spawn rather than fork, as the pipeline threads may be holding locks when a worker starts
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=({sig.id: list(sig.patterns or []) for sig in signatures}, budget, engine.name))
+
+    def match(self,
+              signature_id: str,
+              texts: List[str],
+              guard: PatternGuard = None,
+              all_matches: bool = False) -> List[Tuple[int, str]]:
+        """ Match a batch of texts against a signature's patterns in the pool,
+        blocking until the batch has been matched
+
+        Args:
+            signature_id: ID of the signature to match
+            texts: Texts to search
+            guard: Guard to merge the pattern costs from the batch into. Patterns it
+                has quarantined are skipped
+            all_matches: Return every distinct match of each pattern in a text, rather than only the first
+        Returns:
+            List of (index of the text in the batch, match string) tuples
+        """
+
+        if not texts:
+            return []
+        quarantined = guard.quarantined_patterns(signature_id) if guard else []
+        matches, costs = self._executor.submit(_match_batch, signature_id, texts, quarantined, all_matches).result()
+        if guard:
+            guard.merge(costs)
+        return matches
+
+    def call(self, func: Callable[..., Any], *args: Any) -> Any:
+        """ Run a function in one of the pool processes, blocking until it returns. The function
+        must be importable by the process, and can use the patterns compiled when it started
+
+        Args:
+            func: Module level function to run
+            args: Arguments to pass to the function. Must be picklable
+        Returns:
+            The function's return value
+        """
+        return self._executor.submit(func, *args).result()
+
+    def close(self) -> None:
+        """ Shut down the pool processes """
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
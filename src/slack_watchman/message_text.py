@@ -0,0 +1,101 @@
+import bisect
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# Keys in attachments and Block Kit blocks whose string values are shown to users
+TEXT_KEYS = frozenset(['text', 'title', 'pretext', 'value', 'footer', 'author_name', 'alt_text', 'url',
+                       'title_link'])
+
+# Separates the text of each field, so a match can't run from the end of one field into the next
+SEPARATOR = '\n'
+
+
+@dataclass(slots=True)
+class FlatText:
+    """ Every text field in a message joined into one string to match against, with the
+    offset each field starts at and its path in the message, so the location of a match
+    can be found """
+    text: str = ''
+    starts: List[int] = field(default_factory=list)
+    paths: List[str] = field(default_factory=list)
+
+    def locate(self, offset: int) -> Optional[str]:
+        """ Get the path of the field containing an offset in the text
+
+        Args:
+            offset: Offset in the text
+        Returns:
+            Path of the field in the message, e.g. `attachments[0].fields[1].value`, or None if
+            the offset is outside the text
+        """
+
+        if offset < 0 or offset >= len(self.text):
+            return None
+        return self.paths[bisect.bisect_right(self.starts, offset) - 1]
+
+    def locate_match(self, match_string: str) -> Optional[str]:
+        """ Get the path of the first field containing a match string
+
+        Args:
+            match_string: String matched in the text
+        Returns:
+            Path of the field in the message, or None if the match isn't in the text
+        """
+
+        return self.locate(self.text.find(match_string)) if match_string else None
+
+
+def flatten_message(message: Dict) -> FlatText:
+    """ Pull the text, and every text field in the attachments and Block Kit blocks of a
+    message, into one string in a single pass. Bot posts often only have content in their
+    attachments and blocks.
+
+    Rich text blocks are skipped when the message has text, as Slack sets the text of a
+    message written in the client from its rich text, so they would be matched twice.
+
+    Args:
+        message: Message dict from the Slack API
+    Returns:
+        FlatText of the message
+    """
+
+    parts, starts, paths = [], [], []
+    offset = 0
+
+    def add(path: str, value: str) -> None:
+        nonlocal offset
+        if parts:
+            offset += len(SEPARATOR)
+        parts.append(value)
+        starts.append(offset)
+        paths.append(path)
+        offset += len(value)
+
+    if message.get('text'):
+        add('text', str(message.get('text')))
+
+    # Walked depth first with a stack rather than recursion, keeping the order of the fields
+    stack: List[Tuple[str, Any]] = []
+    for key in ['attachments', 'blocks']:
+        if message.get(key):
+            # Pushed in reverse, so blocks come first as they are shown above attachments
+            stack.append((key, message.get(key)))
+    while stack:
+        path, value = stack.pop()
+        if isinstance(value, list):
+            stack.extend((f'{path}[{index}]', item) for index, item in reversed(list(enumerate(value))))
+        elif isinstance(value, dict):
+            if value.get('type') == 'rich_text' and message.get('text'):
+                continue
+            children = []
+            for key, item in value.items():
+                if isinstance(item, str):
+                    if key in TEXT_KEYS and item:
+                        children.append((f'{path}.{key}', item))
+                elif isinstance(item, (dict, list)):
+                    children.append((f'{path}.{key}', item))
+            stack.extend(reversed(children))
+        elif isinstance(value, str):
+            add(path, value)
+
+    return FlatText(text=SEPARATOR.join(parts), starts=starts, paths=paths)
@@ -10,3 +10,4 @@ class AuthVars:
     url: Optional[str] | None
     disabled_signatures: Optional[List[str]] | None
     cookie_auth: bool
+    app_token: Optional[str] = None
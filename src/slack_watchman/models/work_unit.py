@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from slack_watchman.models.signature import Signature
+
+
+@dataclass(frozen=True, slots=True)
+class WorkUnit:
+    """Class that defines a single planned piece of scanning work: one
+    search query from a signature, run against one scope, optionally in one
+    workspace of an Enterprise Grid organisation. Work units for the history
+    scope have no signature, and their query is the ID of the conversation to
+    read, as every message in it is matched against every signature."""
+
+    signature: Optional[Signature]
+    scope: str
+    query: str
+    team_id: Optional[str] = None
+
+    def __post_init__(self):
+        """Validate types of fields after initialisation."""
+        expected_types = {
+            'signature': Signature,
+            'scope': str,
+            'query': str,
+            'team_id': str,
+        }
+
+        for field_name, expected_type in expected_types.items():
+            value = getattr(self, field_name)
+            if value is not None and not isinstance(value, expected_type):
+                raise TypeError(
+                    f'Expected `{field_name}` to be of type {expected_type}, '
+                    f'received {type(value).__name__}')
+
+    @property
+    def key(self) -> str:
+        """Stable identifier for the work unit"""
+        parts = [self.team_id, self.signature.id if self.signature else None, self.scope, self.query]
+        return '.'.join(part for part in parts if part)
+
+    @property
+    def state_scope(self) -> str:
+        """Scope that watermarks and findings for the work unit are stored under,
+        qualified by the workspace when there is one"""
+        return f'{self.team_id}/{self.scope}' if self.team_id else self.scope
@@ -0,0 +1,120 @@
+import queue
+import threading
+import traceback
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List
+
+from slack_watchman.loggers import JSONLogger, StdoutLogger
+
+_SENTINEL = object()
+
+
+@dataclass(slots=True)
+class Stage:
+    """ A single stage of a Pipeline. Each item taken from the stage's queue is
+    passed to the handler, and everything the handler yields is put on the queue
+    of the next stage.
+
+    Attributes:
+        name: Name of the stage, used in logging
+        handler: Callable that takes an item and returns an iterable of items for the next
+            stage, or None if there is nothing to pass on
+        workers: Number of threads working on this stage
+        queue_size: Maximum number of items waiting for this stage before the
+            previous stage blocks. 0 means unbounded
+    """
+
+    name: str
+    handler: Callable[[Any], Iterable[Any] | None]
+    workers: int = 1
+    queue_size: int = 0
+
+
+class Pipeline:
+    """ Runs items through a sequence of stages joined by bounded queues.
+
+    Every stage has its own pool of threads, so all stages run at the same time. When a
+    stage's queue is full the stage before it blocks, which stops fast producers from
+    building up results in memory faster than they can be processed.
+
+    Errors raised by stage handlers are logged and counted in `errors`, and the item is dropped.
+    """
+
+    def __init__(self,
+                 stages: List[Stage],
+                 logger: JSONLogger | StdoutLogger):
+        """
+        Args:
+            stages: Stages to run, in order
+            logger: Logger used to report errors raised by stage handlers
+        """
+        self.stages = stages
+        self.logger = logger
+        self.errors = 0
+        self._errors_lock = threading.Lock()
+        self._queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+
+    def submit(self, item: Any) -> None:
+        """ Add an item to the first stage. This can be called from a stage handler
+        to add more work while the pipeline is running.
+
+        Args:
+            item: Item to process
+        """
+        self._queues[0].put(item)
+
+    def run(self, items: Iterable[Any]) -> None:
+        """ Process the items through every stage, blocking until all stages have finished
+
+        Args:
+            items: Items to pass to the first stage
+        """
+
+        stage_threads = []
+        for index, stage in enumerate(self.stages):
+            threads = [
+                threading.Thread(
+                    target=self._work,
+                    args=(index,),
+                    name=f'{stage.name}-{number}',
+                    daemon=True)
+                for number in range(stage.workers)
+            ]
+            for thread in threads:
+                thread.start()
+            stage_threads.append(threads)
+
+        for item in items:
+            self.submit(item)
+
+        # Work can be added to the first stage while it is running, so wait for it to
+        # drain before shutting it down. Later stages are shut down in order, once
+        # everything upstream of them has finished.
+        self._queues[0].join()
+        for index, threads in enumerate(stage_threads):
+            for _ in threads:
+                self._queues[index].put(_SENTINEL)
+            for thread in threads:
+                thread.join()
+
+    def _work(self, index: int) -> None:
+        stage = self.stages[index]
+        input_queue = self._queues[index]
+        output_queue = self._queues[index + 1] if index + 1 < len(self._queues) else None
+
+        while True:
+            item = input_queue.get()
+            try:
+                if item is _SENTINEL:
+                    return
+                outputs = stage.handler(item)
+                for output in outputs or []:
+                    if output_queue is not None:
+                        output_queue.put(output)
+            except Exception as e:
+                with self._errors_lock:
+                    self.errors += 1
+                self.logger.log('ERROR', f'Error in {stage.name} stage: {e}')
+                self.logger.log('DEBUG', traceback.format_exc())
+            finally:
+                input_queue.task_done()
@@ -0,0 +1,93 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List
+
+from slack_watchman.clients.slack_client import SlackClient
+from slack_watchman.models.work_unit import WorkUnit
+from slack_watchman.rate_limiter import METHOD_TIERS, RATE_LIMIT_TIERS
+from slack_watchman.state import StateStore
+from slack_watchman.watchman_processor import search_after
+
+
+@dataclass(slots=True)
+class QueryEstimate:
+    """ Expected cost of searching a single work unit """
+    unit: WorkUnit
+    after: str
+    total: int
+    pages: int
+
+
+@dataclass(slots=True)
+class ScanPlan:
+    """ Expected cost of a scan, worked out without running it.
+
+    Attributes:
+        estimates: Expected results and pages for each work unit
+        requests: Expected number of requests to each Slack API method. Enrichment requests
+            are an upper bound, as users and conversations are only looked up once per scan
+        probe_requests: Requests made to work out the plan
+    """
+    estimates: List[QueryEstimate]
+    requests: Dict[str, int]
+    probe_requests: int
+
+    @property
+    def total_results(self) -> int:
+        """ Total number of search results across every work unit """
+        return sum(estimate.total for estimate in self.estimates)
+
+    def minutes_by_method(self) -> Dict[str, float]:
+        """ Minutes the requests to each method take at its rate limit """
+        return {method: count / RATE_LIMIT_TIERS[METHOD_TIERS[method]]
+                for method, count in self.requests.items()}
+
+    @property
+    def minutes(self) -> float:
+        """ Expected runtime of the scan in minutes. Rate limits apply to each method separately,
+        and the scan calls methods at the same time, so the slowest method sets the runtime """
+        return max(self.minutes_by_method().values(), default=0)
+
+
+def plan_scan(slack: SlackClient,
+              work_units: List[WorkUnit],
+              timeframe: str,
+              *,
+              state_store: StateStore = None,
+              workers: int = 4) -> ScanPlan:
+    """ Work out how many pages of results and requests a scan would need, without running it.
+    Each work unit is probed with a search for a single result, which returns the total
+    number of results, so the plan costs one request per work unit.
+
+    Args:
+        slack: Slack API object
+        work_units: Work units the scan would search
+        timeframe: Date the scan would search after
+        state_store: Store of watermarks from previous runs. If given, only results newer than
+            each unit's watermark are counted, as an incremental scan would search
+        workers: Number of probes to run at the same time
+    Returns:
+        ScanPlan of the expected cost
+    """
+
+    def probe(unit: WorkUnit) -> QueryEstimate:
+        watermark = state_store.get_watermark(unit.signature.id, unit.query, unit.state_scope) \
+            if state_store else None
+        after = search_after(timeframe, watermark)
+        total = slack.get_search_total(unit.query, f'search.{unit.scope}', unit.scope, after, team_id=unit.team_id)
+        # A search with no results still takes a request to find that out
+        return QueryEstimate(unit=unit, after=after, total=total, pages=max(1, math.ceil(total / slack.count)))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='plan') as executor:
+        estimates = list(executor.map(probe, work_units))
+
+    requests = {}
+    for estimate in estimates:
+        method = f'search.{estimate.unit.scope}'
+        requests[method] = requests.get(method, 0) + estimate.pages
+        # Every message found may be enriched with its user and conversation, and every file with its user
+        requests['users.info'] = requests.get('users.info', 0) + estimate.total
+        if estimate.unit.scope == 'messages':
+            requests['conversations.info'] = requests.get('conversations.info', 0) + estimate.total
+    return ScanPlan(estimates=estimates, requests=requests, probe_requests=len(work_units))
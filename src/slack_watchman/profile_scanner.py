@@ -0,0 +1,164 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List
+
+from slack_watchman import matcher
+from slack_watchman.loggers import JSONLogger, StdoutLogger
+from slack_watchman.models import conversation, signature, user
+from slack_watchman.models.work_unit import WorkUnit
+from slack_watchman.state import StateStore
+from slack_watchman.watchman_id import profile_watchman_id
+
+PROFILE_SCOPE = 'profiles'
+
+# Free text fields in the profile of a user from users.list
+USER_PROFILE_FIELDS = ['real_name', 'display_name', 'title', 'phone', 'skype', 'status_text', 'first_name',
+                       'last_name']
+
+
+@dataclass(slots=True)
+class ProfileField:
+    """ A free text field of a user or channel """
+    object_type: str
+    object_dict: Dict
+    field: str
+    text: str
+
+
+def iter_user_fields(user_dict: Dict) -> Iterator[ProfileField]:
+    """ Get the free text fields of a user: the standard profile fields and any custom profile fields
+
+    Args:
+        user_dict: User dict from the Slack API
+    Returns:
+        ProfileField for each field that has a value
+    """
+
+    profile = user_dict.get('profile') or {}
+    for field in USER_PROFILE_FIELDS:
+        if profile.get(field):
+            yield ProfileField('user', user_dict, field, str(profile.get(field)))
+    # Custom fields are keyed by their ID, with the value and an optional alternative text
+    for field_id, custom_field in (profile.get('fields') or {}).items():
+        for key in ['value', 'alt']:
+            if isinstance(custom_field, dict) and custom_field.get(key):
+                yield ProfileField('user', user_dict, f'fields.{field_id}.{key}', str(custom_field.get(key)))
+
+
+def iter_channel_fields(channel_dict: Dict) -> Iterator[ProfileField]:
+    """ Get the free text fields of a channel: its topic and purpose
+
+    Args:
+        channel_dict: Conversation dict from the Slack API
+    Returns:
+        ProfileField for each field that has a value
+    """
+
+    for field in ['topic', 'purpose']:
+        value = (channel_dict.get(field) or {}).get('value')
+        if value:
+            yield ProfileField('channel', channel_dict, field, str(value))
+
+
+# pylint: disable=too-many-instance-attributes
+class ProfileScanner:
+    """ Matches the user profiles and channel topics and purposes already downloaded when
+    enumerating users and channels against every signature with the messages scope, so
+    they are scanned without any more requests to the Slack API.
+
+    Findings are reported against a work unit for the signature that matched, with the
+    profiles scope and the ID of the user or channel as its query.
+    """
+
+    # pylint: disable=too-many-positional-arguments, too-many-arguments
+    def __init__(self,
+                 logger: JSONLogger | StdoutLogger,
+                 verbose: bool,
+                 signatures: List[signature.Signature],
+                 on_finding: Callable[[WorkUnit, Dict], None],
+                 pattern_guard: matcher.PatternGuard = None,
+                 state_store: StateStore = None,
+                 emit_mode: str = 'all',
+                 all_matches: bool = False):
+        """
+        Args:
+            logger: Logging object
+            verbose: Whether to use verbose logging or not
+            signatures: Signatures to match fields against. Only those with the messages scope are used
+            on_finding: Called with the work unit and finding for each unique finding
+            pattern_guard: Records the cost of each pattern and quarantines any that exceed their budget
+            state_store: Store of findings from previous runs
+            emit_mode: Which findings to output: `all` or `new`. `new` needs a state store
+            all_matches: Report every distinct match in a field, rather than only the first match of each pattern
+        """
+        if emit_mode not in ['all', 'new']:
+            raise ValueError(f'Emit mode {emit_mode} can\'t be used when scanning profiles')
+        self.logger = logger
+        self.verbose = verbose
+        self.signatures = [sig for sig in signatures if 'messages' in (sig.scope or [])]
+        self.on_finding = on_finding
+        self.pattern_guard = pattern_guard or matcher.PatternGuard()
+        self.engine = matcher.get_engine()
+        self.state_store = state_store
+        self.emit_mode = emit_mode
+        self.all_matches = all_matches
+        self.stats: Dict[str, int] = {'users': 0, 'channels': 0, 'fields': 0, 'matches': 0}
+        self.seen_ids = set()
+
+    def run(self, user_dicts: List[Dict] = None, channel_dicts: List[Dict] = None) -> None:
+        """ Match the fields of the users and channels against the signatures
+
+        Args:
+            user_dicts: Users from users.list
+            channel_dicts: Channels from conversations.list
+        """
+
+        fields = []
+        for user_dict in user_dicts or []:
+            fields.extend(iter_user_fields(user_dict))
+        for channel_dict in channel_dicts or []:
+            fields.extend(iter_channel_fields(channel_dict))
+        self.stats['users'] += len(user_dicts or [])
+        self.stats['channels'] += len(channel_dicts or [])
+        self.stats['fields'] += len(fields)
+        self.logger.log('INFO', f'Scanning {len(fields)} profile fields from {len(user_dicts or [])} users '
+                                f'and {len(channel_dicts or [])} channels')
+        if not fields:
+            return
+
+        # Every field is matched in one batch for each signature
+        texts = [field.text for field in fields]
+        for sig in self.signatures:
+            patterns = matcher.compile_patterns(sig.patterns, self.engine)
+            for index, match_string in matcher.match_texts(patterns, texts, self.pattern_guard, sig.id, self.engine,
+                                                           self.all_matches):
+                self._emit(sig, fields[index], match_string)
+
+    def _emit(self, sig: signature.Signature, field: ProfileField, match_string: str) -> None:
+        object_id = field.object_dict.get('id')
+        watchman_id = profile_watchman_id(match_string, object_id, field.field)
+        if watchman_id in self.seen_ids:
+            return
+        self.seen_ids.add(watchman_id)
+        self.stats['matches'] += 1
+
+        finding = {
+            'match_string': match_string,
+            'field': field.field,
+            'watchman_id': watchman_id
+        }
+        if field.object_type == 'user':
+            finding['user'] = user.create_from_dict(field.object_dict, self.verbose)
+        else:
+            finding['conversation'] = conversation.create_from_dict(field.object_dict, self.verbose)
+
+        unit = WorkUnit(signature=sig, scope=PROFILE_SCOPE, query=object_id)
+        is_new = True
+        if self.state_store:
+            is_new = self.state_store.record_finding(
+                watchman_id=watchman_id,
+                signature_id=sig.id,
+                signature_name=sig.name,
+                severity=sig.severity,
+                scope=unit.state_scope)
+        if self.emit_mode == 'all' or is_new:
+            self.on_finding(unit, finding)
@@ -0,0 +1,68 @@
+import threading
+import time
+from typing import Dict, Tuple
+
+# Requests a minute allowed by each of Slack's rate limit tiers
+RATE_LIMIT_TIERS = {1: 1, 2: 20, 3: 50, 4: 100}
+
+# Rate limit tier of each Slack API method Slack Watchman uses
+METHOD_TIERS = {
+    'search.messages': 2,
+    'search.files': 2,
+    'users.list': 2,
+    'conversations.list': 2,
+    'conversations.info': 3,
+    'conversations.history': 3,
+    'conversations.replies': 3,
+    'files.info': 4,
+    'team.info': 3,
+    'users.info': 4,
+    'auth.teams.list': 2,
+    'auth.test': 4,
+    'apps.connections.open': 1
+}
+
+
+class RateLimiter:
+    """ Keeps requests to the Slack API within Slack's rate limits, so threads sharing a
+    client wait for their turn rather than being rate limited and backing off.
+
+    Slack applies its limits to each method in each workspace separately, so every
+    (method, workspace) pair has its own token bucket. A bucket holds a minute's worth
+    of requests, allowing short bursts, and refills at the rate of the method's tier.
+    Methods without a known tier aren't limited.
+    """
+
+    def __init__(self, tiers: Dict[str, int] = None):
+        """
+        Args:
+            tiers: Rate limit tier of each method. Defaults to METHOD_TIERS
+        """
+        self.tiers = METHOD_TIERS if tiers is None else tiers
+        self._buckets: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def _reserve(self, method: str, team_id: str = None) -> float:
+        """ Take a request from the bucket, returning how many seconds to wait before making it """
+
+        per_minute = RATE_LIMIT_TIERS[self.tiers[method]]
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get((method, team_id), (per_minute, now))
+            tokens = min(per_minute, tokens + (now - updated) * per_minute / 60) - 1
+            self._buckets[(method, team_id)] = (tokens, now)
+        # A negative balance is a queue of requests waiting for the bucket to refill
+        return max(0.0, -tokens * 60 / per_minute)
+
+    def acquire(self, method: str, team_id: str = None) -> None:
+        """ Wait until a request to the method can be made within its rate limit
+
+        Args:
+            method: Slack API method, e.g. search.messages
+            team_id: ID of the workspace the request is for, when using an organisation token
+        """
+
+        if method in self.tiers:
+            delay = self._reserve(method, team_id)
+            if delay:
+                time.sleep(delay)
@@ -0,0 +1,242 @@
+import datetime
+import signal
+import threading
+import time
+import traceback
+from typing import Callable, List, Set
+
+from slack_watchman.loggers import JSONLogger, StdoutLogger
+
+# Allowed (minimum, maximum) values for each field of a cron expression
+_CRON_FIELDS = [
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day of month', 1, 31),
+    ('month', 1, 12),
+    ('day of week', 0, 7),
+]
+
+
+class IntervalSchedule:
+    """ Runs a fixed number of seconds after the previous run finished """
+
+    def __init__(self, seconds: float):
+        """
+        Args:
+            seconds: Seconds to wait between runs
+        Raises:
+            ValueError: If the interval isn't positive
+        """
+        if seconds <= 0:
+            raise ValueError('The interval must be greater than 0')
+        self.seconds = seconds
+
+    def first_run(self, now: float) -> float:
+        """ Epoch time of the first run. Interval schedules start straight away """
+        return now
+
+    def next_run(self, now: float) -> float:
+        """ Epoch time of the next run after `now` """
+        return now + self.seconds
+
+    def __str__(self):
+        return f'every {self.seconds:g} seconds'
+
+
+class CronSchedule:
+    """ Runs at the times matching a standard five field cron expression:
+    minute, hour, day of month, month and day of week, in local time.
+
+    Each field can be `*`, a number, a range `a-b`, a step `*/n` or `a-b/n`,
+    or a comma separated list of these. Day of week 0 and 7 are both Sunday.
+    Like cron, when both day fields are restricted a day matching either is used.
+    """
+
+    def __init__(self, expression: str):
+        """
+        Args:
+            expression: Cron expression, e.g. `*/30 * * * *`
+        Raises:
+            ValueError: If the expression isn't valid
+        """
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != len(_CRON_FIELDS):
+            raise ValueError(f'Cron expression must have {len(_CRON_FIELDS)} fields: {expression}')
+
+        parsed = [_parse_cron_field(field, minimum, maximum)
+                  for field, (_, minimum, maximum) in zip(fields, _CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # Cron counts Sunday as 0 or 7, Python counts Monday as 0
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, dt: datetime.datetime) -> bool:
+        day = dt.day in self.days
+        weekday = dt.weekday() in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def first_run(self, now: float) -> float:
+        """ Epoch time of the first run. Cron schedules wait for the first matching time """
+        return self.next_run(now)
+
+    def next_run(self, now: float) -> float:
+        """ Epoch time of the first matching minute after `now`
+
+        Raises:
+            ValueError: If nothing matches within the next five years, e.g. 30th February
+        """
+
+        dt = datetime.datetime.fromtimestamp(now).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = dt + datetime.timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1) + datetime.timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += datetime.timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        raise ValueError(f'Cron expression never matches: {self.expression}')
+
+    def __str__(self):
+        return f'on cron schedule `{self.expression}`'
+
+
+def _parse_cron_field(field: str, minimum: int, maximum: int) -> Set[int]:
+    values = set()
+    for part in field.split(','):
+        value_range, _, step = part.partition('/')
+        try:
+            step = int(step) if step else 1
+            if value_range == '*':
+                start, end = minimum, maximum
+            elif '-' in value_range:
+                start, end = (int(value) for value in value_range.split('-', 1))
+            else:
+                start = end = int(value_range)
+                if step != 1:
+                    end = maximum
+        except ValueError as e:
+            raise ValueError(f'Invalid cron field: {field}') from e
+        if step < 1 or start < minimum or end > maximum or start > end:
+            raise ValueError(f'Invalid cron field: {field}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def create_schedule(interval: float = None, cron: str = None) -> IntervalSchedule | CronSchedule:
+    """ Create a schedule from a cron expression, or an interval in minutes
+
+    Args:
+        interval: Minutes between runs
+        cron: Cron expression. Takes precedence over the interval
+    Returns:
+        Schedule object
+    """
+
+    if cron:
+        return CronSchedule(cron)
+    return IntervalSchedule(interval * 60)
+
+
+class Daemon:
+    """ Runs a job on a schedule until the process is told to stop.
+
+    SIGHUP asks for the configuration to be reloaded, which happens between runs.
+    SIGINT and SIGTERM stop the daemon once any run in progress has finished.
+    An error in a run is logged, and doesn't stop later runs.
+    """
+
+    def __init__(self,
+                 job: Callable[[], None],
+                 schedule: IntervalSchedule | CronSchedule,
+                 logger: JSONLogger | StdoutLogger,
+                 reload: Callable[[], None] = None):
+        """
+        Args:
+            job: Called for each scheduled run
+            schedule: When to run the job
+            logger: Logging object
+            reload: Called to reload the configuration after a SIGHUP
+        """
+        self.job = job
+        self.schedule = schedule
+        self.logger = logger
+        self.reload = reload
+        self.runs = 0
+        self._stop_requested = False
+        self._reload_requested = False
+        self._wake = threading.Event()
+
+    def request_reload(self, *_) -> None:
+        """ Reload the configuration before the next run. Used as the SIGHUP handler """
+        self._reload_requested = True
+        self._wake.set()
+
+    def request_stop(self, *_) -> None:
+        """ Stop once any run in progress has finished. Used as the SIGINT and SIGTERM handler """
+        self._stop_requested = True
+        self._wake.set()
+
+    def _install_signal_handlers(self) -> List:
+        handlers = []
+        for signal_name, handler in [('SIGHUP', self.request_reload),
+                                     ('SIGTERM', self.request_stop),
+                                     ('SIGINT', self.request_stop)]:
+            # SIGHUP isn't available on Windows
+            signal_number = getattr(signal, signal_name, None)
+            if signal_number is not None:
+                handlers.append((signal_number, signal.signal(signal_number, handler)))
+        return handlers
+
+    def run(self, max_runs: int = None) -> None:
+        """ Run the job on its schedule, blocking until stopped
+
+        Args:
+            max_runs: Stop after this many runs. Runs until stopped by a signal if not given
+        """
+
+        in_main_thread = threading.current_thread() is threading.main_thread()
+        previous_handlers = self._install_signal_handlers() if in_main_thread else []
+        try:
+            next_run = self.schedule.first_run(time.time())
+            self.logger.log('INFO', f'Running in daemon mode {self.schedule}')
+            while not self._stop_requested:
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self._run_safely('Reloading configuration', self.reload)
+
+                now = time.time()
+                if now >= next_run:
+                    self._run_safely('Starting scheduled scan', self.job)
+                    self.runs += 1
+                    if max_runs is not None and self.runs >= max_runs:
+                        break
+                    next_run = self.schedule.next_run(time.time())
+                    self.logger.log(
+                        'INFO', f'Next scan at {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(next_run))}')
+                    continue
+
+                self._wake.wait(next_run - now)
+                self._wake.clear()
+            self.logger.log('INFO', 'Daemon stopped')
+        finally:
+            for signal_number, handler in previous_handlers:
+                signal.signal(signal_number, handler)
+
+    def _run_safely(self, description: str, func: Callable[[], None] | None) -> None:
+        if func is None:
+            return
+        self.logger.log('INFO', description)
+        try:
+            func()
+        except Exception as e:
+            self.logger.log('ERROR', f'{description} failed: {e}')
+            self.logger.log('DEBUG', traceback.format_exc())
@@ -0,0 +1,324 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+STATE_DB_NAME = 'slack_watchman.db'
+
+
+class StateStore:
+    """ Local SQLite store for state kept between runs of Slack Watchman.
+
+    Watermarks record the newest timestamp scanned for each signature, query and scope,
+    so later runs only need to search for anything newer.
+
+    Findings are recorded by their `watchman_id` with the time they were first and last
+    seen, so findings already reported by a previous run can be told apart from new ones.
+
+    Query yields record how many pages of results each work unit has fetched and how
+    many findings they produced, so the most productive searches can be run first.
+
+    The checkpoint records the progress of the current scan: the next page to fetch for each
+    work unit, and the findings already emitted, so an interrupted scan can be resumed.
+    """
+
+    def __init__(self, state_dir: str):
+        """
+        Args:
+            state_dir: Directory to keep the state database in. Created if it doesn't exist
+        """
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, STATE_DB_NAME)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS watermarks ('
+                'signature_id TEXT NOT NULL, '
+                'query TEXT NOT NULL, '
+                'scope TEXT NOT NULL, '
+                'timestamp REAL NOT NULL, '
+                'PRIMARY KEY (signature_id, query, scope))')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS findings ('
+                'watchman_id TEXT PRIMARY KEY, '
+                'signature_id TEXT NOT NULL, '
+                'signature_name TEXT, '
+                'severity TEXT, '
+                'scope TEXT NOT NULL, '
+                'posted_at REAL, '
+                'first_seen REAL NOT NULL, '
+                'last_seen REAL NOT NULL, '
+                'resolved_at REAL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS findings_by_signature ON findings (signature_id, scope, last_seen)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS query_yields ('
+                'unit_key TEXT PRIMARY KEY, '
+                'pages INTEGER NOT NULL, '
+                'findings INTEGER NOT NULL)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoint ('
+                'key TEXT PRIMARY KEY, '
+                'value TEXT NOT NULL)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoint_units ('
+                'unit_key TEXT PRIMARY KEY, '
+                'next_page INTEGER NOT NULL, '
+                'completed INTEGER NOT NULL, '
+                'newest REAL, '
+                'resume_before REAL)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoint_findings ('
+                'watchman_id TEXT PRIMARY KEY)')
+
+    def get_watermark(self, signature_id: str, query: str, scope: str) -> Optional[float]:
+        """ Get the newest timestamp scanned for a signature query
+
+        Args:
+            signature_id: ID of the signature
+            query: Search query
+            scope: Scope searched, e.g. messages or files
+        Returns:
+            Epoch timestamp, or None if the query hasn't been scanned before
+        """
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT timestamp FROM watermarks WHERE signature_id = ? AND query = ? AND scope = ?',
+                (signature_id, query, scope)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, signature_id: str, query: str, scope: str, timestamp: float) -> None:
+        """ Record the newest timestamp scanned for a signature query. The watermark is
+        never moved backwards.
+
+        Args:
+            signature_id: ID of the signature
+            query: Search query
+            scope: Scope searched, e.g. messages or files
+            timestamp: Epoch timestamp of the newest item scanned
+        """
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO watermarks (signature_id, query, scope, timestamp) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (signature_id, query, scope) DO UPDATE SET '
+                'timestamp = MAX(timestamp, excluded.timestamp)',
+                (signature_id, query, scope, timestamp))
+
+    # pylint: disable=too-many-arguments
+    def record_finding(self,
+                       *,
+                       watchman_id: str,
+                       signature_id: str,
+                       signature_name: str,
+                       severity: str,
+                       scope: str,
+                       posted_at: float = None,
+                       seen_at: float = None,
+                       emitted: bool = False) -> bool:
+        """ Record that a finding has been seen, updating its last seen time if it is already known
+
+        Args:
+            watchman_id: ID of the finding
+            signature_id: ID of the signature that matched
+            signature_name: Name of the signature that matched
+            severity: Severity of the signature
+            scope: Scope the finding was found in, e.g. messages or files
+            posted_at: Epoch timestamp of the message or file the finding is in
+            seen_at: Epoch time the finding was seen. Defaults to now
+            emitted: Also record that the finding has been emitted by the current scan, in the
+                same transaction, so the two can't get out of step if the scan is interrupted
+        Returns:
+            True if the finding is new, or had previously been resolved and has been found again
+        """
+
+        seen_at = seen_at or time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT resolved_at FROM findings WHERE watchman_id = ?', (watchman_id,)).fetchone()
+            if row is None:
+                self._connection.execute(
+                    'INSERT INTO findings (watchman_id, signature_id, signature_name, severity, scope, '
+                    'posted_at, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (watchman_id, signature_id, signature_name, str(severity), scope, posted_at, seen_at, seen_at))
+            else:
+                self._connection.execute(
+                    'UPDATE findings SET last_seen = ?, resolved_at = NULL WHERE watchman_id = ?',
+                    (seen_at, watchman_id))
+            if emitted:
+                self._connection.execute(
+                    'INSERT OR IGNORE INTO checkpoint_findings (watchman_id) VALUES (?)', (watchman_id,))
+            return row is None or row[0] is not None
+
+    def is_new_finding(self, watchman_id: str) -> bool:
+        """ Whether a finding hasn't been seen before, or has been resolved since it was last seen.
+        Nothing is recorded, so this can be checked before deciding whether to output a finding
+
+        Args:
+            watchman_id: ID of the finding
+        Returns:
+            True if record_finding would treat the finding as new
+        """
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT resolved_at FROM findings WHERE watchman_id = ?', (watchman_id,)).fetchone()
+        return row is None or row[0] is not None
+
+    def resolve_findings(self,
+                         signature_id: str,
+                         scope: str,
+                         posted_after: float,
+                         seen_before: float) -> List[Dict]:
+        """ Mark findings as resolved if they were posted in a window that has been scanned,
+        but weren't seen by the scan. Each finding is only resolved once.
+
+        Args:
+            signature_id: ID of the signature scanned
+            scope: Scope scanned, e.g. messages or files
+            posted_after: Start of the window scanned, as an epoch timestamp
+            seen_before: Epoch time the scan started
+        Returns:
+            List of the findings that have been resolved
+        """
+
+        resolved_at = time.time()
+        with self._lock, self._connection:
+            rows = self._connection.execute(
+                'SELECT watchman_id, signature_id, signature_name, severity, scope, posted_at, first_seen, '
+                'last_seen FROM findings WHERE signature_id = ? AND scope = ? AND last_seen < ? '
+                'AND posted_at >= ? AND resolved_at IS NULL',
+                (signature_id, scope, seen_before, posted_after)).fetchall()
+            self._connection.executemany(
+                'UPDATE findings SET resolved_at = ? WHERE watchman_id = ?',
+                [(resolved_at, row[0]) for row in rows])
+
+        columns = ['watchman_id', 'signature_id', 'signature_name', 'severity', 'scope', 'posted_at',
+                   'first_seen', 'last_seen']
+        return [dict(zip(columns, row)) for row in rows]
+
+    def record_query_yield(self, unit_key: str, pages: int, findings: int) -> None:
+        """ Add the pages fetched and findings produced by a work unit in a run to its totals
+
+        Args:
+            unit_key: Key of the work unit
+            pages: Pages of results fetched
+            findings: Findings emitted
+        """
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO query_yields (unit_key, pages, findings) VALUES (?, ?, ?) '
+                'ON CONFLICT (unit_key) DO UPDATE SET '
+                'pages = pages + excluded.pages, findings = findings + excluded.findings',
+                (unit_key, pages, findings))
+
+    def get_query_yields(self) -> Dict[str, float]:
+        """ Get the findings produced per page of results for every work unit that has been run
+
+        Returns:
+            Dict of work unit key to findings per page
+        """
+
+        with self._lock:
+            rows = self._connection.execute('SELECT unit_key, pages, findings FROM query_yields').fetchall()
+        return {unit_key: findings / pages for unit_key, pages, findings in rows if pages}
+
+    def start_checkpoint(self, info: Dict[str, Any]) -> None:
+        """ Start a new checkpoint, replacing any previous one
+
+        Args:
+            info: Details of the scan needed to resume it, e.g. the timeframe. Must be JSON serialisable
+        """
+
+        with self._lock, self._connection:
+            self._clear_checkpoint()
+            self._connection.executemany(
+                'INSERT INTO checkpoint (key, value) VALUES (?, ?)',
+                [(key, json.dumps(value)) for key, value in info.items()])
+
+    def get_checkpoint(self) -> Optional[Dict[str, Any]]:
+        """ Get the details of the scan the checkpoint is for
+
+        Returns:
+            Details passed to start_checkpoint, or None if there is no checkpoint
+        """
+
+        with self._lock:
+            rows = self._connection.execute('SELECT key, value FROM checkpoint').fetchall()
+        return {key: json.loads(value) for key, value in rows} if rows else None
+
+    def clear_checkpoint(self) -> None:
+        """ Remove the checkpoint, once a scan has finished """
+        with self._lock, self._connection:
+            self._clear_checkpoint()
+
+    def _clear_checkpoint(self) -> None:
+        for table in ['checkpoint', 'checkpoint_units', 'checkpoint_findings']:
+            self._connection.execute(f'DELETE FROM {table}')
+
+    # pylint: disable=too-many-positional-arguments, too-many-arguments
+    def save_unit_progress(self,
+                           unit_key: str,
+                           next_page: int,
+                           completed: bool,
+                           newest: float = None,
+                           resume_before: float = None) -> None:
+        """ Record how far through its search a work unit is
+
+        Args:
+            unit_key: Key of the work unit
+            next_page: First page that hasn't been fully processed
+            completed: Whether every page has been processed
+            newest: Epoch timestamp of the newest result processed, used for its watermark
+            resume_before: Epoch timestamp of the oldest result on the pages processed, for
+                results paged newest first, so paging can carry on from it
+        """
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO checkpoint_units (unit_key, next_page, completed, newest, resume_before) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (unit_key, next_page, int(completed), newest, resume_before))
+
+    def get_unit_progress(self, unit_key: str) -> Optional[Tuple[int, bool, Optional[float], Optional[float]]]:
+        """ Get how far through its search a work unit got
+
+        Args:
+            unit_key: Key of the work unit
+        Returns:
+            Tuple of the next page to process, whether it was completed, the newest timestamp
+            processed and the timestamp to carry on paging before, or None if it has no
+            progress recorded
+        """
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT next_page, completed, newest, resume_before FROM checkpoint_units WHERE unit_key = ?',
+                (unit_key,)).fetchone()
+        return (row[0], bool(row[1]), row[2], row[3]) if row else None
+
+    def record_emitted(self, watchman_id: str) -> None:
+        """ Record that a finding has been emitted by the current scan """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR IGNORE INTO checkpoint_findings (watchman_id) VALUES (?)', (watchman_id,))
+
+    def was_emitted(self, watchman_id: str) -> bool:
+        """ Whether a finding has already been emitted by the current scan """
+        with self._lock:
+            return self._connection.execute(
+                'SELECT 1 FROM checkpoint_findings WHERE watchman_id = ?', (watchman_id,)).fetchone() is not None
+
+    def close(self) -> None:
+        """ Close the connection to the state database """
+        with self._lock:
+            self._connection.close()
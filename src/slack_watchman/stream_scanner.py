@@ -0,0 +1,314 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from slack_watchman import matcher
+from slack_watchman.clients.slack_client import SlackClient, get_timestamp
+from slack_watchman.loggers import JSONLogger, StdoutLogger
+from slack_watchman.message_text import flatten_message
+from slack_watchman.models import post, signature
+from slack_watchman.models.work_unit import WorkUnit
+from slack_watchman.state import StateStore
+from slack_watchman.utils import convert_timestamp
+from slack_watchman.watchman_id import file_watchman_id, message_watchman_id
+from slack_watchman.watchman_processor import DirectoryCache
+
+try:
+    import websocket
+except ImportError:  # pragma: no cover
+    websocket = None
+
+# Message subtypes that don't carry new content to match
+IGNORED_SUBTYPES = ['message_deleted', 'channel_join', 'channel_leave']
+
+# Seconds to wait before reconnecting after a Socket Mode connection drops
+RECONNECT_SECONDS = 5
+
+# Number of the most recent watchman_ids remembered to drop repeated findings, so memory use
+# stays flat however long a stream runs. Repeats are redelivered or edited messages, which
+# arrive soon after the original
+MAX_SEEN_IDS = 100000
+
+
+def unwrap_event(envelope: Dict) -> Optional[Dict]:
+    """ Get the event from a Socket Mode envelope or Events API callback. Events
+    that aren't wrapped are returned as they are
+
+    Args:
+        envelope: Envelope, callback or event
+    Returns:
+        The event, or None if the envelope doesn't contain one
+    """
+
+    if 'payload' in envelope:
+        envelope = envelope.get('payload') or {}
+    if 'event' in envelope:
+        return envelope.get('event')
+    return envelope if envelope.get('type') else None
+
+
+def iter_event_feed(feed: TextIO) -> Iterator[Dict]:
+    """ Read events from a local feed with one JSON event, Events API callback or Socket
+    Mode envelope on each line. Blank lines are skipped
+
+    Args:
+        feed: Open file or stdin to read from
+    Returns:
+        Each event in the feed, as soon as its line is read
+    """
+
+    for line in feed:
+        if line.strip():
+            event = unwrap_event(json.loads(line))
+            if event:
+                yield event
+
+
+class SocketModeClient:
+    """ Receives events from Slack over Socket Mode, reconnecting whenever the connection
+    is closed. Each envelope is acknowledged as soon as it is received, before the event
+    is matched, so Slack doesn't send it again.
+
+    Socket Mode needs the optional `websocket-client` package, installed with the `stream`
+    extra, and an app-level token.
+    """
+
+    def __init__(self,
+                 slack: SlackClient,
+                 logger: JSONLogger | StdoutLogger,
+                 connect: Callable[[str], Any] = None,
+                 reconnect_seconds: float = RECONNECT_SECONDS):
+        """
+        Args:
+            slack: Slack API object using an app-level token
+            logger: Logging object
+            connect: Opens a WebSocket connection to a URL. Defaults to websocket.create_connection
+            reconnect_seconds: Seconds to wait before reconnecting after an error
+        """
+        if connect is None and websocket is None:
+            raise ImportError('The websocket-client package must be installed to use Socket Mode, '
+                              'e.g. with pip install slack-watchman[stream]')
+        self.slack = slack
+        self.logger = logger
+        self.connect = connect or websocket.create_connection
+        self.reconnect_seconds = reconnect_seconds
+        self.stopped = False
+
+    def iter_events(self) -> Iterator[Dict]:
+        """ Receive events until stopped
+
+        Returns:
+            Each event as soon as it is received
+        """
+
+        while not self.stopped:
+            try:
+                connection = self.connect(self.slack.open_socket_connection())
+            except Exception as e:
+                self.logger.log('WARNING', f'Couldn\'t connect to Socket Mode, retrying: {e}')
+                time.sleep(self.reconnect_seconds)
+                continue
+            try:
+                yield from self._iter_connection(connection)
+            except Exception as e:
+                self.logger.log('WARNING', f'Socket Mode connection lost, reconnecting: {e}')
+                time.sleep(self.reconnect_seconds)
+            finally:
+                connection.close()
+
+    def _iter_connection(self, connection: Any) -> Iterator[Dict]:
+        while not self.stopped:
+            raw = connection.recv()
+            if not raw:
+                return
+            envelope = json.loads(raw)
+            if envelope.get('envelope_id'):
+                connection.send(json.dumps({'envelope_id': envelope.get('envelope_id')}))
+            if envelope.get('type') == 'hello':
+                self.logger.log('INFO', 'Connected to Socket Mode')
+            elif envelope.get('type') == 'disconnect':
+                # Slack asks clients to reconnect before it refreshes a connection
+                self.logger.log('DEBUG', f'Socket Mode disconnect requested: {envelope.get("reason")}')
+                return
+            elif envelope.get('type') == 'events_api':
+                event = unwrap_event(envelope)
+                if event:
+                    yield event
+
+    def stop(self) -> None:
+        """ Stop receiving events once the current one has been handled """
+        self.stopped = True
+
+
+# pylint: disable=too-many-instance-attributes
+class StreamScanner:
+    """ Matches messages and files from a stream of events against the signatures as they
+    arrive, rather than searching for them afterwards.
+
+    Patterns are compiled once, and each event is matched and output as soon as it is
+    received. Users and conversations are enriched from a DirectoryCache, which should be
+    primed with the users and channels of the workspace before the stream starts, so a
+    burst of events doesn't cause a burst of lookups.
+
+    Findings have the same `watchman_id` and format as a search, and are reported against
+    a work unit for the signature that matched, with the conversation ID as its query.
+    """
+
+    # pylint: disable=too-many-positional-arguments, too-many-arguments
+    def __init__(self,
+                 logger: JSONLogger | StdoutLogger,
+                 verbose: bool,
+                 signatures: List[signature.Signature],
+                 on_finding: Callable[[WorkUnit, Dict], None],
+                 directory: DirectoryCache,
+                 workspace_url: str = None,
+                 pattern_guard: matcher.PatternGuard = None,
+                 state_store: StateStore = None,
+                 emit_mode: str = 'all',
+                 all_matches: bool = False):
+        """
+        Args:
+            logger: Logging object
+            verbose: Whether to use verbose logging or not
+            signatures: Signatures to match messages and files against
+            on_finding: Called with the work unit and finding for each unique finding
+            directory: Cache of users and conversations to enrich findings with
+            workspace_url: URL of the workspace, used to link to messages
+            pattern_guard: Records the cost of each pattern and quarantines any that exceed their budget
+            state_store: Store of findings from previous runs
+            emit_mode: Which findings to output: `all` or `new`. `new` needs a state store
+            all_matches: Report every distinct match in a message, rather than only the first match of each pattern
+        """
+        if emit_mode not in ['all', 'new']:
+            raise ValueError(f'Emit mode {emit_mode} can\'t be used when streaming events')
+        self.logger = logger
+        self.verbose = verbose
+        self.engine = matcher.get_engine()
+        self.message_signatures = [(sig, matcher.compile_patterns(sig.patterns, self.engine))
+                                   for sig in signatures if 'messages' in (sig.scope or [])]
+        self.file_signatures = [sig for sig in signatures if 'files' in (sig.scope or [])]
+        self.on_finding = on_finding
+        self.directory = directory
+        self.workspace_url = workspace_url
+        self.pattern_guard = pattern_guard or matcher.PatternGuard()
+        self.state_store = state_store
+        self.emit_mode = emit_mode
+        self.all_matches = all_matches
+        self.stats: Dict[str, int] = {'events': 0, 'messages': 0, 'files': 0, 'matches': 0}
+        self.max_latency = 0.0
+        self.seen_ids: OrderedDict[str, None] = OrderedDict()
+        self.max_seen_ids = MAX_SEEN_IDS
+
+    def run(self, events: Iterable[Dict]) -> None:
+        """ Match each event as it arrives, until the events run out
+
+        Args:
+            events: Slack events, e.g. from a SocketModeClient or iter_event_feed
+        """
+
+        for event in events:
+            try:
+                self.handle_event(event)
+            except Exception as e:
+                self.logger.log('WARNING', f'Couldn\'t match {event.get("type")} event: {e}')
+
+    def handle_event(self, event: Dict) -> None:
+        """ Match a single event, outputting any findings before returning
+
+        Args:
+            event: Slack event
+        """
+
+        received = time.perf_counter()
+        self.stats['events'] += 1
+        if event.get('type') != 'message' or event.get('subtype') in IGNORED_SUBTYPES:
+            return
+        message = event
+        if event.get('subtype') == 'message_changed':
+            # Only the new text of an edited message needs matching
+            message = {**(event.get('message') or {}), 'channel': event.get('channel')}
+
+        self.stats['messages'] += 1
+        self._match_message(message)
+        for file_dict in message.get('files') or []:
+            self.stats['files'] += 1
+            self._match_file(message, file_dict)
+        self.max_latency = max(self.max_latency, time.perf_counter() - received)
+
+    def _match_message(self, message: Dict) -> None:
+        enriched = None
+        flat_text = flatten_message(message)
+        for sig, patterns in self.message_signatures:
+            for _, match_string in matcher.match_texts(patterns, [flat_text.text], self.pattern_guard, sig.id,
+                                                       self.engine, self.all_matches):
+                watchman_id = message_watchman_id(match_string, message.get('ts'))
+                if not self._claim(watchman_id):
+                    continue
+                # Only enriched once the message has a finding, and once for all of its findings
+                enriched = enriched or self._enrich_message(message)
+                self._emit(WorkUnit(signature=sig, scope='messages', query=message.get('channel')), {
+                    'match_string': match_string,
+                    'match_location': flat_text.locate_match(match_string),
+                    'message': enriched,
+                    'watchman_id': watchman_id
+                }, get_timestamp(message))
+
+    def _match_file(self, message: Dict, file_dict: Dict) -> None:
+        name = (file_dict.get('name') or '').lower()
+        for sig in self.file_signatures:
+            if not any(search_string.replace('"', '').lower() in name for search_string in sig.search_strings or []):
+                continue
+            if sig.file_types and not any(file_type.lower() in (file_dict.get('filetype') or '').lower()
+                                          for file_type in sig.file_types):
+                continue
+            watchman_id = file_watchman_id(convert_timestamp(file_dict.get('created')),
+                                            file_dict.get('permalink_public'))
+            if not self._claim(watchman_id):
+                continue
+            u = self.directory.get_user(file_dict.get('user')) if file_dict.get('user') else None
+            self._emit(WorkUnit(signature=sig, scope='files', query=message.get('channel')), {
+                'file': post.create_file_from_dict({**file_dict, 'user': u}),
+                'user': u,
+                'watchman_id': watchman_id
+            }, get_timestamp(file_dict))
+
+    def _claim(self, watchman_id: str) -> bool:
+        if watchman_id in self.seen_ids:
+            self.seen_ids.move_to_end(watchman_id)
+            return False
+        self.seen_ids[watchman_id] = None
+        if len(self.seen_ids) > self.max_seen_ids:
+            # Forget the least recently seen
+            self.seen_ids.popitem(last=False)
+        return True
+
+    def _permalink(self, message: Dict) -> Optional[str]:
+        if not self.workspace_url or not message.get('channel') or not message.get('ts'):
+            return None
+        return f'{self.workspace_url.rstrip("/")}/archives/{message.get("channel")}/' \
+               f'p{message.get("ts").replace(".", "")}'
+
+    def _enrich_message(self, message: Dict) -> post.Message:
+        u = self.directory.get_user(message.get('user')) if message.get('user') else message.get('username')
+        c = self.directory.get_conversation(message.get('channel')) if message.get('channel') else None
+        return post.create_message_from_dict({
+            **message,
+            'user': u,
+            'conversation': c,
+            'permalink': message.get('permalink') or self._permalink(message)
+        })
+
+    def _emit(self, unit: WorkUnit, finding: Dict, posted_at: float) -> None:
+        self.stats['matches'] += 1
+        is_new = True
+        if self.state_store:
+            is_new = self.state_store.record_finding(
+                watchman_id=finding.get('watchman_id'),
+                signature_id=unit.signature.id,
+                signature_name=unit.signature.name,
+                severity=unit.signature.severity,
+                scope=unit.state_scope,
+                posted_at=posted_at or None)
+        if self.emit_mode == 'all' or is_new:
+            self.on_finding(unit, finding)
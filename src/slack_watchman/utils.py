@@ -1,5 +1,6 @@
 import dataclasses
 import json
+import time
 from datetime import datetime, timezone
 from typing import List, Dict, Any
 
@@ -30,6 +31,22 @@ def convert_timestamp(timestamp: str or int) -> str or None:
         return None
 
 
+def is_date(timeframe: str) -> bool:
+    """ Check whether a timeframe is a date rather than a relative period
+
+    Args:
+        timeframe: Timeframe to check, e.g. `2024-01-01` or `7d`
+    Returns:
+        True if the timeframe is a date in the format YYYY-mm-dd, otherwise False
+    """
+
+    try:
+        time.strptime(timeframe, '%Y-%m-%d')
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
 def convert_to_dict(obj: Any) -> Dict:
     """ Returns a dictionary object from a dataclass object or a dict
     containing nested dataclass objects.
@@ -0,0 +1,50 @@
+import hashlib
+
+
+def message_watchman_id(match_string: str, timestamp: str) -> str:
+    """ Generate the watchman_id for a message finding
+
+    Args:
+        match_string: The string that matched
+        timestamp: The raw `ts` of the message
+    Returns:
+        MD5 hex digest identifying the finding across runs
+    """
+    return hashlib.md5(f'{match_string}.{timestamp}'.encode()).hexdigest()
+
+
+def file_watchman_id(created: str, permalink_public: str) -> str:
+    """ Generate the watchman_id for a file finding
+
+    Args:
+        created: Created time of the file, as converted by convert_timestamp
+        permalink_public: Public permalink of the file
+    Returns:
+        MD5 hex digest identifying the finding across runs
+    """
+    return hashlib.md5(f'{created}.{permalink_public}'.encode()).hexdigest()
+
+
+def file_content_watchman_id(match_string: str, file_id: str) -> str:
+    """ Generate the watchman_id for a match in the content of a file or canvas from the match and the file ID
+
+    Args:
+        match_string: The string that matched
+        file_id: ID of the file or canvas the match was found in
+    Returns:
+        MD5 hex digest identifying the finding across runs
+    """
+    return hashlib.md5(f'{match_string}.{file_id}'.encode()).hexdigest()
+
+
+def profile_watchman_id(match_string: str, object_id: str, field: str) -> str:
+    """ Generate the watchman_id for a match in a user profile or channel field
+
+    Args:
+        match_string: The string that matched
+        object_id: ID of the user or channel the field belongs to
+        field: Name of the field the match was found in
+    Returns:
+        MD5 hex digest identifying the finding across runs
+    """
+    return hashlib.md5(f'{match_string}.{object_id}.{field}'.encode()).hexdigest()
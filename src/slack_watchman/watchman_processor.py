@@ -1,15 +1,33 @@
+# pylint: disable=too-many-lines
 import dataclasses
 import hashlib
 import json
-import multiprocessing
-import re
-from typing import List, Dict
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import (
+    Any,
+    List,
+    Dict,
+    Callable,
+    Iterable,
+    Iterator,
+    MutableMapping,
+    Optional,
+    Set,
+    Tuple
+)
 
 import requests
 from bs4 import BeautifulSoup
 
-from slack_watchman.clients.slack_client import SlackClient
+from slack_watchman import matcher
+from slack_watchman.budget import RunBudget
+from slack_watchman.clients.slack_client import SlackClient, get_timestamp
+from slack_watchman.file_content import FileContentReader
 from slack_watchman.loggers import StdoutLogger, JSONLogger
+from slack_watchman.message_text import FlatText, flatten_message
 from slack_watchman.models import (
     signature,
     user,
@@ -17,7 +35,18 @@ from slack_watchman.models import (
     conversation,
     auth_vars
 )
-from slack_watchman.utils import deduplicate_results
+from slack_watchman.models.work_unit import WorkUnit
+from slack_watchman.pipeline import Pipeline, Stage
+from slack_watchman.state import StateStore
+from slack_watchman.utils import deduplicate_results, convert_timestamp, is_date
+from slack_watchman.watchman_id import file_content_watchman_id, file_watchman_id, message_watchman_id
+
+# Which findings a scan emits when it has a state store: every finding, only findings
+# not seen by a previous run, or new findings plus findings that have been resolved
+EMIT_MODES = ('all', 'new', 'new-resolved')
+
+# Scores for signatures that give their severity as a name rather than a number
+SEVERITY_NAMES = {'critical': 100, 'high': 75, 'medium': 50, 'low': 25, 'info': 0}
 
 
 def initiate_slack_connection(auth_info: auth_vars.AuthVars) -> SlackClient:
@@ -38,6 +67,18 @@ def initiate_slack_connection(auth_info: auth_vars.AuthVars) -> SlackClient:
     return SlackClient(token=auth_info.token)
 
 
+def list_users(slack: SlackClient) -> List[Dict]:
+    """ Return the raw JSON data of all active users in the instance
+
+    Args:
+        slack: Slack API connection
+    Returns:
+        List of user dicts from the Slack API, including their profiles
+    """
+
+    return [u for u in slack.cursor_api_search('users.list', 'members') if not u.get('deleted')]
+
+
 def get_users(slack: SlackClient, verbose: bool) -> List[user.User]:
     """ Return a list of all active users in the instance
 
@@ -48,9 +89,19 @@ def get_users(slack: SlackClient, verbose: bool) -> List[user.User]:
         List of User objects
     """
 
-    users = slack.cursor_api_search('users.list', 'members')
+    return [user.create_from_dict(u, verbose) for u in list_users(slack)]
+
+
+def list_channels(slack: SlackClient) -> List[Dict]:
+    """ Return the raw JSON data of all channels in the instance
 
-    return [user.create_from_dict(u, verbose) for u in users if not u.get('deleted')]
+    Args:
+        slack: Slack API object
+    Returns:
+        List of conversation dicts from the Slack API, including their topics and purposes
+    """
+
+    return slack.cursor_api_search('conversations.list', 'channels')
 
 
 def get_channels(slack: SlackClient,
@@ -64,15 +115,797 @@ def get_channels(slack: SlackClient,
         List of Conversation objects
     """
 
-    conversations = slack.cursor_api_search('conversations.list', 'channels')
-    return [conversation.create_from_dict(item, verbose) for item in conversations]
+    return [conversation.create_from_dict(item, verbose) for item in list_channels(slack)]
+
+
+class DirectoryCache:
+    """ Cache of the users and conversations looked up when enriching findings.
+    A user or channel that appears in many findings is only requested from the
+    Slack API once. The cache is shared by all enrichment threads.
+    """
+
+    def __init__(self, slack: SlackClient, verbose: bool):
+        self.slack = slack
+        self.verbose = verbose
+        self._users = {}
+        self._conversations = {}
+
+    def prime(self, user_dicts: List[Dict] = None, conversation_dicts: List[Dict] = None) -> None:
+        """ Fill the cache from users and conversations already listed, so they aren't
+        looked up one at a time
+
+        Args:
+            user_dicts: Users from users.list
+            conversation_dicts: Conversations from conversations.list
+        """
+
+        for user_dict in user_dicts or []:
+            self._users[user_dict.get('id')] = user.create_from_dict(user_dict, self.verbose)
+        for conversation_dict in conversation_dicts or []:
+            self._conversations[conversation_dict.get('id')] = conversation.create_from_dict(
+                conversation_dict, self.verbose)
+
+    def get_user(self, user_id: str) -> user.User | user.UserSuccinct:
+        """ Get a user by ID, from the cache if it has already been looked up
+
+        Args:
+            user_id: ID of the user
+        Returns:
+            User object
+        """
+
+        if user_id not in self._users:
+            user_dict = self.slack.get_user_info(user_id).get('user')
+            self._users[user_id] = user.create_from_dict(user_dict, self.verbose)
+        return self._users[user_id]
+
+    def get_conversation(self, conversation_id: str) -> conversation.Conversation | conversation.ConversationSuccinct:
+        """ Get a conversation by ID, from the cache if it has already been looked up
+
+        Args:
+            conversation_id: ID of the conversation
+        Returns:
+            Conversation object
+        """
+
+        if conversation_id not in self._conversations:
+            channel_dict = self.slack.get_conversation_info(conversation_id).get('channel')
+            self._conversations[conversation_id] = conversation.create_from_dict(channel_dict, self.verbose)
+        return self._conversations[conversation_id]
+
+
+def plan_work_units(signatures: List[signature.Signature],
+                    scopes: List[str] = None,
+                    team_ids: List[str] = None) -> List[WorkUnit]:
+    """ Break signatures down into work units, one for each search string in each scope
+
+    Args:
+        signatures: Signatures to plan work for
+        scopes: Only plan work for these scopes. Defaults to the scopes of each signature
+        team_ids: Workspaces in an Enterprise Grid organisation to plan work for. Each search is
+            planned once per workspace, taking turns between workspaces, so they are searched
+            fairly. Defaults to the workspace of the token
+    Returns:
+        List of WorkUnit objects
+    """
+
+    work_units = []
+    for sig in signatures:
+        for scope in sig.scope or []:
+            if scope not in ('messages', 'files') or (scopes and scope not in scopes):
+                continue
+            for query in sig.search_strings or []:
+                for team_id in team_ids or [None]:
+                    work_units.append(WorkUnit(signature=sig, scope=scope, query=query, team_id=team_id))
+    return work_units
+
+
+def search_after(timeframe: str, watermark: float = None) -> str:
+    """ Get the date to search after, so only results newer than the watermark are returned
+
+    Args:
+        timeframe: Date to search after, as YYYY-MM-DD
+        watermark: Epoch timestamp of the newest result already scanned
+    Returns:
+        Date to use in the `after:` search modifier
+    """
+
+    if not watermark:
+        return timeframe
+    # Slack only searches by date, and `after:` excludes the date given
+    return max(timeframe, time.strftime('%Y-%m-%d', time.localtime(watermark - 86400)))
+
+
+def severity_score(sig: signature.Signature) -> int:
+    """ Get the severity of a signature as a number, so signatures can be ranked
+
+    Args:
+        sig: Signature to score
+    Returns:
+        Severity score, where higher is more severe. 0 if the severity isn't known
+    """
+
+    try:
+        return int(sig.severity)
+    except (TypeError, ValueError):
+        return SEVERITY_NAMES.get(str(sig.severity).lower(), 0)
+
+
+def prioritise_work_units(work_units: List[WorkUnit],
+                          query_yields: Dict[str, float] = None) -> List[WorkUnit]:
+    """ Order work units so the most valuable are searched, and their findings emitted, first.
+    Units are ordered by the severity of their signature, highest first. If historical yields
+    are given, units with the same severity are ordered by the findings each page of results
+    produced in previous runs, with units that haven't been run before first. Otherwise the
+    planned order is kept.
+
+    Args:
+        work_units: Planned work units
+        query_yields: Findings per page of results for each work unit key, from previous runs
+    Returns:
+        List of WorkUnit objects in the order to search them
+    """
+
+    query_yields = query_yields or {}
+    return sorted(
+        work_units,
+        key=lambda unit: (-severity_score(unit.signature), -query_yields.get(unit.key, float('inf'))))
+
+
+def shard_work_units(work_units: List[WorkUnit],
+                     shard_index: int,
+                     shard_count: int) -> List[WorkUnit]:
+    """ Select the work units for one shard of a scan split across several nodes
+
+    Units are assigned by rendezvous hashing of their signature and scope: each unit goes to
+    the shard with the highest hash of the shard number, signature ID and scope. The assignment
+    only depends on the unit itself, so every node picks the same units for a shard regardless
+    of the order they were planned in, and changing the shard count only moves the units that
+    have to move. All the queries for a signature and scope stay on the same node, so findings
+    returned by more than one query are still only emitted once.
+
+    Args:
+        work_units: All planned work units
+        shard_index: Index of this shard, from 0 to shard_count - 1
+        shard_count: Total number of shards
+    Returns:
+        List of the WorkUnit objects in this shard
+    Raises:
+        ValueError: If the shard index isn't valid for the shard count
+    """
+
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError(f'Shard index must be between 0 and {shard_count - 1}')
+
+    def shard_for(unit: WorkUnit) -> int:
+        # History units have no signature, so are sharded by conversation instead
+        group = unit.signature.id if unit.signature else unit.query
+        return max(range(shard_count), key=lambda shard: hashlib.sha256(
+            f'{shard}.{group}.{unit.state_scope}'.encode()).digest())
+
+    return [unit for unit in work_units if shard_count == 1 or shard_for(unit) == shard_index]
+
+
+def _claim(seen: MutableMapping[str, str], key: str) -> bool:
+    """ Claim a key so that only the first worker to see it goes on to process it.
+    The claim is made with a single `setdefault` call, which is atomic, so
+    concurrent workers can't both claim the same key.
+
+    Args:
+        seen: Mapping of keys already claimed
+        key: Key to claim, e.g. a watchman_id
+    Returns:
+        True if the key hadn't been seen before, otherwise False
+    """
+
+    claim = uuid.uuid4().hex
+    return seen.setdefault(key, claim) == claim
+
+
+def _message_key(sig: signature.Signature, message: Dict) -> str:
+    """ Generate the key used to identify a message that has already been processed
+    for a signature, from the signature ID, channel ID and message timestamp """
+    return f'{sig.id}.{(message.get("channel") or {}).get("id")}.{message.get("ts")}'
+
+
+@dataclass(slots=True)
+class Page:
+    """ A page of raw results for a work unit, as fetched by a SignatureScanner or one of its subclasses """
+    unit: WorkUnit
+    items: List[Dict]
+    number: int = 1
+    _flat_texts: List[FlatText] = dataclasses.field(default=None, init=False, repr=False)
+
+    @property
+    def key(self) -> Tuple[str, int]:
+        """ Key used to track the page through the pipeline """
+        return self.unit.key, self.number
+
+    def flat_texts(self) -> List[FlatText]:
+        """ The text of each message on the page, flattened the first time it is needed, so
+        a page matched against several signatures is only flattened once """
+        if self._flat_texts is None:
+            self._flat_texts = [flatten_message(item) for item in self.items]
+        return self._flat_texts
+
+
+@dataclass(slots=True)
+class Candidate:
+    """ A raw message or file that has matched a signature, with the match
+    strings and watchman_ids of each unique finding in it """
+    unit: WorkUnit
+    item: Dict
+    matches: List[Tuple[Optional[str], str]]
+    page_key: Tuple[str, int] = None
+    flat_text: Optional[FlatText] = None
+
+
+@dataclass(slots=True)
+class _Finding:
+    """ An enriched finding ready to be emitted """
+    unit: WorkUnit
+    finding: Dict
+    posted_at: float
+    page_key: Tuple[str, int] = None
+
+
+@dataclass(slots=True)
+class _UnitProgress:
+    """ Pages of a work unit that have been processed by every stage """
+    next_page: int = 1
+    done_pages: Set[int] = dataclasses.field(default_factory=set)
+    last_page: Optional[int] = None
+    newest: Optional[float] = None
+    truncated: bool = False
+    pages_fetched: int = 0
+    findings: int = 0
+    # Oldest timestamp on each page fetched, and on the last page processed in order, for
+    # results paged newest first, so a resumed scan can carry on paging from there
+    page_oldest: Dict[int, float] = dataclasses.field(default_factory=dict)
+    resume_before: Optional[float] = None
+
+    @property
+    def completed(self) -> bool:
+        """ Whether every page has been fetched and processed, and no findings were dropped """
+        return not self.truncated and self.last_page is not None and self.next_page > self.last_page
+
+
+# pylint: disable=too-many-instance-attributes
+class SignatureScanner:
+    """ Runs signature searches through a pipeline of stages, each with its own threads:
+
+        fetch: Pages through the Slack search API for each work unit
+        match: Filters the results using the signature patterns and drops duplicates
+        content: Downloads text files and archives that matched and matches their content
+            against the signature patterns. Only added when a file reader is given
+        enrich: Looks up the user and conversation for each finding
+        emit: Passes each finding to the `on_finding` callback
+
+    The stages are joined by bounded queues, so findings are emitted as soon as they
+    are found, and only a limited number of results are held in memory at once.
+
+    Each page of results is tracked until everything from it has been emitted. When a
+    state store is given, the progress of each work unit and the findings emitted are
+    checkpointed in it, so a scan resumed from the checkpoint skips the pages that have
+    already been processed and doesn't emit the same finding twice.
+
+    When a state store is given, every finding is recorded in it. The emit mode decides
+    which findings are passed on:
+
+        all: Every finding
+        new: Only findings that haven't been seen by a previous run
+        new-resolved: New findings, and findings from previous runs that weren't found
+            again, which are passed to the `on_resolved` callback
+    """
+
+    # pylint: disable=too-many-positional-arguments, too-many-arguments, too-many-locals
+    def __init__(self,
+                 slack: SlackClient,
+                 logger: JSONLogger | StdoutLogger,
+                 verbose: bool,
+                 timeframe: str,
+                 on_finding: Callable[[WorkUnit, Dict], None],
+                 seen_messages: MutableMapping[str, str] = None,
+                 directory: DirectoryCache = None,
+                 matcher_pool: matcher.MatcherPool = None,
+                 pattern_guard: matcher.PatternGuard = None,
+                 state_store: StateStore = None,
+                 emit_mode: str = 'all',
+                 on_resolved: Callable[[WorkUnit, Dict], None] = None,
+                 budget: RunBudget = None,
+                 file_reader: FileContentReader = None,
+                 fetch_workers: int = 4,
+                 match_workers: int = 2,
+                 content_workers: int = 4,
+                 enrich_workers: int = 4,
+                 queue_size: int = 50,
+                 all_matches: bool = False):
+        """
+        Args:
+            slack: Slack API object
+            logger: Logging object
+            verbose: Whether to use verbose logging or not
+            timeframe: How far back to search
+            on_finding: Called with the work unit and finding for each unique finding
+            seen_messages: Run scoped mapping of messages already processed for each signature
+            directory: Cache of users and conversations to use for enrichment
+            matcher_pool: Pool of processes to match messages in. If not given,
+                messages are matched in the match stage threads
+            pattern_guard: Records the cost of each pattern and quarantines patterns that exceed
+                their time budget. Defaults to a guard with the default budget
+            state_store: Store of watermarks from previous runs. If given, each query only
+                searches for results newer than the last time it was scanned, and findings
+                are recorded so they can be told apart from findings seen by previous runs.
+                With the `new-resolved` emit mode the whole timeframe is searched, so findings
+                from previous runs can be seen again
+            emit_mode: Which findings to emit, one of EMIT_MODES. Modes other than `all`
+                need a state store
+            on_resolved: Called with the work unit and stored finding for each finding
+                that has been resolved, when using the `new-resolved` emit mode
+            budget: Limits on the time, requests and findings for the run. Work units that
+                aren't started or finished within the budget are recorded in `skipped` and `truncated`
+            file_reader: Downloads the content of files that match, to match it against the signature
+                patterns. File content isn't read if not given
+            fetch_workers: Number of threads fetching search results
+            match_workers: Number of threads matching results against patterns. When using a
+                matcher pool, at least one thread per pool process is used to keep it busy
+            content_workers: Number of files downloaded at once
+            enrich_workers: Number of threads enriching findings
+            queue_size: Maximum number of items waiting between stages
+            all_matches: Report every distinct match in a message or file, rather than only the
+                first match of each pattern. Each match is its own finding, sharing one enrichment
+        """
+        self.slack = slack
+        self.logger = logger
+        self.verbose = verbose
+        self.timeframe = timeframe
+        self.on_finding = on_finding
+        self.seen_messages = seen_messages if seen_messages is not None else {}
+        self.seen_ids = {}
+        self.directory = directory or DirectoryCache(slack, verbose)
+        self.matcher_pool = matcher_pool
+        self.pattern_guard = pattern_guard or matcher.PatternGuard()
+        self.engine = matcher.get_engine()
+        if emit_mode not in EMIT_MODES:
+            raise ValueError(f'Unknown emit mode: {emit_mode}')
+        if emit_mode != 'all' and not state_store:
+            raise ValueError(f'The {emit_mode} emit mode needs a state store')
+        self.state_store = state_store
+        self.emit_mode = emit_mode
+        self.on_resolved = on_resolved
+        self.budget = budget
+        self.file_reader = file_reader
+        self.all_matches = all_matches
+        self.skipped: Dict[str, Tuple[WorkUnit, str]] = {}
+        self.truncated: Dict[str, Tuple[WorkUnit, str]] = {}
+        self._window_starts = {}
+        self._work_units = []
+        self._pending_pages = {}
+        self._progress = {}
+        self._progress_lock = threading.Lock()
+        if matcher_pool:
+            match_workers = max(match_workers, matcher_pool.processes)
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self._announced = {}
+        self._compiled_patterns = {}
+        stages = [
+            Stage('fetch', self._fetch, workers=fetch_workers),
+            Stage('match', self._match, workers=match_workers, queue_size=queue_size),
+            Stage('enrich', self._enrich, workers=enrich_workers, queue_size=queue_size),
+            Stage('emit', self._emit, workers=1, queue_size=queue_size),
+        ]
+        if file_reader:
+            stages.insert(2, Stage('content', self._match_content, workers=content_workers, queue_size=queue_size))
+        self.pipeline = Pipeline(stages, logger)
+
+    def run(self, work_units: Iterable[WorkUnit], resume: bool = False) -> None:
+        """ Run the work units through the pipeline, blocking until every finding has been emitted
+
+        Args:
+            work_units: Work units to scan
+            resume: Carry on from the checkpoint in the state store, rather than starting a new one
+        """
+        work_units = self._work_units = list(work_units)
+        started_at = time.time()
+        if self.state_store and not resume:
+            self.state_store.start_checkpoint(self._checkpoint_info())
+        if self.budget:
+            self.budget.start(self.slack.request_count if self.budget.max_requests is not None else 0)
+        self.pipeline.run(work_units)
+        if self.state_store:
+            # Only saved once everything has been emitted, so an interrupted run is searched again
+            for unit in work_units:
+                newest = self._progress[unit.key].newest if self.unit_completed(unit.key) else None
+                if newest:
+                    self.state_store.set_watermark(*self._watermark_key(unit), newest)
+            if self.emit_mode == 'new-resolved':
+                self._resolve_findings(work_units, started_at)
+            # A scan with failures keeps its checkpoint, so resuming it only retries what failed
+            if self.completed:
+                self.state_store.clear_checkpoint()
+            for unit_key, progress in self._progress.items():
+                if progress.pages_fetched:
+                    self.state_store.record_query_yield(unit_key, progress.pages_fetched, progress.findings)
+
+    @property
+    def completed(self) -> bool:
+        """ Whether every work unit in the last run was searched in full and emitted without errors """
+        return not self.pipeline.errors and all(self.unit_completed(unit.key) for unit in self._work_units)
+
+    def unit_completed(self, unit_key: str) -> bool:
+        """ Whether every page of a work unit was fetched, and everything found in it was emitted
+
+        Args:
+            unit_key: Key of the work unit
+        """
+        progress = self._progress.get(unit_key)
+        return bool(progress and progress.completed)
+
+    def _track(self, page_key: Tuple[str, int], amount: int) -> None:
+        # Counts the items from each page still in the pipeline, so a page is only
+        # marked as done once everything from it has been emitted. Items dropped by
+        # an error are never counted off, so their page is processed again on resume
+        with self._progress_lock:
+            pending = self._pending_pages.get(page_key, 0) + amount
+            if pending:
+                self._pending_pages[page_key] = pending
+                return
+            self._pending_pages.pop(page_key, None)
+            unit_key, number = page_key
+            progress = self._progress[unit_key]
+            progress.done_pages.add(number)
+            while progress.next_page in progress.done_pages:
+                progress.done_pages.remove(progress.next_page)
+                progress.resume_before = progress.page_oldest.pop(progress.next_page, progress.resume_before)
+                progress.next_page += 1
+            self._save_progress(unit_key, progress)
+
+    def _budget_exhausted(self, unit: WorkUnit) -> Optional[str]:
+        if not self.budget:
+            return None
+        if unit.signature and self.budget.signature_full(unit.signature.id):
+            return f'maximum of {self.budget.max_findings_per_signature} findings for the signature reached'
+        return self.budget.exhausted(self.slack.request_count if self.budget.max_requests is not None else 0)
+
+    def _stop_unit(self,
+                   stopped: Dict[str, Tuple[WorkUnit, str]],
+                   unit: WorkUnit,
+                   reason: str,
+                   progress_key: str = None) -> None:
+        progress_key = progress_key or unit.key
+        with self._progress_lock:
+            if unit.key not in self.skipped and unit.key not in self.truncated:
+                stopped[unit.key] = (unit, reason)
+                self.logger.log('DEBUG', f'Stopped searching {unit.scope} using query: {unit.query} - {reason}')
+            if progress_key in self._progress:
+                self._progress[progress_key].truncated = True
+
+    def _checkpoint_info(self) -> Dict[str, Any]:
+        # Details needed to resume the scan, which are saved when the checkpoint is started
+        return {'timeframe': self.timeframe}
+
+    def _watermark_key(self, unit: WorkUnit) -> Tuple[str, str, str]:
+        # The signature ID, query and scope the unit's watermark is stored under
+        return unit.signature.id, unit.query, unit.state_scope
+
+    def _save_progress(self, unit_key: str, progress: _UnitProgress) -> None:
+        if self.state_store:
+            self.state_store.save_unit_progress(unit_key, progress.next_page, progress.completed, progress.newest,
+                                                progress.resume_before)
+
+    def _resolve_findings(self, work_units: List[WorkUnit], started_at: float) -> None:
+        # A finding can only be resolved if every query for its signature and scope was
+        # searched in full, otherwise it may just not have been fetched
+        units_by_scope = {}
+        for unit in work_units:
+            units_by_scope.setdefault((unit.signature.id, unit.state_scope), []).append(unit)
+
+        for units in units_by_scope.values():
+            if self.pipeline.errors or not all(self.unit_completed(unit.key) for unit in units):
+                continue
+            window_start = max(self._window_starts[unit.key] for unit in units)
+            for finding in self.state_store.resolve_findings(
+                    units[0].signature.id, units[0].state_scope, window_start, started_at):
+                if self.on_resolved:
+                    self.on_resolved(units[0], finding)
+
+    def _count(self, unit: WorkUnit, counter: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            unit_stats = self.stats.setdefault(
+                (unit.signature.id, unit.scope),
+                {'potential_matches': 0, 'matches': 0})
+            unit_stats[counter] += amount
+
+    def _patterns(self, sig: signature.Signature) -> List[Tuple[str, Any]]:
+        if sig.id not in self._compiled_patterns:
+            self._compiled_patterns[sig.id] = matcher.compile_patterns(sig.patterns, self.engine)
+        return self._compiled_patterns[sig.id]
+
+    def _fetch(self, unit: WorkUnit) -> Iterator[Page]:
+        reason = self._budget_exhausted(unit)
+        if reason:
+            self._stop_unit(self.skipped, unit, reason)
+            return
+
+        if _claim(self._announced, f'{unit.signature.id}.{unit.scope}'):
+            post_type = 'posts' if unit.scope == 'messages' else 'files'
+            self.logger.log('INFO', f'Searching for {post_type} containing {unit.signature.name}')
+        self.logger.log('DEBUG', f'Searching {unit.scope} using query: {unit.query}')
+
+        timeframe, watermark, oldest, sort = self.timeframe, None, None, None
+        if self.state_store:
+            sort = 'timestamp'
+            watermark = self.state_store.get_watermark(*self._watermark_key(unit))
+            # Resolving findings needs every finding in the timeframe fetched again, including
+            # those at or before the watermark, so the whole timeframe is searched
+            if watermark and self.emit_mode != 'new-resolved':
+                timeframe, oldest = search_after(timeframe, watermark), watermark
+                self.logger.log('DEBUG', f'Searching {unit.scope} using query: {unit.query} '
+                                         f'for results newer than {convert_timestamp(watermark)}')
+
+        # Slack's `after:` excludes the date given, so the window starts the day after
+        window_start = time.mktime(time.strptime(timeframe, '%Y-%m-%d')) + 86400 if is_date(timeframe) else 0
+        self._window_starts[unit.key] = max(window_start, oldest or 0)
+
+        progress = self._resume_progress(unit)
+        if progress.completed:
+            self.logger.log('DEBUG', f'Skipping {unit.scope} query completed before resuming: {unit.query}')
+        else:
+            progress.newest = progress.newest or watermark
+            number = progress.next_page - 1
+            for number, items in enumerate(self.slack.iter_page_api_search(
+                    unit.query,
+                    f'search.{unit.scope}',
+                    unit.scope,
+                    timeframe,
+                    sort=sort,
+                    oldest=oldest,
+                    start_page=progress.next_page,
+                    team_id=unit.team_id), progress.next_page):
+                progress.newest = max([progress.newest or 0] + [get_timestamp(item) for item in items]) or None
+                progress.pages_fetched += 1
+                self._count(unit, 'potential_matches', len(items))
+                page = Page(unit=unit, items=items, number=number)
+                self._track(page.key, 1)
+                yield page
+
+                reason = self._budget_exhausted(unit)
+                if reason:
+                    # Pages already fetched are still processed, but no more are requested
+                    self._stop_unit(self.truncated, unit, reason)
+                    return
+
+            # Only reached if every page was fetched
+            with self._progress_lock:
+                progress.last_page = number
+                self._save_progress(unit.key, progress)
+
+    def _resume_progress(self, unit: WorkUnit) -> _UnitProgress:
+        progress = _UnitProgress()
+        saved = self.state_store.get_unit_progress(unit.key) if self.state_store else None
+        if saved:
+            progress.next_page, completed, progress.newest, progress.resume_before = saved
+            if completed:
+                progress.last_page = progress.next_page - 1
+            elif progress.next_page > 1:
+                self.logger.log('DEBUG', f'Resuming {unit.scope} query from page {progress.next_page}: {unit.query}')
+        with self._progress_lock:
+            self._progress[unit.key] = progress
+        return progress
+
+    def _match(self, page: Page) -> Iterator[Candidate]:
+        if page.unit.scope == 'messages':
+            candidates = self._match_messages(page)
+        else:
+            candidates = self._match_files(page)
+
+        for candidate in candidates:
+            self._track(page.key, 1)
+            yield candidate
+        self._track(page.key, -1)
+
+    def _match_files(self, page: Page) -> Iterator[Candidate]:
+        for item in page.items:
+            matches = self._match_file(page.unit, item)
+            if matches:
+                yield Candidate(unit=page.unit, item=item, matches=matches, page_key=page.key)
+
+    def _match_messages(self, page: Page, unit: WorkUnit = None) -> Iterator[Candidate]:
+        unit = unit or page.unit
+        sig = unit.signature
+        indexes = [index for index, message in enumerate(page.items)
+                   if _claim(self.seen_messages, _message_key(sig, message))]
+        if not indexes:
+            return
+
+        flat_texts = page.flat_texts()
+        texts = [flat_texts[index].text for index in indexes]
+        matches_by_message = {}
+        for batch_index, match_string in self._match_texts(sig, texts):
+            index = indexes[batch_index]
+            watchman_id = message_watchman_id(match_string, page.items[index].get('ts'))
+            if _claim(self.seen_ids, watchman_id):
+                matches_by_message.setdefault(index, []).append((match_string, watchman_id))
+
+        for index, matches in matches_by_message.items():
+            yield Candidate(unit=unit, item=page.items[index], matches=matches, page_key=page.key,
+                             flat_text=flat_texts[index])
+
+    def _match_texts(self, sig: signature.Signature, texts: List[str]) -> List[Tuple[int, str]]:
+        if self.matcher_pool:
+            return self.matcher_pool.match(sig.id, texts, self.pattern_guard, self.all_matches)
+        return matcher.match_texts(self._patterns(sig), texts, self.pattern_guard, sig.id, self.engine,
+                                   self.all_matches)
+
+    def _match_content(self, candidate: Candidate) -> Iterator[Candidate]:
+        file_dict = candidate.item
+        if candidate.unit.scope == 'files' and candidate.unit.signature.patterns and \
+                self.file_reader.should_read(file_dict):
+            match_strings = []
+            try:
+                if self.file_reader.is_archive(file_dict):
+                    match_strings = self._match_archive(candidate.unit.signature, file_dict)
+                for chunk in self.file_reader.iter_chunks(file_dict):
+                    for _, match_string in self._match_texts(candidate.unit.signature, [chunk]):
+                        # Matches within the overlap between chunks are found twice
+                        if match_string not in match_strings:
+                            match_strings.append(match_string)
+            except requests.exceptions.RequestException as e:
+                self.logger.log('WARNING', f'Couldn\'t download file {file_dict.get("id")} to match its '
+                                           f'content: {e}')
+            for match_string in match_strings:
+                watchman_id = file_content_watchman_id(match_string, file_dict.get('id'))
+                if _claim(self.seen_ids, watchman_id):
+                    candidate.matches.append((match_string, watchman_id))
+        yield candidate
+
+    def _match_archive(self, sig: signature.Signature, file_dict: Dict) -> List[str]:
+        match_strings, stopped = self.file_reader.scan_archive(
+            file_dict,
+            sig.id,
+            None if self.matcher_pool else self._patterns(sig),
+            self.pattern_guard,
+            self.engine,
+            self.matcher_pool,
+            self.all_matches)
+        if stopped:
+            self.logger.log('WARNING', f'Stopped reading archive {file_dict.get("name")} ({file_dict.get("id")}), '
+                                       f'some matches may have been missed: {stopped}')
+        return match_strings
+
+    def _match_file(self, unit: WorkUnit, file_dict: Dict) -> List[Tuple[None, str]]:
+        if unit.query.replace('\"', '').lower() not in file_dict.get('name').lower():
+            return []
+        if unit.signature.file_types and not any(file_type.lower() in file_dict.get('filetype').lower()
+                                                 for file_type in unit.signature.file_types):
+            return []
+
+        watchman_id = file_watchman_id(
+            convert_timestamp(file_dict.get('created')),
+            file_dict.get('permalink_public'))
+        if not _claim(self.seen_ids, watchman_id):
+            return []
+        return [(None, watchman_id)]
+
+    def _enrich(self, candidate: Candidate) -> Iterator[_Finding]:
+        for finding in self._enrich_candidate(candidate):
+            self._track(candidate.page_key, 1)
+            yield _Finding(
+                unit=candidate.unit,
+                finding=finding,
+                posted_at=get_timestamp(candidate.item),
+                page_key=candidate.page_key)
+        self._track(candidate.page_key, -1)
+
+    def _enrich_candidate(self, candidate: Candidate) -> Iterator[Dict]:
+        if candidate.unit.scope == 'messages':
+            message = self._enrich_message(candidate.item)
+            flat_text = candidate.flat_text or flatten_message(candidate.item)
+            for match_string, watchman_id in candidate.matches:
+                yield {
+                    'match_string': match_string,
+                    'match_location': flat_text.locate_match(match_string),
+                    'message': message,
+                    'watchman_id': watchman_id
+                }
+        else:
+            file_dict = candidate.item
+            if file_dict.get('user') and not dataclasses.is_dataclass(file_dict.get('user')):
+                u = self.directory.get_user(file_dict.get('user'))
+            else:
+                u = None
+            for match_string, watchman_id in candidate.matches:
+                finding = {
+                    'file': post.create_file_from_dict(file_dict),
+                    'user': u,
+                    'watchman_id': watchman_id
+                }
+                if match_string is not None:
+                    # Found in the content of the file
+                    finding['match_string'] = match_string
+                yield finding
+
+    def _enrich_message(self, message: Dict) -> post.Message:
+        if message.get('user'):
+            u = self.directory.get_user(message.get('user'))
+        else:
+            u = message.get('username')
+
+        if (message.get('channel') or {}).get('id'):
+            c = self.directory.get_conversation(message.get('channel').get('id'))
+        else:
+            c = None
+
+        return post.create_message_from_dict({**message, 'user': u, 'conversation': c})
+
+    def _emit(self, output: _Finding) -> None:
+        unit, finding = output.unit, output.finding
+        watchman_id = finding.get('watchman_id')
+        if self.state_store and self.state_store.was_emitted(watchman_id):
+            # Findings emitted before a scan was interrupted aren't emitted again when it is resumed
+            pass
+        elif self.budget and not self.budget.allow_finding(unit.signature.id):
+            self._stop_unit(
+                self.truncated, unit,
+                f'maximum of {self.budget.max_findings_per_signature} findings for the signature reached',
+                progress_key=output.page_key[0])
+        else:
+            self._count(unit, 'matches')
+            with self._progress_lock:
+                self._progress[output.page_key[0]].findings += 1
+            is_new = self.state_store.is_new_finding(watchman_id) if self.state_store else True
+            if self.emit_mode == 'all' or is_new:
+                self.on_finding(unit, finding)
+            if self.state_store:
+                # Recorded once the finding has been output, in one transaction with the marker that
+                # it has been emitted. If the scan is interrupted in between, nothing is recorded, so
+                # the resumed scan outputs the finding again rather than losing it
+                self.state_store.record_finding(
+                    watchman_id=watchman_id,
+                    signature_id=unit.signature.id,
+                    signature_name=unit.signature.name,
+                    severity=unit.signature.severity,
+                    scope=unit.state_scope,
+                    posted_at=output.posted_at or None,
+                    emitted=True)
+        self._track(output.page_key, -1)
+
+
+# pylint: disable=too-many-positional-arguments
+def _run_signature_scan(slack: SlackClient,
+                        logger: JSONLogger | StdoutLogger,
+                        sig: signature.Signature,
+                        scope: str,
+                        verbose: bool,
+                        timeframe: str,
+                        seen_messages: MutableMapping[str, str] = None) -> Tuple[List[Dict], int]:
+    """ Scan a single signature in one scope, collecting the findings into a list
+
+    Returns:
+        Tuple of the findings, and the number of potential matches found by searching
+    """
+
+    results = []
+    scanner = SignatureScanner(
+        slack,
+        logger,
+        verbose,
+        timeframe,
+        on_finding=lambda unit, finding: results.append(finding),
+        seen_messages=seen_messages)
+    scanner.run(plan_work_units([sig], scopes=[scope]))
+    potential_matches = sum(stats.get('potential_matches') for stats in scanner.stats.values())
+    return results, potential_matches
 
 
+# pylint: disable=too-many-positional-arguments
 def find_messages(slack: SlackClient,
                   logger: JSONLogger | StdoutLogger,
                   sig: signature.Signature,
                   verbose: bool,
-                  timeframe: str) -> List[Dict]:
+                  timeframe: str,
+                  seen_messages: MutableMapping[str, str] = None) -> List[Dict]:
     """ Look in public channels by first searching for common terms in query list
         then trimming this list down using a regex search
 
@@ -82,39 +915,18 @@ def find_messages(slack: SlackClient,
         sig: Signature object defining what to search for
         verbose: whether to use verbose logging or not
         timeframe: How far back to search
+        seen_messages: Run scoped mapping of messages already processed for each signature.
+            If not given, messages are only deduplicated within this search
     Returns:
         List of dictionaries with results
     """
 
     try:
-        results = multiprocessing.Manager().list()
-        potential_matches = multiprocessing.Manager().list()
-
-        processes = []
-
-        for query in sig.search_strings:
-            p = multiprocessing.Process(
-                target=_multipro_message_worker,
-                args=(
-                    slack,
-                    sig,
-                    query,
-                    verbose,
-                    timeframe
-                ),
-                kwargs={
-                    'results': results,
-                    'potential_matches': potential_matches
-                }
-            )
-            processes.append(p)
-            p.start()
-
-        for process in processes:
-            process.join()
+        results, potential_matches = _run_signature_scan(
+            slack, logger, sig, 'messages', verbose, timeframe, seen_messages)
 
         if potential_matches:
-            logger.log('INFO', f'{sum(potential_matches)} potential matches found')
+            logger.log('INFO', f'{potential_matches} potential matches found')
 
         if results:
             results = deduplicate_results(results)
@@ -126,47 +938,6 @@ def find_messages(slack: SlackClient,
         logger.log('CRITICAL', e)
 
 
-# pylint: disable=too-many-locals
-def _multipro_message_worker(slack: SlackClient,
-                             sig: signature.Signature,
-                             query: str,
-                             verbose: bool,
-                             timeframe: str,
-                             **kwargs):
-    message_list = slack.page_api_search(query, 'search.messages', 'messages', timeframe)
-    kwargs.get('potential_matches').append(len(message_list))
-    for message in message_list:
-        for pattern in sig.patterns:
-            r = re.compile(pattern)
-            if r.search(str(message.get('text'))):
-                if message.get('user'):
-                    user_dict = slack.get_user_info(message.get('user')).get('user')
-                    u = user.create_from_dict(user_dict, verbose)
-                else:
-                    u = message.get('username')
-
-                if message.get('channel').get('id'):
-                    channel_dict = slack.get_conversation_info(message.get('channel').get('id')).get('channel')
-                    c = conversation.create_from_dict(channel_dict, verbose)
-                else:
-                    c = None
-
-                message['user'] = u
-                message['conversation'] = c
-                match_string = r.search(str(message.get('text'))).group(0)
-                message = post.create_message_from_dict(message)
-
-                watchman_id = hashlib.md5(f'{match_string}.{message.timestamp}'.encode()).hexdigest()
-                results_dict = {
-                    'match_string': match_string,
-                    'message': message,
-                    'watchman_id': watchman_id
-                }
-
-                kwargs.get('results').append(results_dict)
-    return kwargs.get('results'), kwargs.get('potential_matches')
-
-
 def find_files(slack: SlackClient,
                logger: JSONLogger | StdoutLogger,
                sig: signature.Signature,
@@ -186,34 +957,10 @@ def find_files(slack: SlackClient,
     """
 
     try:
-        results = multiprocessing.Manager().list()
-        potential_matches = multiprocessing.Manager().list()
-
-        processes = []
-
-        for query in sig.search_strings:
-            p = multiprocessing.Process(
-                target=_multipro_file_worker,
-                args=(
-                    slack,
-                    sig,
-                    query,
-                    verbose,
-                    timeframe
-                ),
-                kwargs={
-                    'results': results,
-                    'potential_matches': potential_matches
-                }
-            )
-            processes.append(p)
-            p.start()
-
-        for process in processes:
-            process.join()
+        results, potential_matches = _run_signature_scan(slack, logger, sig, 'files', verbose, timeframe)
 
         if potential_matches:
-            logger.log('INFO', f'{sum(potential_matches)} potential matches found')
+            logger.log('INFO', f'{potential_matches} potential matches found')
 
         if results:
             results = deduplicate_results(results)
@@ -226,53 +973,6 @@ def find_files(slack: SlackClient,
         logger.log('CRITICAL', e)
 
 
-def _multipro_file_worker(slack: SlackClient,
-                          sig: signature.Signature,
-                          query: str,
-                          verbose: bool,
-                          timeframe: str,
-                          **kwargs):
-    message_list = slack.page_api_search(query, 'search.files', 'files', timeframe)
-    kwargs.get('potential_matches').append(len(message_list))
-    for file_dict in message_list:
-        if sig.file_types:
-            for file_type in sig.file_types:
-                if query.replace('\"', '').lower() in file_dict.get('name').lower() \
-                        and file_type.lower() in file_dict.get('filetype').lower():
-                    if file_dict.get('user') and not dataclasses.is_dataclass(file_dict.get('user')):
-                        user_dict = slack.get_user_info(file_dict.get('user')).get('user')
-                        u = user.create_from_dict(user_dict, verbose)
-                    else:
-                        u = None
-
-                    f = post.create_file_from_dict(file_dict)
-                    watchman_id = hashlib.md5(f'{f.created}.{f.permalink_public}'.encode()).hexdigest()
-                    results_dict = {
-                        'file': f,
-                        'user': u,
-                        'watchman_id': watchman_id
-                    }
-                    kwargs.get('results').append(results_dict)
-        else:
-            if query.replace('\"', '').lower() in file_dict.get('name').lower():
-                if file_dict.get('user'):
-                    user_dict = slack.get_user_info(file_dict.get('user')).get('user')
-                    u = user.create_from_dict(user_dict, verbose)
-                else:
-                    u = None
-
-                f = post.create_file_from_dict(file_dict)
-                watchman_id = hashlib.md5(f'{f.created}.{f.permalink_public}'.encode()).hexdigest()
-                results_dict = {
-                    'file': f,
-                    'user': u,
-                    'watchman_id': watchman_id
-                }
-
-                kwargs.get('results').append(results_dict)
-    return kwargs.get('results'), kwargs.get('potential_matches')
-
-
 def find_auth_information(domain_url: str) -> Dict[str, List[str]] | None:
     """ Get domain authentication information from the Slack workspace
 
@@ -0,0 +1,313 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from slack_watchman.models.work_unit import WorkUnit
+
+# Seconds a leased work unit is held for before another worker can take it over
+DEFAULT_LEASE_SECONDS = 300
+
+# Number of times a work unit is tried before it is marked as failed
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class WorkQueue:
+    """ Durable queue of work units shared by a coordinator and any number of workers,
+    kept in a SQLite database file that every node can reach, e.g. on shared storage.
+
+    The coordinator adds the planned work units. Each worker leases a few units at a time,
+    renews the leases while it searches them, and writes the findings back when a unit is
+    done. Faster workers lease more units, and if a worker dies its leases expire and the
+    units are handed to another worker. Findings are stored once per `watchman_id`, so a
+    finding returned by units on different workers is only reported once.
+
+    The database doesn't use write-ahead logging, as that doesn't work over network file systems.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        """
+        Args:
+            path: Path to the queue database file. Created if it doesn't exist
+            lease_seconds: Seconds a lease lasts before it has to be renewed
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Transactions are managed explicitly, so a lease can be taken with BEGIN IMMEDIATE
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._create_tables()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            # IMMEDIATE takes the write lock straight away, so two workers can't lease the same unit
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def _create_tables(self) -> None:
+        with self._transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS queue_info ('
+                'key TEXT PRIMARY KEY, '
+                'value TEXT NOT NULL)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS work_units ('
+                'unit_key TEXT PRIMARY KEY, '
+                'signature_id TEXT NOT NULL, '
+                'scope TEXT NOT NULL, '
+                'query TEXT NOT NULL, '
+                'status TEXT NOT NULL, '
+                'worker TEXT, '
+                'lease_expires REAL, '
+                'attempts INTEGER NOT NULL DEFAULT 0, '
+                'error TEXT)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS work_units_by_status ON work_units (status, lease_expires)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS findings ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'watchman_id TEXT NOT NULL UNIQUE, '
+                'unit_key TEXT NOT NULL, '
+                'signature_name TEXT, '
+                'severity TEXT, '
+                'scope TEXT NOT NULL, '
+                'finding TEXT NOT NULL)')
+
+    def start(self, work_units: List[WorkUnit], info: Dict[str, Any]) -> None:
+        """ Start a new scan, replacing anything already in the queue
+
+        Args:
+            work_units: Work units to add
+            info: Details of the scan workers need, e.g. the timeframe. Must be JSON serialisable
+        """
+
+        with self._transaction() as connection:
+            for table in ['queue_info', 'work_units', 'findings']:
+                connection.execute(f'DELETE FROM {table}')
+            connection.executemany(
+                'INSERT INTO queue_info (key, value) VALUES (?, ?)',
+                [(key, json.dumps(value)) for key, value in info.items()])
+            connection.executemany(
+                'INSERT OR IGNORE INTO work_units (unit_key, signature_id, scope, query, status) '
+                "VALUES (?, ?, ?, ?, 'pending')",
+                [(unit.key, unit.signature.id, unit.scope, unit.query) for unit in work_units])
+
+    def set_info(self, key: str, value: Any) -> None:
+        """ Set a detail of the scan in the queue, e.g. how far the coordinator has got
+
+        Args:
+            key: Name of the detail
+            value: Value to set. Must be JSON serialisable
+        """
+
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO queue_info (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+
+    def get_info(self) -> Optional[Dict[str, Any]]:
+        """ Get the details of the scan in the queue
+
+        Returns:
+            Details passed to start, or None if no scan has been started
+        """
+
+        with self._lock:
+            rows = self._connection.execute('SELECT key, value FROM queue_info').fetchall()
+        return {key: json.loads(value) for key, value in rows} if rows else None
+
+    def lease(self,
+              worker: str,
+              count: int = 1,
+              max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> List[Tuple[str, str, str, str]]:
+        """ Lease pending work units, or units whose lease has expired. Units whose lease has
+        expired on every attempt, e.g. because they kill the worker searching them, are marked
+        as failed rather than leased again
+
+        Args:
+            worker: ID of the worker taking the lease
+            count: Maximum number of units to lease
+            max_attempts: Mark a unit whose lease has expired as failed once it has been tried this many times
+        Returns:
+            List of (unit key, signature ID, scope, query) tuples for the leased units
+        """
+
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE work_units SET status = 'failed', worker = NULL, lease_expires = NULL, "
+                "error = 'Lease expired on every attempt' "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, max_attempts))
+            rows = connection.execute(
+                'SELECT unit_key, signature_id, scope, query FROM work_units '
+                "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                'ORDER BY attempts, rowid LIMIT ?',
+                (now, count)).fetchall()
+            connection.executemany(
+                "UPDATE work_units SET status = 'leased', worker = ?, lease_expires = ?, "
+                'attempts = attempts + 1 WHERE unit_key = ?',
+                [(worker, now + self.lease_seconds, row[0]) for row in rows])
+        return rows
+
+    def renew(self, worker: str, unit_keys: List[str]) -> List[str]:
+        """ Renew the leases a worker holds
+
+        Args:
+            worker: ID of the worker holding the leases
+            unit_keys: Keys of the leased units
+        Returns:
+            Keys of the units whose lease was renewed. Any others have been taken over by another worker
+        """
+
+        renewed = []
+        with self._transaction() as connection:
+            for unit_key in unit_keys:
+                cursor = connection.execute(
+                    "UPDATE work_units SET lease_expires = ? WHERE unit_key = ? AND worker = ? AND status = 'leased'",
+                    (time.time() + self.lease_seconds, unit_key, worker))
+                if cursor.rowcount:
+                    renewed.append(unit_key)
+        return renewed
+
+    def complete(self, worker: str, unit_key: str, findings: List[Dict[str, Any]]) -> bool:
+        """ Write the findings for a work unit back and mark it as done
+
+        Args:
+            worker: ID of the worker that searched the unit
+            unit_key: Key of the unit
+            findings: Findings from the unit, as dicts with the keys watchman_id, signature_name,
+                severity, scope and finding
+        Returns:
+            Whether the unit was completed. It isn't if the worker's lease was taken over by
+            another worker, which then owns the unit
+        """
+
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE work_units SET status = 'done', lease_expires = NULL, error = NULL "
+                "WHERE unit_key = ? AND worker = ? AND status = 'leased'",
+                (unit_key, worker))
+            if not cursor.rowcount:
+                return False
+            connection.executemany(
+                'INSERT OR IGNORE INTO findings (watchman_id, unit_key, signature_name, severity, scope, finding) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(finding.get('watchman_id'), unit_key, finding.get('signature_name'), str(finding.get('severity')),
+                  finding.get('scope'), json.dumps(finding.get('finding'))) for finding in findings])
+        return True
+
+    def release(self,
+                worker: str,
+                unit_key: str,
+                error: str = None,
+                max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> None:
+        """ Give up the lease on a work unit that couldn't be finished, so another worker can retry it
+
+        Args:
+            worker: ID of the worker holding the lease
+            unit_key: Key of the unit
+            error: Why the unit couldn't be finished
+            max_attempts: Mark the unit as failed rather than retrying it once it has been tried this many times
+        """
+
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE work_units SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                'worker = NULL, lease_expires = NULL, error = ? '
+                "WHERE unit_key = ? AND worker = ? AND status = 'leased'",
+                (max_attempts, error, unit_key, worker))
+
+    def counts(self) -> Dict[str, int]:
+        """ Number of work units with each status: pending, leased, done and failed """
+        with self._lock:
+            rows = self._connection.execute('SELECT status, COUNT(*) FROM work_units GROUP BY status').fetchall()
+        return {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0, **dict(rows)}
+
+    def is_finished(self) -> bool:
+        """ Whether every work unit is done or has failed """
+        counts = self.counts()
+        return self.get_info() is not None and not counts.get('pending') and not counts.get('leased')
+
+    def failed_units(self) -> List[Tuple[str, str]]:
+        """ Units that failed every attempt, as (unit key, error) tuples """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT unit_key, error FROM work_units WHERE status = 'failed' ORDER BY rowid").fetchall()
+
+    def findings_after(self, last_id: int = 0) -> List[Tuple[int, Dict[str, Any]]]:
+        """ Findings written back since the last one read
+
+        Args:
+            last_id: ID of the last finding already read
+        Returns:
+            List of (ID, finding) tuples, where each finding is a dict with the keys watchman_id,
+            signature_name, severity, scope and finding
+        """
+
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT id, watchman_id, signature_name, severity, scope, finding FROM findings '
+                'WHERE id > ? ORDER BY id',
+                (last_id,)).fetchall()
+        return [(row[0], {
+            'watchman_id': row[1],
+            'signature_name': row[2],
+            'severity': row[3],
+            'scope': row[4],
+            'finding': json.loads(row[5])
+        }) for row in rows]
+
+    def close(self) -> None:
+        """ Close the connection to the queue database """
+        with self._lock:
+            self._connection.close()
+
+
+def new_worker_id() -> str:
+    """ Generate a unique ID for a worker """
+    return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+
+class LeaseKeeper:
+    """ Renews a worker's leases in a background thread until the block it is used in exits """
+
+    def __init__(self, work_queue: WorkQueue, worker: str, unit_keys: List[str]):
+        """
+        Args:
+            work_queue: Queue the units were leased from
+            worker: ID of the worker holding the leases
+            unit_keys: Keys of the leased units
+        """
+        self.work_queue = work_queue
+        self.worker = worker
+        self.unit_keys = list(unit_keys)
+        self.lost: List[str] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew, name='lease-keeper', daemon=True)
+
+    def _renew(self) -> None:
+        while not self._stop.wait(self.work_queue.lease_seconds / 3):
+            renewed = self.work_queue.renew(self.worker, self.unit_keys)
+            self.lost.extend(key for key in self.unit_keys if key not in renewed)
+            self.unit_keys = renewed
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,34 @@
+from unittest.mock import patch
+
+from slack_watchman.budget import RunBudget
+
+
+def test_budget_unlimited():
+    budget = RunBudget()
+
+    assert budget.exhausted(1000) is None
+    assert all(budget.allow_finding('sig') for _ in range(100))
+
+
+def test_budget_max_requests():
+    budget = RunBudget(max_requests=5)
+    budget.start(request_count=10)
+
+    assert budget.exhausted(14) is None
+    assert budget.exhausted(15) == 'maximum of 5 requests reached'
+
+
+def test_budget_max_duration():
+    with patch('slack_watchman.budget.time.monotonic', side_effect=[100, 159, 160]):
+        budget = RunBudget(max_duration=60)
+        assert budget.exhausted() is None
+        assert budget.exhausted() == 'maximum duration of 60 seconds reached'
+
+
+def test_budget_max_findings_per_signature():
+    budget = RunBudget(max_findings_per_signature=2)
+
+    assert [budget.allow_finding('sig') for _ in range(3)] == [True, True, False]
+    assert budget.signature_full('sig')
+    assert budget.allow_finding('other_sig')
+    assert not budget.signature_full('other_sig')
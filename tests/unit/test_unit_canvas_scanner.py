@@ -0,0 +1,135 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from slack_watchman.canvas_scanner import CanvasScanner
+from slack_watchman.clients.slack_client import SlackClient
+from slack_watchman.models import conversation, post, signature, user
+from slack_watchman.state import StateStore
+from slack_watchman.watchman_id import file_content_watchman_id
+from slack_watchman.watchman_processor import DirectoryCache
+
+
+def _make_signature(signature_id, pattern, scope=None):
+    mock_sig = MagicMock(spec=signature.Signature)
+    mock_sig.id = signature_id
+    mock_sig.name = signature_id
+    mock_sig.severity = '70'
+    mock_sig.scope = scope or ['messages']
+    mock_sig.patterns = [pattern]
+    return mock_sig
+
+
+def _make_channel(channel_id, canvas_id, canvas_empty=False):
+    mock_channel = MagicMock(spec=conversation.Conversation)
+    mock_channel.id = channel_id
+    mock_channel.name = f'channel-{channel_id}'
+    mock_channel.canvas_id = canvas_id
+    mock_channel.canvas_empty = canvas_empty
+    return mock_channel
+
+
+@pytest.fixture
+def mock_slack():
+    canvases = {
+        'F1': ({'id': 'F1', 'updated': 1700000000, 'url_private_download': 'https://files/F1'},
+               [b'the password is ', b'hunter2 and the token is abc']),
+        'F2': ({'id': 'F2', 'updated': 1700000500, 'url_private': 'https://files/F2'},
+               [b'nothing to see']),
+    }
+    urls = {file_dict.get('url_private_download') or file_dict.get('url_private'): content
+            for file_dict, content in canvases.values()}
+
+    slack = MagicMock(spec=SlackClient)
+    slack.get_file_info.side_effect = lambda file_id: {'ok': True, 'file': canvases[file_id][0]}
+    slack.iter_file_content.side_effect = lambda url, chunk_size: (chunk for chunk in urls[url])
+    return slack
+
+
+def _make_scanner(slack, findings, signatures, **kwargs):
+    directory = MagicMock(spec=DirectoryCache)
+    return CanvasScanner(
+        slack,
+        MagicMock(),
+        verbose=False,
+        signatures=signatures,
+        on_finding=lambda unit, finding: findings.append((unit, finding)),
+        workspace_url='https://example.slack.com/',
+        directory=directory,
+        **kwargs)
+
+
+def test_canvas_scanner_matches_canvases(mock_slack):
+    """Only channels with a canvas are read, against the signatures with the messages scope."""
+
+    findings = []
+    scanner = _make_scanner(mock_slack, findings, [
+        _make_signature('passwords', r'password is \w+'),
+        _make_signature('tokens', r'token is \w+'),
+        _make_signature('files_only', r'token', scope=['files'])])
+    scanner.run([_make_channel('C1', 'F1'), _make_channel('C2', 'F2'), _make_channel('C3', None),
+                 _make_channel('C4', 'F4', canvas_empty=True)])
+
+    by_signature = sorted((unit.signature.id, unit.scope, unit.query, finding['match_string'])
+                          for unit, finding in findings)
+    assert by_signature == [
+        ('passwords', 'canvases', 'C1', 'password is hunter2'),
+        ('tokens', 'canvases', 'C1', 'token is abc')]
+    assert sorted(call.args[0] for call in mock_slack.get_file_info.call_args_list) == ['F1', 'F2']
+    assert scanner.stats == {'read': 2, 'unchanged': 0, 'failed': 0, 'matches': 2}
+
+
+def test_canvas_scanner_finding_schema(mock_slack):
+    findings = []
+    scanner = _make_scanner(mock_slack, findings, [_make_signature('tokens', r'token is \w+')])
+    creator = user.UserSuccinct(id='U1', name='alice', email=None, display_name=None, has_2fa=None, is_admin=None)
+    scanner.directory.get_user.return_value = creator
+    mock_slack.get_file_info.side_effect = lambda file_id: {'ok': True, 'file': {
+        'id': 'F1', 'user': 'U1', 'updated': 1700000000, 'url_private_download': 'https://files/F1'}}
+    scanner.run([_make_channel('C1', 'F1')])
+
+    finding = findings[0][1]
+    assert finding['watchman_id'] == file_content_watchman_id('token is abc', 'F1')
+    assert finding['canvas_url'] == 'https://example.slack.com/canvas/C1'
+    assert finding['channel_name'] == 'channel-C1'
+    assert isinstance(finding['file'], post.File)
+    assert finding['file'].user is creator
+    assert finding['user'] is creator
+
+
+def test_canvas_scanner_skips_unchanged_canvases(mock_slack, tmp_path):
+    """Canvases are only downloaded again once their updated time moves past the watermark."""
+
+    state_store = StateStore(str(tmp_path / 'state'))
+    signatures = [_make_signature('tokens', r'token is \w+')]
+    channels = [_make_channel('C1', 'F1'), _make_channel('C2', 'F2')]
+
+    first, second = [], []
+    _make_scanner(mock_slack, first, signatures, state_store=state_store, emit_mode='new').run(channels)
+    assert mock_slack.iter_file_content.call_count == 2
+
+    mock_slack.iter_file_content.reset_mock()
+    scanner = _make_scanner(mock_slack, second, signatures, state_store=state_store, emit_mode='new')
+    scanner.run(channels)
+    state_store.close()
+
+    assert len(first) == 1
+    assert second == []
+    mock_slack.iter_file_content.assert_not_called()
+    assert scanner.stats['unchanged'] == 2
+
+
+def test_canvas_scanner_logs_failed_canvas(mock_slack):
+    findings = []
+    mock_slack.get_file_info.side_effect = ValueError('file_not_found')
+    scanner = _make_scanner(mock_slack, findings, [_make_signature('tokens', r'token is \w+')])
+    scanner.run([_make_channel('C1', 'F1')])
+
+    assert findings == []
+    assert scanner.stats['failed'] == 1
+    scanner.logger.log.assert_called_with('WARNING', 'Couldn\'t read the canvas in channel C1: file_not_found')
+
+
+def test_canvas_scanner_rejects_new_resolved(mock_slack):
+    with pytest.raises(ValueError):
+        _make_scanner(mock_slack, [], [], emit_mode='new-resolved')
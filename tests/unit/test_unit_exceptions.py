@@ -9,7 +9,8 @@ from slack_watchman.exceptions import (
     SlackScopeError,
     SlackAPIError,
     SlackAPIRateLimit,
-    MissingCookieAuthError
+    MissingCookieAuthError,
+    ArchiveLimitError
 )
 
 
@@ -95,3 +96,11 @@ def test_missing_cookie_auth_error():
     )
     with pytest.raises(MissingCookieAuthError, match='Cookie authentication has been selected, but missing'):
         raise exc
+
+
+def test_archive_limit_error():
+    exc = ArchiveLimitError('more than 10 members')
+    assert exc.limit == 'more than 10 members'
+    assert exc.message == 'Archive limit reached: more than 10 members'
+    with pytest.raises(ArchiveLimitError, match='Archive limit reached: more than 10 members'):
+        raise exc
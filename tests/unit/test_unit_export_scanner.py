@@ -0,0 +1,172 @@
+import json
+import zipfile
+from unittest.mock import MagicMock
+
+import pytest
+
+from slack_watchman.export_scanner import ExportScanner, list_export_members
+from slack_watchman.models import post, signature, user
+from slack_watchman.state import StateStore
+from slack_watchman.watchman_id import message_watchman_id
+
+
+def _make_signature(signature_id, pattern, scope=None):
+    mock_sig = MagicMock(spec=signature.Signature)
+    mock_sig.id = signature_id
+    mock_sig.name = signature_id
+    mock_sig.severity = '70'
+    mock_sig.scope = scope or ['messages']
+    mock_sig.patterns = [pattern]
+    return mock_sig
+
+
+@pytest.fixture
+def export_path(tmp_path):
+    path = tmp_path / 'export.zip'
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('users.json', json.dumps([{'id': 'U1', 'name': 'alice', 'profile': {}}]))
+        archive.writestr('channels.json', json.dumps([{'id': 'C1', 'name': 'general'}]))
+        archive.writestr('groups.json', json.dumps([{'id': 'G1', 'name': 'private'}]))
+        archive.writestr('general/2024-01-02.json', json.dumps([
+            {'type': 'message', 'user': 'U1', 'text': 'password and token', 'ts': '1704153600.000100'},
+            {'type': 'message', 'user': 'U2', 'text': 'nothing here', 'ts': '1704153600.000200'}
+        ]))
+        archive.writestr('general/2023-06-01.json', json.dumps([
+            {'type': 'message', 'user': 'U1', 'text': 'old token', 'ts': '1685577600.000100'}
+        ]))
+        archive.writestr('private/2024-01-03.json', json.dumps([
+            {'type': 'message', 'user': 'U2', 'text': 'another token', 'ts': '1704240000.000100'}
+        ]))
+    return str(path)
+
+
+def _make_scanner(path, findings, signatures, **kwargs):
+    return ExportScanner(
+        path,
+        MagicMock(),
+        verbose=False,
+        signatures=signatures,
+        on_finding=lambda unit, finding: findings.append((unit, finding)),
+        timeframe='2024-01-01',
+        processes=1,
+        **kwargs)
+
+
+def test_list_export_members(export_path):
+    with zipfile.ZipFile(export_path) as archive:
+        assert sorted(list_export_members(archive)) == [
+            ('general/2023-06-01.json', 'general'),
+            ('general/2024-01-02.json', 'general'),
+            ('private/2024-01-03.json', 'private')]
+        assert sorted(list_export_members(archive, '2024-01-01')) == [
+            ('general/2024-01-02.json', 'general'),
+            ('private/2024-01-03.json', 'private')]
+
+
+def test_export_scanner_matches_every_signature(export_path):
+    """Every message in the timeframe is matched against every signature with the messages scope."""
+
+    findings = []
+    scanner = _make_scanner(export_path, findings, [
+        _make_signature('passwords', r'password'),
+        _make_signature('tokens', r'token'),
+        _make_signature('files_only', r'token', scope=['files'])])
+    scanner.run()
+
+    by_query = sorted((unit.signature.id, unit.scope, unit.query, finding['match_string'])
+                      for unit, finding in findings)
+    assert by_query == [
+        ('passwords', 'messages', 'general', 'password'),
+        ('tokens', 'messages', 'general', 'token'),
+        ('tokens', 'messages', 'private', 'token')]
+    assert scanner.files_read == 2
+    assert scanner.messages_read == 3
+    # Every message read is a potential match for each signature
+    assert scanner.stats[('tokens', 'messages')] == {'potential_matches': 3, 'matches': 2}
+    assert scanner.stats[('passwords', 'messages')] == {'potential_matches': 3, 'matches': 1}
+
+
+def test_export_scanner_finding_schema(export_path):
+    """Findings have the same watchman_id and schema as a search, enriched from the export."""
+
+    findings = []
+    _make_scanner(export_path, findings, [_make_signature('passwords', r'password')]).run()
+
+    assert len(findings) == 1
+    finding = findings[0][1]
+    assert finding['watchman_id'] == message_watchman_id('password', '1704153600.000100')
+    assert finding['match_location'] == 'text'
+    assert isinstance(finding['message'], post.Message)
+    assert isinstance(finding['message'].user, user.UserSuccinct)
+    assert finding['message'].user.id == 'U1'
+    assert finding['message'].conversation.name == 'general'
+
+
+def test_export_scanner_all_matches(export_path):
+    """Every distinct match in a message is a finding, sharing one enriched message."""
+
+    findings = []
+    _make_scanner(export_path, findings, [_make_signature('secrets', r'password|token')], all_matches=True).run()
+
+    general = [finding for unit, finding in findings if unit.query == 'general']
+    assert [finding['match_string'] for finding in general] == ['password', 'token']
+    assert general[0]['watchman_id'] == message_watchman_id('password', '1704153600.000100')
+    assert general[1]['watchman_id'] == message_watchman_id('token', '1704153600.000100')
+    assert general[0]['message'] is general[1]['message']
+    assert len(findings) == 3
+
+
+def test_export_scanner_partial_export(tmp_path):
+    """Conversations missing from the conversation lists are named after their directory."""
+
+    path = tmp_path / 'partial.zip'
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('random/2024-01-02.json', json.dumps([
+            {'type': 'message', 'user': 'U1', 'text': 'a token', 'ts': '1704153600.000100'}
+        ]))
+
+    findings = []
+    _make_scanner(str(path), findings, [_make_signature('tokens', r'token')]).run()
+
+    assert len(findings) == 1
+    finding = findings[0][1]
+    assert finding['message'].conversation.name == 'random'
+    assert finding['message'].user == 'U1'
+
+
+def test_export_scanner_skips_corrupt_files(tmp_path):
+    """A daily file that can't be read is logged and skipped, and the rest of the export is still scanned."""
+
+    path = tmp_path / 'corrupt.zip'
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('general/2024-01-02.json', 'not json')
+        archive.writestr('general/2024-01-03.json', json.dumps([
+            {'type': 'message', 'user': 'U1', 'text': 'a token', 'ts': '1704240000.000100'}
+        ]))
+
+    findings = []
+    scanner = _make_scanner(str(path), findings, [_make_signature('tokens', r'token')])
+    scanner.run()
+
+    assert [finding['match_string'] for _, finding in findings] == ['token']
+    assert scanner.files_read == 1
+    assert any(call.args[0] == 'WARNING' and 'general/2024-01-02.json' in call.args[1]
+               for call in scanner.logger.log.call_args_list)
+
+
+def test_export_scanner_emits_new_only(export_path, tmp_path):
+    state_store = StateStore(str(tmp_path / 'state'))
+    signatures = [_make_signature('tokens', r'token')]
+
+    first, second = [], []
+    _make_scanner(export_path, first, signatures, state_store=state_store, emit_mode='new').run()
+    _make_scanner(export_path, second, signatures, state_store=state_store, emit_mode='new').run()
+    state_store.close()
+
+    assert len(first) == 2
+    assert second == []
+
+
+def test_export_scanner_rejects_new_resolved(export_path):
+    with pytest.raises(ValueError):
+        _make_scanner(export_path, [], [], emit_mode='new-resolved')
@@ -0,0 +1,271 @@
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+from unittest.mock import MagicMock
+
+import pytest
+
+from slack_watchman import matcher
+from slack_watchman.clients.slack_client import SlackClient
+from slack_watchman.file_content import (
+    ArchiveLimits,
+    FileContentReader,
+    archive_type,
+    is_text_file,
+    iter_text_chunks,
+    scan_archive
+)
+from slack_watchman.models import signature
+
+PATTERNS = matcher.compile_patterns([r'AKIA[0-9A-Z]{4}'])
+
+
+@pytest.mark.parametrize(
+    "file_dict, expected",
+    [
+        ({'filetype': 'text'}, True),
+        ({'filetype': 'YAML'}, True),
+        ({'filetype': 'binary', 'mimetype': 'text/plain'}, True),
+        ({'filetype': 'zip', 'mimetype': 'application/zip'}, False),
+        ({}, False),
+    ]
+)
+def test_is_text_file(file_dict, expected):
+    assert is_text_file(file_dict) == expected
+
+
+def test_iter_text_chunks_overlaps_chunks():
+    """Each chunk starts with the end of the previous one, so a match across the boundary is found."""
+
+    chunks = list(iter_text_chunks([b'abcdefgh', b'ijKEYmnop', b'qr'], chunk_size=6, overlap=3))
+
+    assert chunks == ['abcdef', 'defghijKE', 'jKEYmnopq', 'opqr']
+    assert 'KEY' in chunks[2]
+
+
+def test_iter_text_chunks_decodes_split_characters():
+    data = 'café été'.encode()
+
+    chunks = list(iter_text_chunks([data[:4], data[4:]], chunk_size=100, overlap=0))
+
+    assert chunks == ['café été']
+
+
+def test_iter_text_chunks_stops_at_max_bytes():
+    data = iter([b'12345', b'67890', b'never read'])
+
+    assert list(iter_text_chunks(data, chunk_size=100, overlap=0, max_bytes=7)) == ['1234567']
+    assert next(data) == b'never read'
+
+
+def _generator(chunks, closed):
+    try:
+        yield from chunks
+    finally:
+        closed.append(True)
+
+
+def test_file_content_reader():
+    closed = []
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_slack.iter_file_content.return_value = _generator([b'password=hunter2\n'], closed)
+    reader = FileContentReader(mock_slack, max_bytes=100, chunk_size=10, overlap=4)
+    file_dict = {'filetype': 'text', 'size': 17, 'url_private_download': 'https://files.slack.com/f'}
+
+    assert list(reader.iter_chunks(file_dict)) == ['password=h', 'rd=hunter2\n']
+    mock_slack.iter_file_content.assert_called_once_with('https://files.slack.com/f', 10)
+    assert closed == [True]
+
+
+@pytest.mark.parametrize(
+    "file_dict",
+    [
+        {'filetype': 'zip', 'size': 10, 'url_private_download': 'https://files.slack.com/f'},
+        {'filetype': 'text', 'size': 1000, 'url_private_download': 'https://files.slack.com/f'},
+        {'filetype': 'text', 'size': 10},
+    ]
+)
+def test_file_content_reader_skips_files(file_dict):
+    mock_slack = MagicMock(spec=SlackClient)
+    reader = FileContentReader(mock_slack, max_bytes=100)
+
+    assert not reader.should_read(file_dict)
+    assert list(reader.iter_chunks(file_dict)) == []
+    mock_slack.iter_file_content.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "file_name, expected",
+    [
+        ('config.zip', 'zip'),
+        ('logs.TAR.GZ', 'tar.gz'),
+        ('logs.tgz', 'tar.gz'),
+        ('app.log.gz', 'gz'),
+        ('notes.txt', None),
+        (None, None),
+    ]
+)
+def test_archive_type(file_name, expected):
+    assert archive_type(file_name) == expected
+
+
+def _write_zip(path, members):
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+def _write_tar_gz(path, members):
+    with tarfile.open(path, 'w:gz') as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+
+@pytest.mark.parametrize("file_name", ['bundle.zip', 'bundle.tar.gz'])
+def test_scan_archive(tmp_path, file_name):
+    """Text members are matched, and binary members are skipped."""
+
+    path = str(tmp_path / file_name)
+    members = {
+        'config/prod.env': b'KEY=AKIAAAAA\n',
+        'config/dev.env': b'KEY=AKIABBBB\nOTHER=AKIAAAAA\n',
+        'image.png': b'\x89PNG\x00\x00AKIACCCC',
+    }
+    (_write_zip if file_name.endswith('.zip') else _write_tar_gz)(path, members)
+
+    match_strings, stopped = scan_archive(path, file_name, ArchiveLimits(), 100, 10, PATTERNS)
+
+    assert sorted(match_strings) == ['AKIAAAAA', 'AKIABBBB']
+    assert stopped is None
+
+
+def test_scan_archive_counts_skipped_tar_members(tmp_path):
+    """A binary tar member that is skipped is still decompressed, so it counts towards the limits."""
+
+    path = str(tmp_path / 'bomb.tar.gz')
+    _write_tar_gz(path, {'zeros.bin': b'\0' * (20 * 1024 * 1024), 'config.env': b'password=hunter2\n'})
+    limits = ArchiveLimits(max_total_bytes=1024 * 1024, max_ratio=1000000)
+
+    assert scan_archive(path, 'bomb.tar.gz', limits, 100, 10, matcher.compile_patterns([r'password=\w+'])) == (
+        [], f'more than {1024 * 1024} bytes decompressed')
+    assert scan_archive(path, 'bomb.tar.gz', ArchiveLimits(max_ratio=10), 100, 10, PATTERNS) == (
+        [], 'compression ratio over 10')
+
+
+def test_scan_archive_all_matches(tmp_path):
+    """Every distinct match in a member is reported when all_matches is set."""
+
+    path = str(tmp_path / 'bundle.zip')
+    _write_zip(path, {'config/prod.env': b'KEY=AKIAAAAA\nOTHER=AKIABBBB\n'})
+
+    assert scan_archive(path, 'bundle.zip', ArchiveLimits(), 100, 10, PATTERNS) == (['AKIAAAAA'], None)
+    match_strings, stopped = scan_archive(path, 'bundle.zip', ArchiveLimits(), 100, 10, PATTERNS, all_matches=True)
+
+    assert sorted(match_strings) == ['AKIAAAAA', 'AKIABBBB']
+    assert stopped is None
+
+
+def test_scan_archive_gzip(tmp_path):
+    path = str(tmp_path / 'app.log.gz')
+    with gzip.open(path, 'wb') as gzip_file:
+        gzip_file.write(b'line\n' * 1000 + b'token AKIADDDD\n')
+
+    assert scan_archive(path, 'app.log.gz', ArchiveLimits(), 100, 10, PATTERNS) == (['AKIADDDD'], None)
+
+
+@pytest.mark.parametrize(
+    "limits, expected",
+    [
+        (ArchiveLimits(max_members=1), 'more than 1 members'),
+        (ArchiveLimits(max_total_bytes=1000), 'more than 1000 bytes decompressed'),
+        (ArchiveLimits(max_ratio=2), 'compression ratio over 2'),
+    ]
+)
+def test_scan_archive_limits(tmp_path, limits, expected):
+    """Decompression stops as soon as a limit is reached, keeping the matches found so far."""
+
+    path = str(tmp_path / 'bomb.zip')
+    _write_zip(path, {'first.txt': b'AKIAAAAA\n', 'second.txt': b'0' * 100000})
+
+    match_strings, stopped = scan_archive(path, 'bomb.zip', limits, 100, 10, PATTERNS)
+
+    assert match_strings == ['AKIAAAAA']
+    assert stopped == expected
+
+
+def test_scan_archive_invalid(tmp_path):
+    path = tmp_path / 'broken.zip'
+    path.write_bytes(b'not a zip file')
+
+    match_strings, stopped = scan_archive(str(path), 'broken.zip', ArchiveLimits(), 100, 10, PATTERNS)
+
+    assert match_strings == []
+    assert stopped.startswith('invalid archive')
+
+
+def _archive_bytes(tmp_path, members):
+    path = tmp_path / 'upload.zip'
+    _write_zip(str(path), members)
+    return path.read_bytes()
+
+
+def _archive_reader(tmp_path, data, max_bytes=1000):
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_slack.iter_file_content.side_effect = lambda url, chunk_size: _generator([data[:50], data[50:]], [])
+    reader = FileContentReader(mock_slack, max_bytes=max_bytes, archive_limits=ArchiveLimits())
+    file_dict = {'id': 'F1', 'name': 'upload.zip', 'filetype': 'zip', 'size': len(data),
+                 'url_private_download': 'https://files.slack.com/upload.zip'}
+    return reader, file_dict
+
+
+def test_file_content_reader_scan_archive(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'temp')
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path / 'temp'))
+    data = _archive_bytes(tmp_path, {'prod.env': b'KEY=AKIAAAAA\n'})
+    reader, file_dict = _archive_reader(tmp_path, data)
+
+    assert reader.is_archive(file_dict)
+    assert reader.should_read(file_dict)
+    assert list(reader.iter_chunks(file_dict)) == []
+    assert reader.scan_archive(file_dict, 'sig', PATTERNS, matcher.PatternGuard()) == (['AKIAAAAA'], None)
+    # The temporary file is removed once the archive has been read
+    assert os.listdir(tmp_path / 'temp') == []
+
+
+def test_file_content_reader_archive_over_size_cap(tmp_path):
+    data = _archive_bytes(tmp_path, {'prod.env': b'KEY=AKIAAAAA\n'})
+    reader, file_dict = _archive_reader(tmp_path, data, max_bytes=len(data) - 1)
+    # Slack reported a smaller size than was downloaded
+    file_dict['size'] = 10
+
+    assert reader.scan_archive(file_dict, 'sig', PATTERNS, matcher.PatternGuard()) == (
+        [], f'archive larger than {len(data) - 1} bytes')
+
+
+def test_file_content_reader_skips_archives_without_limits():
+    reader = FileContentReader(MagicMock(spec=SlackClient))
+    file_dict = {'name': 'upload.zip', 'filetype': 'zip', 'size': 10, 'url_private_download': 'https://f'}
+
+    assert not reader.is_archive(file_dict)
+    assert not reader.should_read(file_dict)
+
+
+def test_file_content_reader_scan_archive_in_matcher_pool(tmp_path):
+    """Decompression and matching run in the matcher pool when one is given."""
+
+    mock_sig = MagicMock(spec=signature.Signature)
+    mock_sig.id = 'sig'
+    mock_sig.patterns = [r'AKIA[0-9A-Z]{4}']
+    data = _archive_bytes(tmp_path, {'prod.env': b'KEY=AKIAAAAA\n'})
+    reader, file_dict = _archive_reader(tmp_path, data)
+    guard = matcher.PatternGuard()
+
+    with matcher.MatcherPool([mock_sig], processes=1) as pool:
+        result = reader.scan_archive(file_dict, 'sig', None, guard, matcher_pool=pool)
+
+    assert result == (['AKIAAAAA'], None)
+    assert guard.costs[('sig', r'AKIA[0-9A-Z]{4}')].calls == 1
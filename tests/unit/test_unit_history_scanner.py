@@ -0,0 +1,231 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from slack_watchman.clients.slack_client import SlackClient
+from slack_watchman.history_scanner import HistoryScanner, history_watermark_id, plan_channel_work_units
+from slack_watchman.message_text import flatten_message
+from slack_watchman.models import conversation, signature
+from slack_watchman.state import StateStore
+
+
+def _make_signature(signature_id, pattern, scope=None):
+    mock_sig = MagicMock(spec=signature.Signature)
+    mock_sig.id = signature_id
+    mock_sig.name = signature_id
+    mock_sig.severity = '70'
+    mock_sig.scope = scope or ['messages']
+    mock_sig.patterns = [pattern]
+    return mock_sig
+
+
+def _make_channels(*channel_ids):
+    channels = []
+    for channel_id in channel_ids:
+        channel = MagicMock(spec=conversation.Conversation)
+        channel.id = channel_id
+        channels.append(channel)
+    return channels
+
+
+def _make_slack(history):
+    # Pages of history newest first, only keeping messages before `latest` as Slack does
+    def iter_history(channel_id, oldest, latest, team_id=None):
+        for page in history[channel_id]:
+            page = [message for message in page if not latest or float(message['ts']) < latest]
+            if page:
+                yield page
+
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_slack.iter_conversation_history.side_effect = iter_history
+    return mock_slack
+
+
+def _make_scanner(mock_slack, findings, signatures, **kwargs):
+    directory = MagicMock()
+    directory.get_conversation.return_value = None
+    return HistoryScanner(
+        mock_slack,
+        MagicMock(),
+        verbose=False,
+        timeframe='2024-01-01',
+        on_finding=lambda unit, finding: findings.append((unit, finding)),
+        signatures=signatures,
+        workspace_url='https://example.slack.com/',
+        directory=directory,
+        **kwargs)
+
+
+def test_plan_channel_work_units():
+    work_units = plan_channel_work_units(_make_channels('C1', 'C2'))
+
+    assert [(unit.signature, unit.scope, unit.query) for unit in work_units] == [
+        (None, 'history', 'C1'), (None, 'history', 'C2')]
+    assert work_units[0].key == 'history.C1'
+
+
+def test_history_scanner_matches_every_signature():
+    """Every message in every channel is matched against every signature with the messages scope."""
+
+    mock_slack = _make_slack({
+        'C1': [[{'text': 'password and token', 'ts': '1704153600.000100'}], [{'text': 'nothing', 'ts': '1'}]],
+        'C2': [[{'text': 'another token', 'ts': '1704153600.000200'}]]
+    })
+    signatures = [
+        _make_signature('passwords', r'password'),
+        _make_signature('tokens', r'token'),
+        _make_signature('files_only', r'token', scope=['files'])
+    ]
+
+    findings = []
+    scanner = _make_scanner(mock_slack, findings, signatures)
+    scanner.run(plan_channel_work_units(_make_channels('C1', 'C2')))
+
+    assert sorted((unit.signature.id, unit.query, finding['match_string']) for unit, finding in findings) == [
+        ('passwords', 'C1', 'password'), ('tokens', 'C1', 'token'), ('tokens', 'C2', 'token')]
+    first_call = mock_slack.iter_conversation_history.call_args_list[0]
+    assert first_call.args[1] == pytest.approx(1704067200, abs=86400)
+    assert first_call.args[2] == scanner.latest
+    assert scanner.stats[('tokens', 'messages')] == {'potential_matches': 3, 'matches': 2}
+    assert scanner.completed
+    scanner.directory.get_conversation.assert_any_call('C2')
+    permalinks = {finding['message'].permalink for _, finding in findings}
+    assert 'https://example.slack.com/archives/C2/p1704153600000200' in permalinks
+
+
+def test_history_scanner_flattens_each_page_once():
+    """The text of a message is flattened once, and reused for every signature."""
+
+    mock_slack = _make_slack({'C1': [[{'text': 'password and token', 'ts': '1704153600.000100'}]]})
+    signatures = [_make_signature('passwords', r'password'), _make_signature('tokens', r'token')]
+
+    findings = []
+    with patch('slack_watchman.watchman_processor.flatten_message', side_effect=flatten_message) as mock_flatten:
+        _make_scanner(mock_slack, findings, signatures).run(plan_channel_work_units(_make_channels('C1')))
+
+    assert len(findings) == 2
+    assert mock_flatten.call_count == 1
+    assert {finding['match_location'] for _, finding in findings} == {'text'}
+
+
+def test_history_scanner_uses_watermarks(tmp_path):
+    signatures = [_make_signature('tokens', r'token')]
+    state_store = StateStore(str(tmp_path))
+    state_store.set_watermark(history_watermark_id(signatures), 'C1', 'history', 1717243200.0)
+    mock_slack = _make_slack({'C1': [[{'text': 'token', 'ts': '1717250000.000100'}]]})
+
+    _make_scanner(mock_slack, [], signatures, state_store=state_store).run(
+        plan_channel_work_units(_make_channels('C1')))
+
+    assert mock_slack.iter_conversation_history.call_args.args[1] == 1717243200.0
+    assert state_store.get_watermark(history_watermark_id(signatures), 'C1', 'history') == 1717250000.0001
+
+
+def test_history_scanner_watermarks_are_kept_per_signature_set(tmp_path):
+    """History read with some of the signatures is read again when more signatures are used."""
+
+    tokens, passwords = _make_signature('tokens', r'token'), _make_signature('passwords', r'password')
+    state_store = StateStore(str(tmp_path))
+    mock_slack = _make_slack({'C1': [[{'text': 'token and password', 'ts': '1717250000.000100'}]]})
+
+    _make_scanner(mock_slack, [], [tokens], state_store=state_store).run(plan_channel_work_units(_make_channels('C1')))
+    findings = []
+    _make_scanner(mock_slack, findings, [tokens, passwords], state_store=state_store).run(
+        plan_channel_work_units(_make_channels('C1')))
+
+    assert mock_slack.iter_conversation_history.call_args.args[1] == pytest.approx(1704067200, abs=86400)
+    assert sorted(finding['match_string'] for _, finding in findings) == ['password', 'token']
+    assert history_watermark_id([tokens, passwords]) == history_watermark_id([passwords, tokens])
+    assert history_watermark_id([tokens]) != history_watermark_id([tokens, passwords])
+
+
+def test_history_scanner_checkpoints_oldest_message_processed(tmp_path):
+    state_store = StateStore(str(tmp_path))
+    mock_slack = MagicMock(spec=SlackClient)
+
+    def pages(*args, **kwargs):
+        yield [{'text': 'token one', 'ts': '1704153600.000100'}, {'text': 'token two', 'ts': '1704153500.000100'}]
+        raise ValueError('rate limited')
+
+    mock_slack.iter_conversation_history.side_effect = pages
+    scanner = _make_scanner(mock_slack, [], [_make_signature('tokens', r'token \w+')], state_store=state_store)
+    scanner.run(plan_channel_work_units(_make_channels('C1')))
+
+    assert not scanner.completed
+    assert state_store.get_unit_progress('history.C1') == (2, False, 1704153600.0001, 1704153500.0001)
+
+
+def test_history_scanner_resumes_after_processed_pages(tmp_path):
+    """A resumed scan carries on paging from the oldest message processed, without fetching earlier pages."""
+
+    state_store = StateStore(str(tmp_path))
+    state_store.start_checkpoint({'timeframe': '2024-01-01', 'latest': 1800000000.0})
+    state_store.save_unit_progress('history.C1', 2, False, 1704153600.0001, resume_before=1704153600.0001)
+    mock_slack = _make_slack({
+        'C1': [[{'text': 'token one', 'ts': '1704153600.000100'}], [{'text': 'token two', 'ts': '1704067300.0'}]]
+    })
+
+    findings = []
+    scanner = _make_scanner(mock_slack, findings, [_make_signature('tokens', r'token \w+')], state_store=state_store)
+    scanner.run(plan_channel_work_units(_make_channels('C1')), resume=True)
+
+    assert [finding['match_string'] for _, finding in findings] == ['token two']
+    assert mock_slack.iter_conversation_history.call_args.args[2] == 1704153600.0001
+    # One page fetched, with one finding on it
+    assert state_store.get_query_yields() == {'history.C1': 1.0}
+    assert state_store.get_checkpoint() is None
+
+
+def test_history_scanner_expands_threads(tmp_path):
+    """Threads with replies since the watermark are found on parents from before it, and only newer
+    replies are fetched."""
+
+    signatures = [_make_signature('tokens', r'token is \w+')]
+    state_store = StateStore(str(tmp_path))
+    state_store.set_watermark(history_watermark_id(signatures), 'C1', 'history', 1717243200.0)
+    mock_slack = _make_slack({'C1': [[
+        {'text': 'the token is new', 'ts': '1717250000.000100'},
+        {'text': 'old thread, the token is old', 'ts': '1717000000.000100', 'thread_ts': '1717000000.000100',
+         'reply_count': 2, 'latest_reply': '1717250100.000100'},
+        {'text': 'quiet thread', 'ts': '1717000100.000100', 'thread_ts': '1717000100.000100', 'reply_count': 1,
+         'latest_reply': '1717100000.000100'}
+    ]]})
+    mock_slack.iter_conversation_replies.return_value = iter([[
+        {'text': 'old thread, the token is old', 'ts': '1717000000.000100', 'thread_ts': '1717000000.000100'},
+        {'text': 'the token is abc', 'ts': '1717250100.000100', 'thread_ts': '1717000000.000100'}
+    ]])
+
+    findings = []
+    scanner = _make_scanner(mock_slack, findings, signatures, state_store=state_store, expand_threads=True)
+    scanner.run(plan_channel_work_units(_make_channels('C1')))
+
+    assert mock_slack.iter_conversation_history.call_args.args[1] == pytest.approx(1704067200, abs=86400)
+    mock_slack.iter_conversation_replies.assert_called_once_with(
+        'C1', '1717000000.000100', 1717243200.0, scanner.latest, team_id=None)
+    assert sorted(finding['match_string'] for _, finding in findings) == ['token is abc', 'token is new']
+    reply = next(finding for _, finding in findings if finding['match_string'] == 'token is abc')
+    assert reply['message'].permalink == \
+        'https://example.slack.com/archives/C1/p1717250100000100?thread_ts=1717000000.000100&cid=C1'
+    assert [stage.name for stage in scanner.pipeline.stages] == ['fetch', 'threads', 'match', 'enrich', 'emit']
+    assert scanner.completed
+
+
+def test_history_scanner_keeps_progress_when_replies_fail(tmp_path):
+    state_store = StateStore(str(tmp_path))
+    mock_slack = _make_slack({'C1': [[
+        {'text': 'thread', 'ts': '1717250000.000100', 'thread_ts': '1717250000.000100', 'reply_count': 1}
+    ]]})
+    mock_slack.iter_conversation_replies.side_effect = ValueError('rate limited')
+
+    scanner = _make_scanner(mock_slack, [], [_make_signature('tokens', r'token')],
+                            state_store=state_store, expand_threads=True)
+    scanner.run(plan_channel_work_units(_make_channels('C1')))
+
+    assert not scanner.completed
+    assert state_store.get_watermark(scanner.watermark_id, 'C1', 'history') is None
+
+
+def test_history_scanner_rejects_new_resolved(tmp_path):
+    with pytest.raises(ValueError):
+        _make_scanner(MagicMock(spec=SlackClient), [], [], state_store=StateStore(str(tmp_path)),
+                      emit_mode='new-resolved')
@@ -26,6 +26,59 @@ def test_stdout_logger_log(mock_write, mock_stdout_logger):
     assert 'Test Message' in str(formatted_call)
 
 
+def test_stdout_logger_formats_profile_result(mock_stdout_logger):
+    message, level = mock_stdout_logger.formatters['result']({
+        'field': 'title',
+        'match_string': 'xoxb-123',
+        'user': {'display_name': 'alice', 'email': 'alice@example.com'}
+    })
+
+    assert level == 'RESULT'
+    assert message.splitlines()[:2] == ['POST_TYPE: Profile ', '    USER: alice - alice@example.com ']
+    assert '    POTENTIAL_SECRET: xoxb-123 ' in message.splitlines()
+
+
+def test_stdout_logger_formats_message_without_conversation(mock_stdout_logger):
+    message, _ = mock_stdout_logger.formatters['result']({
+        'message': {'user': 'U1', 'conversation': None, 'created': '2024-01-01'},
+        'match_string': 'xoxb-123'
+    })
+
+    assert 'CONVERSATION_TYPE: Public Channel' in message
+    assert 'POTENTIAL_SECRET: xoxb-123' in message
+
+
+def test_stdout_logger_formats_file_content_result(mock_stdout_logger):
+    message, _ = mock_stdout_logger.formatters['result']({
+        'file': {'name': 'Canvas', 'created': '2024-01-01'},
+        'user': None,
+        'match_string': 'xoxb-123',
+        'canvas_url': 'https://example.slack.com/canvas/C1'
+    })
+
+    lines = message.splitlines()
+    assert lines[:2] == ['POST_TYPE: File ', '    POSTED_BY: None ']
+    assert '    CANVAS_URL: https://example.slack.com/canvas/C1 ' in lines
+    assert '    POTENTIAL_SECRET: xoxb-123 ' in lines
+
+
+def test_stdout_logger_formats_file_name_result(mock_stdout_logger):
+    message, _ = mock_stdout_logger.formatters['result']({
+        'file': {'name': 'passwords.txt'},
+        'user': {'display_name': 'alice', 'email': 'alice@example.com'}
+    })
+
+    assert '    POSTED_BY: alice - alice@example.com ' in message.splitlines()
+    assert 'POTENTIAL_SECRET' not in message
+
+
+@patch('sys.stdout.write', autospec=True)
+def test_stdout_logger_log_uses_formatter(mock_write, mock_stdout_logger):
+    mock_stdout_logger.log('RESULT', {'signature_name': 'Tokens', 'watchman_id': 'abc'}, notify_type='resolved')
+
+    assert any('WATCHMAN_ID' in str(call) and 'abc' in str(call) for call in mock_write.mock_calls)
+
+
 def test_json_logger_log(mock_json_logger):
     """Test logging functionality of JSONLogger."""
     with patch.object(mock_json_logger.logger, 'info') as mock_info:
@@ -0,0 +1,180 @@
+import time
+from unittest.mock import patch
+
+import pytest
+
+from slack_watchman.matcher import (
+    compile_patterns,
+    get_engine,
+    init_worker,
+    match_texts,
+    MatcherPool,
+    PatternGuard,
+    StdlibEngine,
+    RegexModuleEngine,
+    worker_state
+)
+from slack_watchman.models import signature
+
+
+def _make_signature(signature_id, patterns):
+    return signature.create_from_dict({
+        'name': signature_id,
+        'id': signature_id,
+        'status': 'enabled',
+        'author': 'PaperMtn',
+        'date': '2024-01-01',
+        'version': '1.0',
+        'description': 'Test signature',
+        'severity': '70',
+        'watchman_apps': {'slack_std': {'category': 'secrets', 'scope': ['messages'], 'search_strings': ['key']}},
+        'test_cases': {'match_cases': [], 'fail_cases': []},
+        'patterns': patterns
+    })
+
+
+def test_match_texts():
+    patterns = compile_patterns([r'AKIA[A-Z0-9]{4}', r'secret'])
+    texts = ['nothing here', 'AKIAABCD and a secret', 'just a secret']
+
+    assert match_texts(patterns, texts) == [(1, 'AKIAABCD'), (1, 'secret'), (2, 'secret')]
+    assert patterns[0][0] == r'AKIA[A-Z0-9]{4}'
+
+
+def test_match_texts_all_matches():
+    patterns = compile_patterns([r'AKIA[A-Z0-9]{4}', r'secret'])
+    texts = ['AKIAABCD AKIAEFGH AKIAABCD secret', 'AKIAIJKL']
+
+    assert match_texts(patterns, texts, all_matches=True) == [
+        (0, 'AKIAABCD'), (0, 'AKIAEFGH'), (0, 'secret'), (1, 'AKIAIJKL')]
+
+
+def test_match_texts_all_matches_guard_times_one_pass():
+    guard = PatternGuard(budget=10)
+
+    match_texts(compile_patterns([r'secret']), ['secret secret secret'], guard, 'sig', all_matches=True)
+
+    assert guard.costs[('sig', 'secret')].calls == 1
+
+
+def test_match_texts_no_patterns():
+    assert match_texts(compile_patterns(None), ['secret']) == []
+
+
+def test_matcher_pool():
+    signatures = [_make_signature('aws', [r'AKIA[A-Z0-9]{4}']), _make_signature('other', [r'secret'])]
+
+    with MatcherPool(signatures, processes=1) as pool:
+        assert pool.match('aws', ['AKIAABCD', 'secret']) == [(0, 'AKIAABCD')]
+        assert pool.match('other', ['AKIAABCD', 'secret']) == [(1, 'secret')]
+        assert pool.match('unknown', ['secret']) == []
+        assert pool.match('aws', []) == []
+        assert pool.match('aws', ['AKIAABCD AKIAEFGH'], all_matches=True) == [(0, 'AKIAABCD'), (0, 'AKIAEFGH')]
+
+
+def test_init_worker(monkeypatch):
+    monkeypatch.setattr('slack_watchman.matcher._WORKER_STATE', {})
+    assert not worker_state()
+
+    init_worker({'aws': [r'AKIA[A-Z0-9]{4}']}, 2.0, 're')
+
+    state = worker_state()
+    assert isinstance(state['engine'], StdlibEngine)
+    assert state['budget'] == 2.0
+    assert match_texts(state['patterns']['aws'], ['AKIAABCD'], engine=state['engine']) == [(0, 'AKIAABCD')]
+
+
+def test_matcher_pool_merges_costs_into_guard():
+    signatures = [_make_signature('aws', [r'AKIA[A-Z0-9]{4}', r'secret'])]
+    guard = PatternGuard(budget=10)
+    guard.record('aws', 'secret', 0.0, calls=0, quarantined=True)
+
+    with MatcherPool(signatures, processes=1, budget=10) as pool:
+        assert pool.match('aws', ['AKIAABCD secret'], guard) == [(0, 'AKIAABCD')]
+
+    assert guard.costs[('aws', r'AKIA[A-Z0-9]{4}')].calls == 1
+    assert guard.costs[('aws', 'secret')].calls == 0
+
+
+def test_pattern_guard_quarantines_over_budget():
+    guard = PatternGuard(budget=0.5)
+    guard.record('sig', 'fast', 0.1)
+    guard.record('sig', 'slow', 0.1)
+    guard.record('sig', 'slow', 0.6)
+
+    assert not guard.is_quarantined('sig', 'fast')
+    assert guard.is_quarantined('sig', 'slow')
+    assert guard.quarantined_patterns('sig') == ['slow']
+
+    costs, quarantined = guard.report()
+    assert [cost.pattern for cost in costs] == ['slow', 'fast']
+    assert costs[0].calls == 2
+    assert costs[0].max_seconds == 0.6
+    assert [cost.pattern for cost in quarantined] == ['slow']
+
+
+def test_pattern_guard_no_budget():
+    guard = PatternGuard(budget=None)
+    guard.record('sig', 'slow', 100)
+    assert not guard.is_quarantined('sig', 'slow')
+
+
+def test_match_texts_skips_quarantined_patterns():
+    guard = PatternGuard(budget=1)
+    guard.record('sig', 'secret', 0.0, calls=0, quarantined=True)
+    patterns = compile_patterns(['secret', 'key'])
+
+    assert match_texts(patterns, ['secret key'], guard, 'sig') == [(0, 'key')]
+    assert guard.costs[('sig', 'key')].calls == 1
+
+
+def test_match_texts_quarantines_slow_pattern():
+    guard = PatternGuard(budget=0.5)
+    patterns = compile_patterns(['secret'])
+
+    with patch('slack_watchman.matcher.time.thread_time', side_effect=[0.0, 1.0]):
+        assert match_texts(patterns, ['secret', 'secret'], guard, 'sig') == [(0, 'secret')]
+
+    assert guard.is_quarantined('sig', 'secret')
+    assert guard.costs[('sig', 'secret')].calls == 1
+
+
+def test_match_texts_budget_counts_cpu_time():
+    """Time the thread spends not running, e.g. waiting for the GIL, isn't counted against the budget."""
+
+    guard = PatternGuard(budget=0.05)
+
+    with patch('slack_watchman.matcher._find', side_effect=lambda *args: time.sleep(0.2) or ['secret']):
+        assert match_texts(compile_patterns(['secret']), ['secret'], guard, 'sig') == [(0, 'secret')]
+
+    assert not guard.is_quarantined('sig', 'secret')
+
+
+def test_get_engine():
+    assert isinstance(get_engine('re'), StdlibEngine)
+    with patch('slack_watchman.matcher.regex', None):
+        assert isinstance(get_engine(), StdlibEngine)
+        with pytest.raises(ImportError):
+            get_engine('regex')
+
+
+def test_regex_engine_timeout_quarantines_pattern():
+    pytest.importorskip('regex')
+    engine = RegexModuleEngine()
+    guard = PatternGuard(budget=0.1)
+    patterns = compile_patterns([r'(a|aa)+c', 'a'], engine)
+
+    matches = match_texts(patterns, ['a' * 60], guard, 'sig', engine)
+
+    assert matches == [(0, 'a')]
+    assert guard.is_quarantined('sig', r'(a|aa)+c')
+    assert not guard.is_quarantined('sig', 'a')
+
+
+def test_regex_engine_all_matches():
+    pytest.importorskip('regex')
+    engine = RegexModuleEngine()
+    patterns = compile_patterns([r'key=\w+'], engine)
+
+    assert match_texts(patterns, ['key=a\nkey=b\nkey=a'], PatternGuard(budget=10), 'sig', engine,
+                       all_matches=True) == [(0, 'key=a'), (0, 'key=b')]
@@ -0,0 +1,79 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+from slack_watchman.pipeline import Pipeline, Stage
+
+
+def test_pipeline_runs_items_through_stages():
+    """Each item is passed through every stage in order."""
+    output = []
+    pipeline = Pipeline(
+        [
+            Stage('double', lambda item: [item * 2], workers=2),
+            Stage('split', lambda item: [item, item + 1], workers=2, queue_size=1),
+            Stage('collect', output.append, workers=1, queue_size=1),
+        ],
+        MagicMock())
+
+    pipeline.run(range(5))
+
+    assert sorted(output) == [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+
+
+def test_pipeline_logs_errors_and_continues():
+    """A failing item is logged, and the remaining items are still processed."""
+    output = []
+    mock_logger = MagicMock()
+
+    def handler(item):
+        if item == 2:
+            raise ValueError('bad item')
+        return [item]
+
+    pipeline = Pipeline([Stage('check', handler), Stage('collect', output.append)], mock_logger)
+    pipeline.run([1, 2, 3])
+
+    assert sorted(output) == [1, 3]
+    mock_logger.log.assert_any_call('ERROR', 'Error in check stage: bad item')
+
+
+def test_pipeline_submit_from_handler():
+    """Work added by a handler while the pipeline is running is processed before shutdown."""
+    output = []
+    pipeline = None
+
+    def handler(item):
+        if item < 3:
+            pipeline.submit(item + 1)
+        return [item]
+
+    pipeline = Pipeline([Stage('expand', handler, workers=2), Stage('collect', output.append)], MagicMock())
+    pipeline.run([0])
+
+    assert sorted(output) == [0, 1, 2, 3]
+
+
+def test_pipeline_backpressure():
+    """A full queue blocks the stage before it, so only a bounded number of items are in flight."""
+    release = threading.Event()
+    produced = []
+
+    def produce(item):
+        for number in range(10):
+            produced.append(number)
+            yield number
+
+    def consume(item):
+        release.wait()
+
+    pipeline = Pipeline([Stage('produce', produce), Stage('consume', consume, queue_size=2)], MagicMock())
+    runner = threading.Thread(target=pipeline.run, args=([None],))
+    runner.start()
+    time.sleep(0.2)
+
+    # One item being consumed, two waiting in the queue and one blocked on put
+    assert len(produced) <= 4
+    release.set()
+    runner.join()
+    assert len(produced) == 10
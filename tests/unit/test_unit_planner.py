@@ -0,0 +1,76 @@
+from unittest.mock import MagicMock
+
+from slack_watchman.clients.slack_client import SlackClient
+from slack_watchman.models import signature
+from slack_watchman.planner import plan_scan
+from slack_watchman.state import StateStore
+from slack_watchman.watchman_processor import plan_work_units
+
+
+def _make_signature():
+    mock_sig = MagicMock(spec=signature.Signature)
+    mock_sig.id = 'test_signature'
+    mock_sig.scope = ['messages', 'files']
+    mock_sig.search_strings = ['first', 'second']
+    return mock_sig
+
+
+def _make_slack(totals):
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_slack.count = 100
+    mock_slack.get_search_total.side_effect = lambda query, url, scope, timeframe, team_id=None: totals[(scope, query)]
+    return mock_slack
+
+
+def test_plan_scan():
+    mock_slack = _make_slack({
+        ('messages', 'first'): 250,
+        ('messages', 'second'): 0,
+        ('files', 'first'): 100,
+        ('files', 'second'): 30
+    })
+
+    scan_plan = plan_scan(mock_slack, plan_work_units([_make_signature()]), '2024-01-01')
+
+    assert [(estimate.total, estimate.pages) for estimate in scan_plan.estimates] == [
+        (250, 3), (0, 1), (100, 1), (30, 1)]
+    assert scan_plan.total_results == 380
+    assert scan_plan.probe_requests == 4
+    assert scan_plan.requests == {
+        'search.messages': 4,
+        'search.files': 2,
+        'users.info': 380,
+        'conversations.info': 250
+    }
+    assert scan_plan.minutes_by_method() == {
+        'search.messages': 0.2,
+        'search.files': 0.1,
+        'users.info': 3.8,
+        'conversations.info': 5.0
+    }
+    assert scan_plan.minutes == 5.0
+
+
+def test_plan_scan_uses_watermarks(tmp_path):
+    state_store = StateStore(str(tmp_path))
+    state_store.set_watermark('test_signature', 'first', 'messages', 1717243200.0)
+    mock_slack = _make_slack({
+        ('messages', 'first'): 10,
+        ('messages', 'second'): 10,
+        ('files', 'first'): 10,
+        ('files', 'second'): 10
+    })
+
+    scan_plan = plan_scan(mock_slack, plan_work_units([_make_signature()]), '2024-01-01', state_store=state_store)
+
+    assert scan_plan.estimates[0].after == '2024-05-31'
+    assert [estimate.after for estimate in scan_plan.estimates[1:]] == ['2024-01-01'] * 3
+    mock_slack.get_search_total.assert_any_call(
+        'first', 'search.messages', 'messages', '2024-05-31', team_id=None)
+
+
+def test_plan_scan_empty():
+    scan_plan = plan_scan(_make_slack({}), [], '2024-01-01')
+
+    assert scan_plan.requests == {}
+    assert scan_plan.minutes == 0
@@ -0,0 +1,113 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from slack_watchman.models import conversation, signature, user
+from slack_watchman.profile_scanner import ProfileScanner, iter_channel_fields, iter_user_fields
+from slack_watchman.state import StateStore
+from slack_watchman.watchman_id import profile_watchman_id
+
+
+def _make_signature(signature_id, pattern, scope=None):
+    mock_sig = MagicMock(spec=signature.Signature)
+    mock_sig.id = signature_id
+    mock_sig.name = signature_id
+    mock_sig.severity = '70'
+    mock_sig.scope = scope or ['messages']
+    mock_sig.patterns = [pattern]
+    return mock_sig
+
+
+USERS = [
+    {
+        'id': 'U1',
+        'name': 'alice',
+        'profile': {
+            'title': 'Engineer',
+            'phone': '',
+            'status_text': 'token is abc123',
+            'fields': {'Xf01': {'value': 'password is hunter2', 'alt': ''}}
+        }
+    },
+    {'id': 'U2', 'name': 'bob', 'profile': {'title': 'Nothing to see'}}
+]
+
+CHANNELS = [
+    {'id': 'C1', 'name': 'general', 'topic': {'value': 'deploy token is xyz789'}, 'purpose': {'value': ''}},
+    {'id': 'C2', 'name': 'random', 'topic': {'value': ''}, 'purpose': {'value': 'Chat'}}
+]
+
+
+def _make_scanner(findings, signatures, **kwargs):
+    return ProfileScanner(
+        MagicMock(),
+        verbose=False,
+        signatures=signatures,
+        on_finding=lambda unit, finding: findings.append((unit, finding)),
+        **kwargs)
+
+
+def test_iter_user_fields():
+    fields = [(field.field, field.text) for field in iter_user_fields(USERS[0])]
+
+    assert fields == [
+        ('title', 'Engineer'),
+        ('status_text', 'token is abc123'),
+        ('fields.Xf01.value', 'password is hunter2')]
+
+
+def test_iter_channel_fields():
+    assert [(field.field, field.text) for field in iter_channel_fields(CHANNELS[0])] == [
+        ('topic', 'deploy token is xyz789')]
+    assert [(field.field, field.text) for field in iter_channel_fields({'id': 'D1'})] == []
+
+
+def test_profile_scanner_matches_fields():
+    """Profile fields and channel topics are matched against the signatures with the messages scope."""
+
+    findings = []
+    scanner = _make_scanner(findings, [
+        _make_signature('tokens', r'token is \w+'),
+        _make_signature('passwords', r'password is \w+'),
+        _make_signature('files_only', r'Engineer', scope=['files'])])
+    scanner.run(USERS, CHANNELS)
+
+    by_signature = sorted((unit.signature.id, unit.scope, unit.query, finding['field'], finding['match_string'])
+                          for unit, finding in findings)
+    assert by_signature == [
+        ('passwords', 'profiles', 'U1', 'fields.Xf01.value', 'password is hunter2'),
+        ('tokens', 'profiles', 'C1', 'topic', 'token is xyz789'),
+        ('tokens', 'profiles', 'U1', 'status_text', 'token is abc123')]
+    assert scanner.stats == {'users': 2, 'channels': 2, 'fields': 6, 'matches': 3}
+
+
+def test_profile_scanner_finding_schema():
+    findings = []
+    _make_scanner(findings, [_make_signature('tokens', r'token is \w+')]).run(USERS, CHANNELS)
+
+    user_finding = next(finding for unit, finding in findings if unit.query == 'U1')
+    assert user_finding['watchman_id'] == profile_watchman_id('token is abc123', 'U1', 'status_text')
+    assert isinstance(user_finding['user'], user.UserSuccinct)
+    assert 'conversation' not in user_finding
+
+    channel_finding = next(finding for unit, finding in findings if unit.query == 'C1')
+    assert isinstance(channel_finding['conversation'], conversation.ConversationSuccinct)
+    assert channel_finding['conversation'].name == 'general'
+
+
+def test_profile_scanner_emits_new_only(tmp_path):
+    state_store = StateStore(str(tmp_path / 'state'))
+    signatures = [_make_signature('tokens', r'token is \w+')]
+
+    first, second = [], []
+    _make_scanner(first, signatures, state_store=state_store, emit_mode='new').run(USERS, CHANNELS)
+    _make_scanner(second, signatures, state_store=state_store, emit_mode='new').run(USERS, CHANNELS)
+    state_store.close()
+
+    assert len(first) == 2
+    assert second == []
+
+
+def test_profile_scanner_rejects_new_resolved():
+    with pytest.raises(ValueError):
+        _make_scanner([], [], emit_mode='new-resolved')
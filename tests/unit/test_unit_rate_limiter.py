@@ -0,0 +1,45 @@
+from unittest.mock import patch
+
+from slack_watchman.rate_limiter import RateLimiter
+
+
+@patch('slack_watchman.rate_limiter.time')
+def test_rate_limiter_allows_burst_then_waits(mock_time):
+    mock_time.monotonic.return_value = 100.0
+    limiter = RateLimiter({'search.messages': 2})
+
+    for _ in range(20):
+        limiter.acquire('search.messages')
+    mock_time.sleep.assert_not_called()
+
+    limiter.acquire('search.messages')
+    mock_time.sleep.assert_called_once_with(3.0)
+
+
+@patch('slack_watchman.rate_limiter.time')
+def test_rate_limiter_refills(mock_time):
+    mock_time.monotonic.return_value = 100.0
+    limiter = RateLimiter({'search.messages': 2})
+    for _ in range(20):
+        limiter.acquire('search.messages')
+
+    mock_time.monotonic.return_value = 106.0
+    limiter.acquire('search.messages')
+    limiter.acquire('search.messages')
+
+    mock_time.sleep.assert_not_called()
+
+
+@patch('slack_watchman.rate_limiter.time')
+def test_rate_limiter_separates_methods_and_workspaces(mock_time):
+    mock_time.monotonic.return_value = 100.0
+    limiter = RateLimiter({'search.messages': 1, 'users.info': 1})
+
+    limiter.acquire('search.messages', 'T1')
+    limiter.acquire('search.messages', 'T2')
+    limiter.acquire('users.info', 'T1')
+    limiter.acquire('conversations.history', 'T1')
+    mock_time.sleep.assert_not_called()
+
+    limiter.acquire('search.messages', 'T1')
+    mock_time.sleep.assert_called_once_with(60.0)
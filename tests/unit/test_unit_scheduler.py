@@ -0,0 +1,98 @@
+import datetime
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from slack_watchman.scheduler import (
+    create_schedule,
+    CronSchedule,
+    Daemon,
+    IntervalSchedule
+)
+
+
+def _timestamp(*args):
+    return datetime.datetime(*args).timestamp()
+
+
+def test_interval_schedule():
+    schedule = create_schedule(interval=5)
+
+    assert isinstance(schedule, IntervalSchedule)
+    assert schedule.first_run(100) == 100
+    assert schedule.next_run(100) == 400
+    with pytest.raises(ValueError):
+        IntervalSchedule(0)
+
+
+@pytest.mark.parametrize(
+    "expression, now, expected",
+    [
+        ('* * * * *', (2024, 1, 1, 12, 0, 30), (2024, 1, 1, 12, 1)),
+        ('*/15 * * * *', (2024, 1, 1, 12, 1), (2024, 1, 1, 12, 15)),
+        ('0 */6 * * *', (2024, 1, 1, 12, 0), (2024, 1, 1, 18, 0)),
+        ('30 2 * * *', (2024, 1, 1, 12, 0), (2024, 1, 2, 2, 30)),
+        ('0 9 * * 1-5', (2024, 1, 5, 10, 0), (2024, 1, 8, 9, 0)),
+        ('0 0 1 3 *', (2024, 1, 5, 10, 0), (2024, 3, 1, 0, 0)),
+        ('0 0 29 2 *', (2024, 3, 1, 0, 0), (2028, 2, 29, 0, 0)),
+        # Either day field can match when both are restricted
+        ('0 0 15 * 0', (2024, 1, 1, 0, 0), (2024, 1, 7, 0, 0)),
+    ]
+)
+def test_cron_schedule(expression, now, expected):
+    assert CronSchedule(expression).next_run(_timestamp(*now)) == _timestamp(*expected)
+
+
+@pytest.mark.parametrize("expression", ['* * * *', '60 * * * *', '5-1 * * * *', '*/0 * * * *', 'a * * * *'])
+def test_cron_schedule_invalid(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_cron_schedule_never_matches():
+    with pytest.raises(ValueError):
+        CronSchedule('0 0 30 2 *').next_run(_timestamp(2024, 1, 1))
+
+
+def test_daemon_runs_job_and_reloads():
+    schedule = MagicMock()
+    schedule.first_run.return_value = 0
+    schedule.next_run.return_value = 0
+    reload = MagicMock()
+    daemon = Daemon(MagicMock(), schedule, MagicMock(), reload=reload)
+
+    def job():
+        if daemon.runs == 0:
+            daemon.request_reload()
+
+    daemon.job = job
+    daemon.run(max_runs=2)
+
+    assert daemon.runs == 2
+    reload.assert_called_once()
+
+
+def test_daemon_keeps_running_after_error():
+    schedule = MagicMock()
+    schedule.first_run.return_value = 0
+    schedule.next_run.return_value = 0
+    logger = MagicMock()
+    job = MagicMock(side_effect=[ValueError('failed'), None])
+
+    Daemon(job, schedule, logger).run(max_runs=2)
+
+    assert job.call_count == 2
+    assert any(call.args[0] == 'ERROR' for call in logger.log.call_args_list)
+
+
+def test_daemon_stops_on_request():
+    schedule = MagicMock()
+    schedule.first_run.return_value = 0
+    schedule.next_run.return_value = time.time() + 3600
+    daemon = Daemon(MagicMock(), schedule, MagicMock())
+    daemon.job = daemon.request_stop
+
+    daemon.run()
+
+    assert daemon.runs == 1
@@ -124,3 +124,157 @@ def test_get_auth_test(mock_make_request):
 
     assert auth_test == {'ok': True, 'user_id': 'U123', 'team': 'Test Workspace'}
     mock_make_request.assert_called_once_with('auth.test')
+
+
+@patch('slack_watchman.clients.slack_client.SlackClient._make_request')
+def test_iter_page_api_search(mock_make_request):
+    pages = [
+        {'messages': {'matches': [{'ts': '1'}], 'pagination': {'page_count': 2}}},
+        {'messages': {'matches': [{'ts': '2'}], 'pagination': {'page_count': 2}}},
+    ]
+    mock_make_request.side_effect = [MagicMock(json=MagicMock(return_value=page)) for page in pages]
+
+    client = SlackClient(token='mock_token')
+    results = list(client.iter_page_api_search('test', 'search.messages', 'messages', '2024-01-01'))
+
+    assert results == [[{'ts': '1'}], [{'ts': '2'}]]
+    assert mock_make_request.call_args_list[0][0][1]['query'] == 'after:2024-01-01 test'
+
+
+@patch('slack_watchman.clients.slack_client.SlackClient._make_request')
+def test_iter_page_api_search_stops_at_oldest(mock_make_request):
+    pages = [
+        {'messages': {'matches': [{'ts': '300.1'}, {'ts': '200.1'}], 'pagination': {'page_count': 3}}},
+        {'messages': {'matches': [{'ts': '150.1'}, {'ts': '100.0'}], 'pagination': {'page_count': 3}}},
+        {'messages': {'matches': [{'ts': '50.1'}], 'pagination': {'page_count': 3}}},
+    ]
+    mock_make_request.side_effect = [MagicMock(json=MagicMock(return_value=page)) for page in pages]
+
+    client = SlackClient(token='mock_token')
+    results = list(client.iter_page_api_search(
+        'test', 'search.messages', 'messages', '2024-01-01', sort='timestamp', oldest=100.0))
+
+    assert results == [[{'ts': '300.1'}, {'ts': '200.1'}], [{'ts': '150.1'}]]
+    assert mock_make_request.call_count == 2
+    params = mock_make_request.call_args_list[0][1]['params'] if mock_make_request.call_args_list[0][1] \
+        else mock_make_request.call_args_list[0][0][1]
+    assert params['sort'] == 'timestamp'
+    assert params['sort_dir'] == 'desc'
+
+
+@patch('slack_watchman.clients.slack_client.SlackClient._make_request')
+def test_iter_page_api_search_start_page(mock_make_request):
+    pages = [
+        {'messages': {'matches': [{'ts': '2'}], 'pagination': {'page_count': 3}}},
+        {'messages': {'matches': [{'ts': '3'}], 'pagination': {'page_count': 3}}},
+    ]
+    mock_make_request.side_effect = [MagicMock(json=MagicMock(return_value=page)) for page in pages]
+
+    client = SlackClient(token='mock_token')
+    results = list(client.iter_page_api_search('test', 'search.messages', 'messages', '2024-01-01', start_page=2))
+
+    assert results == [[{'ts': '2'}], [{'ts': '3'}]]
+    assert mock_make_request.call_count == 2
+
+
+@patch('slack_watchman.clients.slack_client.SlackClient._make_request')
+def test_get_search_total(mock_make_request):
+    mock_make_request.return_value.json.return_value = {
+        'ok': True,
+        'messages': {'total': 1234, 'pagination': {'total_count': 1234, 'page_count': 1234}, 'matches': [{}]}
+    }
+
+    client = SlackClient(token='mock_token')
+
+    assert client.get_search_total('password', 'search.messages', 'messages', '2024-01-01') == 1234
+    mock_make_request.assert_called_once_with(
+        'search.messages', params={'query': 'after:2024-01-01 password', 'pretty': 1, 'count': 1})
+
+
+@patch('slack_watchman.clients.slack_client.SlackClient._make_request')
+def test_iter_page_api_search_team_id(mock_make_request):
+    mock_make_request.return_value.json.return_value = {
+        'messages': {'matches': [], 'pagination': {'page_count': 1}}}
+
+    client = SlackClient(token='mock_token')
+    list(client.iter_page_api_search('test', 'search.messages', 'messages', '2024-01-01', team_id='T123'))
+
+    assert mock_make_request.call_args[0][1]['team_id'] == 'T123'
+
+
+@patch('slack_watchman.clients.slack_client.requests.Session.request')
+def test_make_request_uses_rate_limiter(mock_request):
+    mock_request.return_value.json.return_value = {'ok': True}
+    rate_limiter = MagicMock()
+
+    client = SlackClient(token='mock_token', rate_limiter=rate_limiter)
+    client._make_request('search.messages', params={'query': 'test', 'team_id': 'T123'})
+
+    rate_limiter.acquire.assert_called_once_with('search.messages', 'T123')
+
+
+@patch('slack_watchman.clients.slack_client.SlackClient._make_request')
+def test_iter_conversation_history(mock_make_request):
+    pages = [
+        {'ok': True, 'messages': [{'ts': '3'}, {'ts': '2'}], 'has_more': True,
+         'response_metadata': {'next_cursor': 'abc'}},
+        {'ok': True, 'messages': [{'ts': '1'}], 'has_more': False},
+    ]
+    mock_make_request.side_effect = [MagicMock(json=MagicMock(return_value=page)) for page in pages]
+
+    client = SlackClient(token='mock_token')
+    results = list(client.iter_conversation_history('C123', oldest=100.0, latest=200.0))
+
+    assert results == [[{'ts': '3'}, {'ts': '2'}], [{'ts': '1'}]]
+    first_params = mock_make_request.call_args_list[0].kwargs['params']
+    assert first_params['oldest'] == '100.0'
+    assert first_params['latest'] == '200.0'
+    assert mock_make_request.call_args_list[1].kwargs['params']['cursor'] == 'abc'
+
+
+@patch('slack_watchman.clients.slack_client.SlackClient._make_request')
+def test_iter_conversation_replies(mock_make_request):
+    mock_make_request.return_value.json.return_value = {'ok': True, 'messages': [{'ts': '1'}, {'ts': '2'}]}
+
+    client = SlackClient(token='mock_token')
+    results = list(client.iter_conversation_replies('C123', '1', oldest=100.0))
+
+    assert results == [[{'ts': '1'}, {'ts': '2'}]]
+    mock_make_request.assert_called_once_with(
+        'conversations.replies', params={'channel': 'C123', 'ts': '1', 'limit': 200, 'oldest': '100.0'})
+
+
+@patch('requests.Session.get')
+def test_iter_file_content(mock_get):
+    response = mock_get.return_value.__enter__.return_value
+    response.iter_content.return_value = iter([b'abc', b'def'])
+
+    client = SlackClient(token='mock_token')
+    chunks = list(client.iter_file_content('https://files.slack.com/files-pri/T1-F1/download/a.txt', 3))
+
+    assert chunks == [b'abc', b'def']
+    mock_get.assert_called_once_with('https://files.slack.com/files-pri/T1-F1/download/a.txt',
+                                     cookies={}, stream=True, timeout=30)
+    response.iter_content.assert_called_once_with(chunk_size=3)
+    assert client.request_count == 1
+
+
+@patch('slack_watchman.clients.slack_client.SlackClient._make_request')
+def test_get_file_info(mock_make_request):
+    mock_make_request.return_value.json.return_value = {'ok': True, 'file': {'id': 'F123', 'updated': 1700000000}}
+
+    client = SlackClient(token='mock_token')
+    file_info = client.get_file_info('F123')
+
+    assert file_info == {'ok': True, 'file': {'id': 'F123', 'updated': 1700000000}}
+    mock_make_request.assert_called_once_with('files.info', params={'file': 'F123'})
+
+
+@patch('slack_watchman.clients.slack_client.SlackClient._make_request')
+def test_open_socket_connection(mock_make_request):
+    mock_make_request.return_value.json.return_value = {'ok': True, 'url': 'wss://wss-primary.slack.com/link'}
+
+    client = SlackClient(token='xapp-mock_token')
+
+    assert client.open_socket_connection() == 'wss://wss-primary.slack.com/link'
+    mock_make_request.assert_called_once_with('apps.connections.open', method='POST')
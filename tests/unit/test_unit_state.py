@@ -0,0 +1,121 @@
+import os
+
+from slack_watchman.state import StateStore, STATE_DB_NAME
+
+
+def test_state_store_creates_database(tmp_path):
+    state_dir = tmp_path / 'state'
+    store = StateStore(str(state_dir))
+
+    assert os.path.exists(os.path.join(state_dir, STATE_DB_NAME))
+    store.close()
+
+
+def test_watermarks(tmp_path):
+    store = StateStore(str(tmp_path))
+
+    assert store.get_watermark('sig', 'query', 'messages') is None
+
+    store.set_watermark('sig', 'query', 'messages', 100.5)
+    assert store.get_watermark('sig', 'query', 'messages') == 100.5
+    assert store.get_watermark('sig', 'query', 'files') is None
+
+    # Watermarks are never moved backwards
+    store.set_watermark('sig', 'query', 'messages', 50)
+    assert store.get_watermark('sig', 'query', 'messages') == 100.5
+    store.set_watermark('sig', 'query', 'messages', 200)
+    assert store.get_watermark('sig', 'query', 'messages') == 200
+
+
+def test_watermarks_persist(tmp_path):
+    store = StateStore(str(tmp_path))
+    store.set_watermark('sig', 'query', 'messages', 100)
+    store.close()
+
+    assert StateStore(str(tmp_path)).get_watermark('sig', 'query', 'messages') == 100
+
+
+def _record(store, watchman_id, seen_at, posted_at=100):
+    return store.record_finding(
+        watchman_id=watchman_id,
+        signature_id='sig',
+        signature_name='Signature',
+        severity='70',
+        scope='messages',
+        posted_at=posted_at,
+        seen_at=seen_at)
+
+
+def test_record_finding(tmp_path):
+    store = StateStore(str(tmp_path))
+
+    assert _record(store, 'abc', seen_at=10)
+    assert not _record(store, 'abc', seen_at=20)
+    assert _record(store, 'def', seen_at=20)
+
+
+def test_record_finding_emitted(tmp_path):
+    store = StateStore(str(tmp_path))
+    assert store.is_new_finding('abc')
+
+    assert store.record_finding(watchman_id='abc', signature_id='sig', signature_name='Signature',
+                                severity='70', scope='messages', emitted=True)
+
+    assert store.was_emitted('abc')
+    assert not store.is_new_finding('abc')
+    _record(store, 'def', seen_at=10)
+    assert not store.was_emitted('def')
+
+
+def test_resolve_findings(tmp_path):
+    store = StateStore(str(tmp_path))
+    _record(store, 'seen_again', seen_at=10)
+    _record(store, 'gone', seen_at=10)
+    _record(store, 'outside_window', seen_at=10, posted_at=10)
+    _record(store, 'seen_again', seen_at=30)
+
+    resolved = store.resolve_findings('sig', 'messages', posted_after=50, seen_before=25)
+
+    assert [finding['watchman_id'] for finding in resolved] == ['gone']
+    assert resolved[0]['first_seen'] == 10
+    assert resolved[0]['signature_name'] == 'Signature'
+    # Each finding is only resolved once
+    assert store.resolve_findings('sig', 'messages', posted_after=50, seen_before=25) == []
+    # A resolved finding that is found again is new
+    assert _record(store, 'gone', seen_at=40)
+
+
+def test_checkpoint(tmp_path):
+    store = StateStore(str(tmp_path))
+    assert store.get_checkpoint() is None
+
+    store.start_checkpoint({'timeframe': '2024-01-01'})
+    store.save_unit_progress('unit', 3, False, 100.5)
+    store.record_emitted('abc')
+
+    assert store.get_checkpoint() == {'timeframe': '2024-01-01'}
+    assert store.get_unit_progress('unit') == (3, False, 100.5, None)
+    store.save_unit_progress('unit', 4, False, 100.5, resume_before=90.25)
+    assert store.get_unit_progress('unit') == (4, False, 100.5, 90.25)
+    assert store.get_unit_progress('other') is None
+    assert store.was_emitted('abc')
+    assert not store.was_emitted('def')
+
+    # Starting a new checkpoint replaces the old one
+    store.start_checkpoint({'timeframe': '2024-02-01'})
+    assert store.get_unit_progress('unit') is None
+    assert not store.was_emitted('abc')
+
+    store.clear_checkpoint()
+    assert store.get_checkpoint() is None
+
+
+def test_query_yields(tmp_path):
+    store = StateStore(str(tmp_path))
+    assert store.get_query_yields() == {}
+
+    store.record_query_yield('sig.messages.query', 2, 1)
+    store.record_query_yield('sig.messages.query', 2, 3)
+    store.record_query_yield('sig.files.query', 0, 0)
+
+    assert store.get_query_yields() == {'sig.messages.query': 1.0}
@@ -0,0 +1,192 @@
+import io
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from slack_watchman.clients.slack_client import SlackClient
+from slack_watchman.models import post, signature
+from slack_watchman.state import StateStore
+from slack_watchman.stream_scanner import SocketModeClient, StreamScanner, iter_event_feed, unwrap_event
+from slack_watchman.watchman_id import message_watchman_id
+from slack_watchman.watchman_processor import DirectoryCache
+
+
+def _make_signature(signature_id, pattern, scope=None, search_strings=None, file_types=None):
+    mock_sig = MagicMock(spec=signature.Signature)
+    mock_sig.id = signature_id
+    mock_sig.name = signature_id
+    mock_sig.severity = '70'
+    mock_sig.scope = scope or ['messages']
+    mock_sig.patterns = [pattern]
+    mock_sig.search_strings = search_strings or []
+    mock_sig.file_types = file_types or []
+    return mock_sig
+
+
+MESSAGE_EVENT = {'type': 'message', 'channel': 'C1', 'user': 'U1', 'text': 'the token is abc123',
+                 'ts': '1700000000.000100'}
+
+
+@pytest.fixture
+def directory():
+    mock_slack = MagicMock(spec=SlackClient)
+    directory = DirectoryCache(mock_slack, verbose=False)
+    directory.prime([{'id': 'U1', 'name': 'alice'}], [{'id': 'C1', 'name': 'general'}])
+    return directory
+
+
+def _make_scanner(directory, findings, signatures, **kwargs):
+    return StreamScanner(
+        MagicMock(),
+        verbose=False,
+        signatures=signatures,
+        on_finding=lambda unit, finding: findings.append((unit, finding)),
+        directory=directory,
+        workspace_url='https://example.slack.com/',
+        **kwargs)
+
+
+def test_unwrap_event():
+    assert unwrap_event(MESSAGE_EVENT) == MESSAGE_EVENT
+    assert unwrap_event({'type': 'event_callback', 'event': MESSAGE_EVENT}) == MESSAGE_EVENT
+    assert unwrap_event({'type': 'events_api', 'envelope_id': 'E1', 'payload': {'event': MESSAGE_EVENT}}) \
+        == MESSAGE_EVENT
+    assert unwrap_event({'envelope_id': 'E1'}) is None
+
+
+def test_iter_event_feed():
+    feed = io.StringIO(f'{json.dumps(MESSAGE_EVENT)}\n\n{json.dumps({"event": MESSAGE_EVENT})}\n')
+
+    assert list(iter_event_feed(feed)) == [MESSAGE_EVENT, MESSAGE_EVENT]
+
+
+def test_stream_scanner_matches_messages(directory):
+    """Messages are matched and enriched from the primed directory without any API requests."""
+
+    findings = []
+    scanner = _make_scanner(directory, findings, [
+        _make_signature('tokens', r'token is \w+'),
+        _make_signature('passwords', r'password is \w+')])
+    scanner.run([MESSAGE_EVENT, {'type': 'reaction_added'}, {**MESSAGE_EVENT, 'subtype': 'message_deleted'}])
+
+    assert len(findings) == 1
+    unit, finding = findings[0]
+    assert (unit.signature.id, unit.scope, unit.query) == ('tokens', 'messages', 'C1')
+    assert finding['match_string'] == 'token is abc123'
+    assert finding['match_location'] == 'text'
+    assert finding['watchman_id'] == message_watchman_id('token is abc123', '1700000000.000100')
+    assert finding['message'].user.name == 'alice'
+    assert finding['message'].conversation.name == 'general'
+    assert finding['message'].permalink == 'https://example.slack.com/archives/C1/p1700000000000100'
+    assert scanner.stats == {'events': 3, 'messages': 1, 'files': 0, 'matches': 1}
+    directory.slack.get_user_info.assert_not_called()
+    directory.slack.get_conversation_info.assert_not_called()
+
+
+def test_stream_scanner_matches_bot_attachments(directory):
+    findings = []
+    scanner = _make_scanner(directory, findings, [_make_signature('tokens', r'token is \w+')])
+    scanner.handle_event({'type': 'message', 'subtype': 'bot_message', 'channel': 'C1', 'ts': '1700000000.000200',
+                          'attachments': [{'text': 'the token is def456'}]})
+
+    assert [finding['match_location'] for _, finding in findings] == ['attachments[0].text']
+
+
+def test_stream_scanner_matches_edited_messages_once(directory):
+    findings = []
+    scanner = _make_scanner(directory, findings, [_make_signature('tokens', r'token is \w+')])
+    edited = {'type': 'message', 'subtype': 'message_changed', 'channel': 'C1',
+              'message': {'user': 'U1', 'text': 'the token is abc123 (edited)', 'ts': '1700000000.000100'}}
+    scanner.run([MESSAGE_EVENT, edited])
+
+    assert len(findings) == 1
+
+
+def test_stream_scanner_bounds_seen_ids(directory):
+    """Only the most recently seen watchman_ids are remembered, so a long stream doesn't keep growing."""
+
+    findings = []
+    scanner = _make_scanner(directory, findings, [_make_signature('tokens', r'token is \w+')])
+    scanner.max_seen_ids = 2
+    events = [{**MESSAGE_EVENT, 'ts': f'1700000000.00010{i}'} for i in range(3)]
+    # The repeat of the second event refreshes it, so the first is the one forgotten
+    scanner.run([events[0], events[1], events[1], events[2], events[1], events[0]])
+
+    assert [finding['watchman_id'] for _, finding in findings] == [
+        message_watchman_id('token is abc123', event['ts']) for event in [events[0], events[1], events[2], events[0]]]
+    assert len(scanner.seen_ids) == 2
+
+
+def test_stream_scanner_all_matches(directory):
+    findings = []
+    scanner = _make_scanner(directory, findings, [_make_signature('tokens', r'token is \w+')], all_matches=True)
+    scanner.handle_event({**MESSAGE_EVENT, 'text': 'the token is abc123, the token is def456'})
+
+    assert [finding['match_string'] for _, finding in findings] == ['token is abc123', 'token is def456']
+    assert findings[0][1]['watchman_id'] != findings[1][1]['watchman_id']
+    assert findings[0][1]['message'] is findings[1][1]['message']
+
+
+def test_stream_scanner_matches_files(directory):
+    findings = []
+    scanner = _make_scanner(directory, findings, [
+        _make_signature('env_files', r'', scope=['files'], search_strings=['.env'], file_types=['text']),
+        _make_signature('keys', r'', scope=['files'], search_strings=['.pem'])])
+    scanner.handle_event({**MESSAGE_EVENT, 'text': 'here you go', 'subtype': 'file_share', 'files': [
+        {'id': 'F1', 'name': 'prod.env', 'filetype': 'text', 'user': 'U1', 'created': 1700000000,
+         'permalink_public': 'https://slack-files.com/F1'}]})
+
+    assert len(findings) == 1
+    unit, finding = findings[0]
+    assert (unit.signature.id, unit.scope) == ('env_files', 'files')
+    assert isinstance(finding['file'], post.File)
+    assert finding['user'].name == 'alice'
+
+
+def test_stream_scanner_emits_new_only(directory, tmp_path):
+    state_store = StateStore(str(tmp_path / 'state'))
+    signatures = [_make_signature('tokens', r'token is \w+')]
+
+    first, second = [], []
+    _make_scanner(directory, first, signatures, state_store=state_store, emit_mode='new').run([MESSAGE_EVENT])
+    _make_scanner(directory, second, signatures, state_store=state_store, emit_mode='new').run([MESSAGE_EVENT])
+    state_store.close()
+
+    assert len(first) == 1
+    assert second == []
+
+
+def test_stream_scanner_rejects_new_resolved(directory):
+    with pytest.raises(ValueError):
+        _make_scanner(directory, [], [], emit_mode='new-resolved')
+
+
+def test_socket_mode_client_acknowledges_and_reconnects():
+    """Each envelope is acknowledged, and the client reconnects when Slack asks it to."""
+
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_slack.open_socket_connection.side_effect = ['wss://one', 'wss://two']
+    connections = {
+        'wss://one': [{'type': 'hello'},
+                      {'type': 'events_api', 'envelope_id': 'E1', 'payload': {'event': MESSAGE_EVENT}},
+                      {'type': 'disconnect', 'reason': 'refresh_requested'}],
+        'wss://two': [{'type': 'events_api', 'envelope_id': 'E2', 'payload': {'event': MESSAGE_EVENT}}]
+    }
+    opened = {}
+
+    def connect(url):
+        connection = MagicMock()
+        connection.recv.side_effect = [json.dumps(envelope) for envelope in connections[url]] + ['']
+        opened[url] = connection
+        return connection
+
+    client = SocketModeClient(mock_slack, MagicMock(), connect=connect, reconnect_seconds=0)
+    events = client.iter_events()
+    assert next(events) == MESSAGE_EVENT
+    assert next(events) == MESSAGE_EVENT
+    client.stop()
+
+    opened['wss://one'].send.assert_called_once_with(json.dumps({'envelope_id': 'E1'}))
+    opened['wss://one'].close.assert_called_once()
+    opened['wss://two'].send.assert_called_once_with(json.dumps({'envelope_id': 'E2'}))
@@ -6,7 +6,8 @@ import pytest
 from slack_watchman.utils import (
     convert_timestamp,
     convert_to_dict,
-    deduplicate_results
+    deduplicate_results,
+    is_date
 )
 
 
@@ -92,6 +93,13 @@ def dataclass_example_result_two() -> Dict[Any, Any]:
     }
 
 
+def test_is_date():
+    assert is_date('2024-01-01')
+    assert not is_date('7d')
+    assert not is_date('2024-13-01')
+    assert not is_date(None)
+
+
 def test_convert_to_dict(simple_example_result: Dict[Any, Any],
                          dataclass_example_result_one: Dict[Any, Any]) -> None:
     # Test with simple example
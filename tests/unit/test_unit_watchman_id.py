@@ -0,0 +1,23 @@
+import hashlib
+
+from slack_watchman.watchman_id import file_content_watchman_id, file_watchman_id, message_watchman_id, \
+    profile_watchman_id
+
+
+def test_message_watchman_id():
+    assert message_watchman_id('token', '1700000000.000100') == hashlib.md5(b'token.1700000000.000100').hexdigest()
+
+
+def test_file_watchman_id():
+    assert file_watchman_id('2024-01-01 00:00:00 UTC', 'https://example.com/file') == hashlib.md5(
+        b'2024-01-01 00:00:00 UTC.https://example.com/file').hexdigest()
+
+
+def test_file_content_watchman_id():
+    assert file_content_watchman_id('token', 'F1') == hashlib.md5(b'token.F1').hexdigest()
+    assert file_content_watchman_id('token', 'F1') != file_content_watchman_id('token', 'F2')
+
+
+def test_profile_watchman_id():
+    assert profile_watchman_id('token', 'U1', 'title') == hashlib.md5(b'token.U1.title').hexdigest()
+    assert profile_watchman_id('token', 'U1', 'title') != profile_watchman_id('token', 'U1', 'status_text')
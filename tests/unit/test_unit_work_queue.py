@@ -0,0 +1,132 @@
+import time
+from unittest.mock import MagicMock
+
+from slack_watchman.models import signature
+from slack_watchman.models.work_unit import WorkUnit
+from slack_watchman.work_queue import LeaseKeeper, WorkQueue
+
+
+def _make_units(count):
+    mock_sig = MagicMock(spec=signature.Signature)
+    mock_sig.id = 'sig'
+    return [WorkUnit(signature=mock_sig, scope='messages', query=f'query_{i}') for i in range(count)]
+
+
+def _finding(watchman_id):
+    return {
+        'watchman_id': watchman_id,
+        'signature_name': 'Signature',
+        'severity': '70',
+        'scope': 'messages',
+        'finding': {'match_string': 'secret', 'watchman_id': watchman_id}
+    }
+
+
+def test_work_queue_lease_and_complete(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    assert queue.get_info() is None
+    assert not queue.is_finished()
+
+    queue.start(_make_units(3), {'timeframe': '2024-01-01'})
+    assert queue.get_info() == {'timeframe': '2024-01-01'}
+
+    first = queue.lease('worker_1', 2)
+    second = queue.lease('worker_2', 2)
+    assert [row[0] for row in first] == ['sig.messages.query_0', 'sig.messages.query_1']
+    assert [row[0] for row in second] == ['sig.messages.query_2']
+    assert first[0][1:] == ('sig', 'messages', 'query_0')
+    assert queue.lease('worker_3', 2) == []
+
+    queue.complete('worker_1', 'sig.messages.query_0', [_finding('abc')])
+    queue.complete('worker_1', 'sig.messages.query_1', [_finding('abc'), _finding('def')])
+    queue.complete('worker_2', 'sig.messages.query_2', [])
+
+    assert queue.is_finished()
+    assert queue.counts() == {'pending': 0, 'leased': 0, 'done': 3, 'failed': 0}
+    findings = queue.findings_after(0)
+    assert [finding['watchman_id'] for _, finding in findings] == ['abc', 'def']
+    assert findings[0][1]['finding'] == {'match_string': 'secret', 'watchman_id': 'abc'}
+    assert queue.findings_after(findings[0][0]) == [findings[1]]
+
+
+def test_work_queue_reassigns_expired_lease(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=0.01)
+    queue.start(_make_units(1), {'timeframe': '2024-01-01'})
+
+    assert len(queue.lease('worker_1')) == 1
+    time.sleep(0.05)
+
+    assert len(queue.lease('worker_2')) == 1
+    # The first worker's lease has been taken over
+    assert queue.renew('worker_1', ['sig.messages.query_0']) == []
+    assert queue.renew('worker_2', ['sig.messages.query_0']) == ['sig.messages.query_0']
+
+
+def test_work_queue_complete_needs_current_lease(tmp_path):
+    """A worker whose lease was taken over can't complete the unit over the new owner."""
+
+    queue = WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=0.01)
+    queue.start(_make_units(1), {'timeframe': '2024-01-01'})
+    queue.lease('worker_1')
+    time.sleep(0.05)
+    queue.lease('worker_2')
+
+    assert not queue.complete('worker_1', 'sig.messages.query_0', [_finding('abc')])
+    assert queue.counts()['leased'] == 1
+    assert queue.findings_after(0) == []
+    assert queue.complete('worker_2', 'sig.messages.query_0', [_finding('def')])
+    assert not queue.complete('worker_2', 'sig.messages.query_0', [])
+    assert [finding['watchman_id'] for _, finding in queue.findings_after(0)] == ['def']
+
+
+def test_work_queue_fails_unit_whose_lease_always_expires(tmp_path):
+    """A unit that kills every worker that leases it is failed rather than leased forever."""
+
+    queue = WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=0.01)
+    queue.start(_make_units(1), {'timeframe': '2024-01-01'})
+
+    for attempt in range(2):
+        assert len(queue.lease(f'worker_{attempt}', max_attempts=2)) == 1
+        time.sleep(0.05)
+
+    assert queue.lease('worker_2', max_attempts=2) == []
+    assert queue.is_finished()
+    assert queue.failed_units() == [('sig.messages.query_0', 'Lease expired on every attempt')]
+
+
+def test_work_queue_release_retries_then_fails(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    queue.start(_make_units(1), {'timeframe': '2024-01-01'})
+
+    for attempt in range(2):
+        queue.lease('worker', 1)
+        queue.release('worker', 'sig.messages.query_0', 'rate limited', max_attempts=2)
+        assert queue.is_finished() == (attempt == 1)
+
+    assert queue.failed_units() == [('sig.messages.query_0', 'rate limited')]
+
+
+def test_work_queue_start_replaces_scan(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    queue.start(_make_units(2), {'timeframe': '2024-01-01'})
+    queue.lease('worker', 1)
+    queue.complete('worker', 'sig.messages.query_0', [_finding('abc')])
+    queue.set_info('last_output', 1)
+
+    queue.start(_make_units(1), {'timeframe': '2024-02-01'})
+
+    assert queue.get_info() == {'timeframe': '2024-02-01'}
+    assert queue.counts()['pending'] == 1
+    assert queue.findings_after(0) == []
+
+
+def test_lease_keeper_renews_leases(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=0.06)
+    queue.start(_make_units(1), {'timeframe': '2024-01-01'})
+    queue.lease('worker', 1)
+
+    with LeaseKeeper(queue, 'worker', ['sig.messages.query_0']) as keeper:
+        time.sleep(0.2)
+        assert queue.lease('other_worker', 1) == []
+
+    assert keeper.lost == []
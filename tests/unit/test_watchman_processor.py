@@ -2,9 +2,13 @@ import hashlib
 from unittest.mock import MagicMock, patch
 
 import pytest
+import requests
 
+from slack_watchman.budget import RunBudget
 from slack_watchman.clients.slack_client import SlackClient
+from slack_watchman.file_content import FileContentReader
 from slack_watchman.models import user, auth_vars, signature
+from slack_watchman.state import StateStore
 from slack_watchman.watchman_processor import (
     initiate_slack_connection,
     get_users,
@@ -12,8 +16,12 @@ from slack_watchman.watchman_processor import (
     find_messages,
     find_files,
     find_auth_information,
-    _multipro_message_worker,
-    _multipro_file_worker
+    plan_work_units,
+    prioritise_work_units,
+    severity_score,
+    shard_work_units,
+    DirectoryCache,
+    SignatureScanner
 )
 
 
@@ -74,37 +82,37 @@ def test_get_channels(mock_slack_client):
     mock_slack.cursor_api_search.assert_called_once_with('conversations.list', 'channels')
 
 
-@patch('slack_watchman.watchman_processor.multiprocessing.Process')
-@patch('slack_watchman.watchman_processor.multiprocessing.Manager')
-def test_find_messages(mock_manager, mock_process):
+def test_find_messages():
     """Test find_messages function."""
     mock_logger = MagicMock()
     mock_slack = MagicMock()
-    mock_sig = MagicMock()
+    mock_slack.iter_page_api_search.return_value = iter([])
+    mock_sig = MagicMock(spec=signature.Signature)
+    mock_sig.id = 'test_signature'
+    mock_sig.scope = ['messages']
     mock_sig.search_strings = ['test_query']
 
-    mock_manager.return_value.list.return_value = []
-
     find_messages(mock_slack, mock_logger, mock_sig, verbose=False, timeframe='7d')
 
-    mock_process.assert_called_once()
+    mock_slack.iter_page_api_search.assert_called_once_with(
+        'test_query', 'search.messages', 'messages', '7d', sort=None, oldest=None, start_page=1, team_id=None)
     mock_logger.log.assert_any_call('INFO', 'No matches found after filtering')
 
 
-@patch('slack_watchman.watchman_processor.multiprocessing.Process')
-@patch('slack_watchman.watchman_processor.multiprocessing.Manager')
-def test_find_files(mock_manager, mock_process):
+def test_find_files():
     """Test find_files function."""
     mock_logger = MagicMock()
     mock_slack = MagicMock()
-    mock_sig = MagicMock()
+    mock_slack.iter_page_api_search.return_value = iter([])
+    mock_sig = MagicMock(spec=signature.Signature)
+    mock_sig.id = 'test_signature'
+    mock_sig.scope = ['files']
     mock_sig.search_strings = ['test_query']
 
-    mock_manager.return_value.list.return_value = []
-
     find_files(mock_slack, mock_logger, mock_sig, verbose=False, timeframe='7d')
 
-    mock_process.assert_called_once()
+    mock_slack.iter_page_api_search.assert_called_once_with(
+        'test_query', 'search.files', 'files', '7d', sort=None, oldest=None, start_page=1, team_id=None)
     mock_logger.log.assert_any_call('INFO', 'No files found after filtering')
 
 
@@ -141,132 +149,748 @@ def test_find_auth_information_no_props_node():
         assert result is None
 
 
+def _make_scanner(mock_slack, findings, **kwargs):
+    return SignatureScanner(
+        mock_slack,
+        MagicMock(),
+        verbose=False,
+        timeframe='7d',
+        on_finding=lambda unit, finding: findings.append(finding),
+        **kwargs)
+
+
+def _make_signature(scope, patterns=None, file_types=None, search_strings=None):
+    mock_sig = MagicMock(spec=signature.Signature)
+    mock_sig.id = 'test_signature'
+    mock_sig.name = 'Test Signature'
+    mock_sig.scope = [scope]
+    mock_sig.patterns = patterns or []
+    mock_sig.file_types = file_types
+    mock_sig.search_strings = search_strings or ['test_query']
+    return mock_sig
+
+
+def test_plan_work_units():
+    """Test plan_work_units creates one unit per query and scope."""
+    mock_sig = _make_signature('messages', search_strings=['one', 'two'])
+    mock_sig.scope = ['messages', 'files', 'unknown']
+
+    work_units = plan_work_units([mock_sig])
+
+    assert [(u.scope, u.query) for u in work_units] == [
+        ('messages', 'one'), ('messages', 'two'), ('files', 'one'), ('files', 'two')]
+    assert [u.scope for u in plan_work_units([mock_sig], scopes=['files'])] == ['files', 'files']
+
+
+def test_plan_work_units_for_workspaces():
+    """Each search is planned for every workspace, taking turns between workspaces."""
+    mock_sig = _make_signature('messages', search_strings=['one', 'two'])
+
+    work_units = plan_work_units([mock_sig], team_ids=['T1', 'T2'])
+
+    assert [(u.team_id, u.query) for u in work_units] == [('T1', 'one'), ('T2', 'one'), ('T1', 'two'), ('T2', 'two')]
+    assert work_units[0].key == 'T1.test_signature.messages.one'
+    assert work_units[0].state_scope == 'T1/messages'
+    assert plan_work_units([mock_sig])[0].state_scope == 'messages'
+
+
+def test_signature_scanner_searches_workspaces(tmp_path):
+    """Each workspace is searched with its own team_id and keeps its own watermark."""
+
+    state_store = StateStore(str(tmp_path))
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'secret'])
+    mock_slack.iter_page_api_search.side_effect = lambda *args, team_id=None, **kwargs: iter([[
+        {'text': f'secret in {team_id}', 'user': None, 'channel': {'id': None},
+         'ts': '1704153600.000100' if team_id == 'T1' else '1704240000.000100'}
+    ]])
+
+    findings = []
+    _make_scanner(mock_slack, findings, state_store=state_store).run(
+        plan_work_units([mock_sig], team_ids=['T1', 'T2']))
+
+    assert sorted(call.kwargs['team_id'] for call in mock_slack.iter_page_api_search.call_args_list) == ['T1', 'T2']
+    assert state_store.get_watermark('test_signature', 'test_query', 'T1/messages') == 1704153600.0001
+    assert state_store.get_watermark('test_signature', 'test_query', 'T2/messages') == 1704240000.0001
+    assert state_store.get_watermark('test_signature', 'test_query', 'messages') is None
+
+
 @patch('slack_watchman.watchman_processor.user')
 @patch('slack_watchman.watchman_processor.conversation')
 @patch('slack_watchman.watchman_processor.post')
-def test_multipro_message_worker(mock_post, mock_conversation, mock_user):
-    """Unit test for _multipro_message_worker function."""
+def test_signature_scanner_messages(mock_post, mock_conversation, mock_user):
+    """Test the scanner filters, enriches and emits message findings."""
 
-    # Mock input data
     mock_slack = MagicMock(spec=SlackClient)
-    mock_sig = MagicMock(spec=signature.Signature)
-    mock_sig.patterns = [r'secret']
+    mock_sig = _make_signature('messages', patterns=[r'secret'])
 
-    query = 'test_query'
-    verbose = False
-    timeframe = '7d'
-
-    # Mock Slack API message response
-    mock_slack.page_api_search.return_value = [
-        {'text': 'This contains a secret', 'user': 'U123', 'channel': {'id': 'C123'}},
-        {'text': 'No match here', 'user': 'U456', 'channel': {'id': 'C456'}}
-    ]
-
-    # Mock user and conversation creation
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'text': 'This contains a secret', 'user': 'U123', 'channel': {'id': 'C123'}, 'ts': '1234567890'},
+        {'text': 'No match here', 'user': 'U456', 'channel': {'id': 'C456'}, 'ts': '1234567891'}
+    ]])
     mock_user.create_from_dict.return_value = 'MockUser'
     mock_conversation.create_from_dict.return_value = 'MockConversation'
-    mock_post.create_message_from_dict.return_value = MagicMock(timestamp='1234567890')
-
-    # Mock multiprocessing lists
-    results = []
-    potential_matches = []
-
-    # Run the function
-    _multipro_message_worker(
-        slack=mock_slack,
-        sig=mock_sig,
-        query=query,
-        verbose=verbose,
-        timeframe=timeframe,
-        results=results,
-        potential_matches=potential_matches
-    )
 
-    # Assertions
-    assert len(potential_matches) == 1
-    assert potential_matches[0] == 2  # Two messages were returned by Slack API
+    findings = []
+    scanner = _make_scanner(mock_slack, findings)
+    scanner.run(plan_work_units([mock_sig]))
 
-    assert len(results) == 1
-    result = results[0]
+    assert scanner.stats[('test_signature', 'messages')] == {'potential_matches': 2, 'matches': 1}
+    assert len(findings) == 1
+    result = findings[0]
     assert result['match_string'] == 'secret'
     assert result['message'] == mock_post.create_message_from_dict.return_value
 
-    # Verify that user and conversation were created correctly
     mock_user.create_from_dict.assert_called_once_with(
         mock_slack.get_user_info.return_value.get.return_value,
-        verbose
+        False
     )
     mock_conversation.create_from_dict.assert_called_once_with(
         mock_slack.get_conversation_info.return_value.get.return_value,
-        verbose
+        False
     )
 
-    # Verify that the correct watchman_id was created
     expected_watchman_id = hashlib.md5(f'secret.1234567890'.encode()).hexdigest()
     assert result['watchman_id'] == expected_watchman_id
 
 
+@patch('slack_watchman.watchman_processor.post')
+def test_signature_scanner_matches_attachments_and_blocks(mock_post):
+    """Text in the attachments and blocks of bot posts is matched, with the location of each match."""
+
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'secret \w+'])
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'text': '', 'user': None, 'channel': {'id': None}, 'ts': '1234567890',
+         'attachments': [{'fields': [{'title': 'Key', 'value': 'secret abc'}]}],
+         'blocks': [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': 'the secret xyz'}}]}
+    ]])
+
+    findings = []
+    _make_scanner(mock_slack, findings).run(plan_work_units([mock_sig]))
+
+    assert findings[0]['match_string'] == 'secret xyz'
+    assert findings[0]['match_location'] == 'blocks[0].text.text'
+
+
+@patch('slack_watchman.watchman_processor.post')
+def test_signature_scanner_all_matches(mock_post):
+    """Every distinct match in a message is its own finding, and the message is only enriched once."""
+
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'KEY_\w+=\w+'])
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'text': 'KEY_A=one\nKEY_B=two\nKEY_A=one', 'user': None, 'channel': {'id': None}, 'ts': '1234567890'}
+    ]])
+
+    findings = []
+    _make_scanner(mock_slack, findings, all_matches=True).run(plan_work_units([mock_sig]))
+
+    assert [finding['match_string'] for finding in findings] == ['KEY_A=one', 'KEY_B=two']
+    assert findings[0]['watchman_id'] == hashlib.md5('KEY_A=one.1234567890'.encode()).hexdigest()
+    assert findings[1]['watchman_id'] == hashlib.md5('KEY_B=two.1234567890'.encode()).hexdigest()
+    assert findings[0]['message'] is findings[1]['message']
+    mock_post.create_message_from_dict.assert_called_once()
+
+
+@patch('slack_watchman.watchman_processor.post')
+def test_signature_scanner_first_match_only_by_default(mock_post):
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'KEY_\w+=\w+'])
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'text': 'KEY_A=one\nKEY_B=two', 'user': None, 'channel': {'id': None}, 'ts': '1234567890'}
+    ]])
+
+    findings = []
+    _make_scanner(mock_slack, findings).run(plan_work_units([mock_sig]))
+
+    assert [finding['match_string'] for finding in findings] == ['KEY_A=one']
+
+
+@patch('slack_watchman.watchman_processor.post')
+@pytest.mark.parametrize(
+    "file_types, expected_results_count, expected_potential_matches",
+    [
+        (['zip'], 1, 2),  # File type provided
+        (None, 1, 2)      # File type not provided
+    ]
+)
+def test_signature_scanner_files(mock_post, file_types, expected_results_count, expected_potential_matches):
+    """Parameterized test for scanning files."""
+
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('files', file_types=file_types, search_strings=['.zip'])
+
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'name': 'Test Zip.zip', 'filetype': 'zip', 'user': 'U123', 'created': 1704067200,
+         'permalink_public': 'https://example.com/file'},
+        {'name': 'Other File.doc', 'filetype': 'doc', 'user': 'U456'},  # Does not match file_types if provided
+    ]])
+
+    findings = []
+    directory = MagicMock()
+    directory.get_user.return_value = 'MockUser'
+    scanner = _make_scanner(mock_slack, findings, directory=directory)
+    scanner.run(plan_work_units([mock_sig]))
+
+    assert scanner.stats[('test_signature', 'files')]['potential_matches'] == expected_potential_matches
+    assert len(findings) == expected_results_count
+    result = findings[0]
+    assert result['file'] == mock_post.create_file_from_dict.return_value
+    assert result['user'] == 'MockUser'
+    directory.get_user.assert_called_once_with('U123')
+
+    expected_watchman_id = hashlib.md5(f'2024-01-01 00:00:00 UTC.https://example.com/file'.encode()).hexdigest()
+    assert result['watchman_id'] == expected_watchman_id
+
+
 @patch('slack_watchman.watchman_processor.user')
+@patch('slack_watchman.watchman_processor.conversation')
 @patch('slack_watchman.watchman_processor.post')
+def test_signature_scanner_skips_duplicates_before_enrichment(mock_post, mock_conversation, mock_user):
+    """Findings returned by more than one query are only enriched once."""
+
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'secret'], search_strings=['first_query', 'second_query'])
+    mock_slack.iter_page_api_search.side_effect = lambda *args, **kwargs: iter([[
+        {'text': 'This contains a secret', 'user': 'U123', 'channel': {'id': 'C123'}, 'ts': '1234567890'}
+    ]])
+
+    findings = []
+    _make_scanner(mock_slack, findings).run(plan_work_units([mock_sig]))
+
+    assert len(findings) == 1
+    assert mock_slack.get_user_info.call_count == 1
+    assert mock_slack.get_conversation_info.call_count == 1
+    mock_post.create_message_from_dict.assert_called_once()
+
+
+def test_signature_scanner_skips_seen_messages_before_regex():
+    """Messages already processed for a signature are skipped before any regex runs."""
+
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'secret'])
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'text': 'This contains a secret', 'user': 'U123', 'channel': {'id': 'C123'}, 'ts': '1234567890'}
+    ]])
+
+    findings = []
+    scanner = _make_scanner(
+        mock_slack, findings, seen_messages={'test_signature.C123.1234567890': 'claimed'})
+    with patch.object(scanner, '_patterns') as mock_patterns:
+        scanner.run(plan_work_units([mock_sig]))
+
+    mock_patterns.assert_not_called()
+    assert findings == []
+
+
+def test_directory_cache():
+    """Users and conversations are only looked up once."""
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_slack.get_user_info.return_value = {'user': {'id': 'U123'}}
+    mock_slack.get_conversation_info.return_value = {'channel': {'id': 'C123', 'name': 'general'}}
+
+    directory = DirectoryCache(mock_slack, verbose=False)
+    for _ in range(3):
+        directory.get_user('U123')
+        directory.get_conversation('C123')
+
+    mock_slack.get_user_info.assert_called_once_with('U123')
+    mock_slack.get_conversation_info.assert_called_once_with('C123')
+
+
+def test_directory_cache_prime():
+    """Users and conversations primed from lists aren't looked up."""
+    mock_slack = MagicMock(spec=SlackClient)
+
+    directory = DirectoryCache(mock_slack, verbose=False)
+    directory.prime([{'id': 'U123', 'name': 'alice'}], [{'id': 'C123', 'name': 'general'}])
+
+    assert directory.get_user('U123').name == 'alice'
+    assert directory.get_conversation('C123').name == 'general'
+    mock_slack.get_user_info.assert_not_called()
+    mock_slack.get_conversation_info.assert_not_called()
+
+
+@patch('slack_watchman.watchman_processor.post')
+def test_signature_scanner_uses_matcher_pool(mock_post):
+    """When a matcher pool is given, message texts are matched in the pool."""
+
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'secret'])
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'text': 'first', 'user': None, 'channel': {'id': None}, 'ts': '1'},
+        {'text': 'second', 'user': None, 'channel': {'id': None}, 'ts': '2'}
+    ]])
+    mock_pool = MagicMock()
+    mock_pool.processes = 4
+    mock_pool.match.return_value = [(1, 'pool_match')]
+
+    findings = []
+    scanner = _make_scanner(mock_slack, findings, matcher_pool=mock_pool)
+    scanner.run(plan_work_units([mock_sig]))
+
+    mock_pool.match.assert_called_once_with('test_signature', ['first', 'second'], scanner.pattern_guard, False)
+    assert [finding['match_string'] for finding in findings] == ['pool_match']
+    assert scanner.pipeline.stages[1].workers == 4
+
+
+def test_signature_scanner_uses_watermarks(tmp_path):
+    """Queries only search for results newer than their watermark, and the watermark is updated after the run."""
+
+    state_store = StateStore(str(tmp_path))
+    state_store.set_watermark('test_signature', 'test_query', 'messages', 1704110400.0)
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'secret'])
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'text': 'new', 'user': None, 'channel': {'id': None}, 'ts': '1704153600.000100'}
+    ]])
+
+    scanner = SignatureScanner(
+        mock_slack,
+        MagicMock(),
+        verbose=False,
+        timeframe='2020-01-01',
+        on_finding=MagicMock(),
+        state_store=state_store)
+    scanner.run(plan_work_units([mock_sig]))
+
+    mock_slack.iter_page_api_search.assert_called_once_with(
+        'test_query', 'search.messages', 'messages', '2023-12-31',
+        sort='timestamp', oldest=1704110400.0, start_page=1, team_id=None)
+    assert state_store.get_watermark('test_signature', 'test_query', 'messages') == 1704153600.0001
+
+
+def test_signature_scanner_keeps_watermark_when_fetch_fails(tmp_path):
+    """A query that fails part way through doesn't move its watermark."""
+
+    state_store = StateStore(str(tmp_path))
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'secret'])
+
+    def pages(*args, **kwargs):
+        yield [{'text': 'new', 'user': None, 'channel': {'id': None}, 'ts': '1704153600.000100'}]
+        raise ValueError('rate limited')
+
+    mock_slack.iter_page_api_search.side_effect = pages
+
+    scanner = _make_scanner(mock_slack, [], state_store=state_store)
+    scanner.run(plan_work_units([mock_sig]))
+
+    assert state_store.get_watermark('test_signature', 'test_query', 'messages') is None
+
+
 @pytest.mark.parametrize(
-    "file_types, expected_results_count, expected_potential_matches, expected_filetype",
+    "emit_mode, expected_second_run",
     [
-        (['zip'], 1, 2, 'zip'),  # File type provided
-        (None, 1, 2, None)        # File type not provided
+        ('all', ['secret']),
+        ('new', []),
+        ('new-resolved', [])
     ]
 )
-def test_multipro_file_worker(mock_post, mock_user, file_types, expected_results_count, expected_potential_matches, expected_filetype):
-    """Parameterized unit test for _multipro_file_worker function."""
+def test_signature_scanner_emit_modes(tmp_path, emit_mode, expected_second_run):
+    """Findings seen by a previous run are only emitted again in the `all` emit mode."""
 
-    # Mock input data
+    state_store = StateStore(str(tmp_path))
     mock_slack = MagicMock(spec=SlackClient)
-    mock_sig = MagicMock(spec=signature.Signature)
-    mock_sig.file_types = file_types
+    mock_sig = _make_signature('messages', patterns=[r'secret'])
+    mock_slack.iter_page_api_search.side_effect = lambda *args, **kwargs: iter([[
+        {'text': 'This contains a secret', 'user': None, 'channel': {'id': None}, 'ts': '1704153600.000100'}
+    ]])
 
-    query = '.zip'
-    verbose = False
-    timeframe = '7d'
+    runs = []
+    for _ in range(2):
+        findings = []
+        _make_scanner(mock_slack, findings, state_store=state_store, emit_mode=emit_mode).run(
+            plan_work_units([mock_sig]))
+        runs.append([finding['match_string'] for finding in findings])
 
-    # Mock Slack API file response
-    mock_slack.page_api_search.return_value = [
-        {'name': 'Test Zip.zip', 'filetype': 'zip', 'user': 'U123'},
-        {'name': 'Other File.doc', 'filetype': 'doc', 'user': 'U456'},  # Does not match file_types if provided
+    assert runs == [['secret'], expected_second_run]
+
+
+def test_signature_scanner_emits_resolved_findings(tmp_path):
+    """Findings from a previous run that aren't found again are resolved once every query has been searched."""
+
+    state_store = StateStore(str(tmp_path))
+    state_store.record_finding(
+        watchman_id='old_finding', signature_id='test_signature', signature_name='Test Signature',
+        severity='70', scope='messages', posted_at=1704153600.0, seen_at=1)
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_slack.iter_page_api_search.return_value = iter([[]])
+
+    resolved = []
+    scanner = _make_scanner(
+        mock_slack, [], state_store=state_store, emit_mode='new-resolved',
+        on_resolved=lambda unit, finding: resolved.append(finding))
+    scanner.run(plan_work_units([_make_signature('messages', patterns=[r'secret'])]))
+
+    assert [finding['watchman_id'] for finding in resolved] == ['old_finding']
+
+
+def _search_workspace(messages):
+    # Searches a fixed workspace, keeping only results newer than `oldest` as the Slack client does
+    def search(*args, oldest=None, **kwargs):
+        return iter([[message for message in messages if not oldest or float(message['ts']) > oldest]])
+    return search
+
+
+def test_signature_scanner_new_resolved_unchanged_workspace(tmp_path):
+    """Findings that are still there aren't resolved by a second run over an unchanged workspace."""
+
+    state_store = StateStore(str(tmp_path))
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_slack.iter_page_api_search.side_effect = _search_workspace([
+        {'text': 'secret1', 'user': None, 'channel': {'id': None}, 'ts': '1704153600.000100'},
+        {'text': 'secret2', 'user': None, 'channel': {'id': None}, 'ts': '1704240000.000100'}
+    ])
+    mock_sig = _make_signature('messages', patterns=[r'secret\d'])
+
+    runs, resolved = [], []
+    for _ in range(2):
+        findings = []
+        _make_scanner(mock_slack, findings, state_store=state_store, emit_mode='new-resolved',
+                      on_resolved=lambda unit, finding: resolved.append(finding)).run(plan_work_units([mock_sig]))
+        runs.append([finding['match_string'] for finding in findings])
+
+    assert runs == [['secret1', 'secret2'], []]
+    assert resolved == []
+    assert mock_slack.iter_page_api_search.call_args.kwargs['oldest'] is None
+
+
+def test_signature_scanner_new_resolved_finds_deleted_findings_before_watermark(tmp_path):
+    """A finding older than the watermark that has been deleted is resolved by the next run."""
+
+    state_store = StateStore(str(tmp_path))
+    mock_slack = MagicMock(spec=SlackClient)
+    messages = [
+        {'text': 'secret1', 'user': None, 'channel': {'id': None}, 'ts': '1704153600.000100'},
+        {'text': 'secret2', 'user': None, 'channel': {'id': None}, 'ts': '1704240000.000100'}
     ]
+    mock_slack.iter_page_api_search.side_effect = _search_workspace(messages)
+    mock_sig = _make_signature('messages', patterns=[r'secret\d'])
 
-    # Mock user creation
-    mock_user.create_from_dict.return_value = 'MockUser'
-    mock_post.create_file_from_dict.return_value = MagicMock(created='2024-01-01', permalink_public='https://example.com/file')
-
-    # Mock multiprocessing lists
-    results = []
-    potential_matches = []
-
-    # Run the function
-    _multipro_file_worker(
-        slack=mock_slack,
-        sig=mock_sig,
-        query=query,
-        verbose=verbose,
-        timeframe=timeframe,
-        results=results,
-        potential_matches=potential_matches
-    )
+    resolved = []
+    _make_scanner(mock_slack, [], state_store=state_store, emit_mode='new-resolved').run(plan_work_units([mock_sig]))
+    messages.pop(0)
+    _make_scanner(mock_slack, [], state_store=state_store, emit_mode='new-resolved',
+                  on_resolved=lambda unit, finding: resolved.append(finding)).run(plan_work_units([mock_sig]))
 
-    # Assertions
-    assert len(potential_matches) == 1  # There should be one entry for the files searched
-    assert potential_matches[0] == expected_potential_matches  # Two files were returned by Slack API
+    assert [finding['watchman_id'] for finding in resolved] == [
+        hashlib.md5('secret1.1704153600.000100'.encode()).hexdigest()]
 
-    assert len(results) == expected_results_count  # Only one file matches the type (zip) if file_types is provided
-    result = results[0]
-    assert result['file'] == mock_post.create_file_from_dict.return_value
-    assert result['user'] == 'MockUser'
 
-    # Verify that user was created correctly
-    mock_user.create_from_dict.assert_called_once_with(
-        mock_slack.get_user_info.return_value.get.return_value,
-        verbose
-    )
+def test_signature_scanner_does_not_resolve_after_failed_fetch(tmp_path):
+    """Findings aren't resolved if a query wasn't searched in full."""
 
-    # Verify that the correct watchman_id was created
-    expected_watchman_id = hashlib.md5(f'2024-01-01.https://example.com/file'.encode()).hexdigest()
-    assert result['watchman_id'] == expected_watchman_id
+    state_store = StateStore(str(tmp_path))
+    state_store.record_finding(
+        watchman_id='old_finding', signature_id='test_signature', signature_name='Test Signature',
+        severity='70', scope='messages', posted_at=1704153600.0, seen_at=1)
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_slack.iter_page_api_search.side_effect = ValueError('rate limited')
+
+    on_resolved = MagicMock()
+    scanner = _make_scanner(
+        mock_slack, [], state_store=state_store, emit_mode='new-resolved', on_resolved=on_resolved)
+    scanner.run(plan_work_units([_make_signature('messages', patterns=[r'secret'])]))
+
+    on_resolved.assert_not_called()
+
+
+def test_signature_scanner_emit_mode_needs_state_store():
+    with pytest.raises(ValueError):
+        _make_scanner(MagicMock(spec=SlackClient), [], emit_mode='new')
+
+
+def test_signature_scanner_checkpoints_interrupted_scan(tmp_path):
+    """Pages processed before a failure are checkpointed, and the checkpoint is kept."""
+
+    state_store = StateStore(str(tmp_path))
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'secret'])
+
+    def pages(*args, **kwargs):
+        yield [{'text': 'a secret', 'user': None, 'channel': {'id': None}, 'ts': '1704153600.000100'}]
+        raise ValueError('rate limited')
+
+    mock_slack.iter_page_api_search.side_effect = pages
+
+    scanner = _make_scanner(mock_slack, [], state_store=state_store)
+    scanner.run(plan_work_units([mock_sig]))
+
+    assert not scanner.completed
+    assert state_store.get_checkpoint() == {'timeframe': '7d'}
+    assert state_store.get_unit_progress('test_signature.messages.test_query') == (2, False, 1704153600.0001, None)
+    assert state_store.was_emitted(hashlib.md5('secret.1704153600.000100'.encode()).hexdigest())
+
+
+def test_signature_scanner_records_findings_after_output(tmp_path):
+    """A finding is recorded, and marked as emitted, only once it has been output, so a scan
+    interrupted while outputting it outputs it again when resumed."""
+
+    state_store = StateStore(str(tmp_path))
+    state_store.start_checkpoint({'timeframe': '7d'})
+    watchman_id = hashlib.md5('secret.1704153600.000100'.encode()).hexdigest()
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'text': 'a secret', 'user': None, 'channel': {'id': None}, 'ts': '1704153600.000100'}]])
+    recorded_when_output = []
+
+    scanner = SignatureScanner(
+        mock_slack, MagicMock(), verbose=False, timeframe='7d', state_store=state_store, emit_mode='new',
+        on_finding=lambda unit, finding: recorded_when_output.append(
+            state_store.was_emitted(watchman_id) or not state_store.is_new_finding(watchman_id)))
+    scanner.run(plan_work_units([_make_signature('messages', patterns=[r'secret'])]))
+
+    assert recorded_when_output == [False]
+    assert not state_store.is_new_finding(watchman_id)
+
+
+def test_signature_scanner_resumes_from_checkpoint(tmp_path):
+    """A resumed scan starts from the next page and doesn't emit findings emitted before it was interrupted."""
+
+    state_store = StateStore(str(tmp_path))
+    state_store.start_checkpoint({'timeframe': '7d'})
+    state_store.save_unit_progress('test_signature.messages.test_query', 2, False, 1704153600.0)
+    state_store.save_unit_progress('test_signature.messages.done_query', 5, True, 1704153600.0)
+    state_store.record_emitted(hashlib.md5('secret.1704153600.000100'.encode()).hexdigest())
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'secret'], search_strings=['test_query', 'done_query'])
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'text': 'a secret', 'user': None, 'channel': {'id': None}, 'ts': '1704153600.000100'},
+        {'text': 'another secret', 'user': None, 'channel': {'id': None}, 'ts': '1704153500.000100'}
+    ]])
+
+    findings = []
+    scanner = _make_scanner(mock_slack, findings, state_store=state_store)
+    scanner.run(plan_work_units([mock_sig]), resume=True)
+
+    mock_slack.iter_page_api_search.assert_called_once_with(
+        'test_query', 'search.messages', 'messages', '7d', sort='timestamp', oldest=None, start_page=2, team_id=None)
+    assert [finding['message'].text for finding in findings] == ['another secret']
+    assert scanner.completed
+    assert state_store.get_checkpoint() is None
+
+
+def _make_signatures(count):
+    signatures = []
+    for i in range(count):
+        mock_sig = _make_signature('messages', search_strings=['one', 'two'])
+        mock_sig.id = f'signature_{i}'
+        mock_sig.scope = ['messages', 'files']
+        signatures.append(mock_sig)
+    return signatures
+
+
+def test_shard_work_units():
+    """Every unit is assigned to exactly one shard, independent of the order they were planned in."""
+
+    work_units = plan_work_units(_make_signatures(30))
+
+    shards = [shard_work_units(work_units, index, 3) for index in range(3)]
+
+    assert sorted(unit.key for shard in shards for unit in shard) == sorted(unit.key for unit in work_units)
+    assert all(shard for shard in shards)
+    assert shard_work_units(list(reversed(work_units)), 1, 3) == list(reversed(shards[1]))
+    assert shard_work_units(work_units, 0, 1) == work_units
+    # Every query for a signature and scope is in the same shard
+    for shard in shards:
+        keys = {(unit.signature.id, unit.scope) for unit in shard}
+        assert len(shard) == 2 * len(keys)
+
+
+def test_shard_work_units_moves_few_units():
+    """Adding a shard only moves units to the new shard."""
+
+    work_units = plan_work_units(_make_signatures(30))
+
+    for index in range(3):
+        after = {unit.key for unit in shard_work_units(work_units, index, 4)}
+        before = {unit.key for unit in shard_work_units(work_units, index, 3)}
+        assert after <= before
+
+
+@pytest.mark.parametrize("shard_index, shard_count", [(3, 3), (-1, 2), (0, 0)])
+def test_shard_work_units_invalid(shard_index, shard_count):
+    with pytest.raises(ValueError):
+        shard_work_units([], shard_index, shard_count)
+
+
+def test_signature_scanner_stops_at_request_budget():
+    """Once the request budget is used, pages already fetched are emitted and the rest are skipped."""
+
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_slack.request_count = 0
+    mock_sig = _make_signature('messages', patterns=[r'secret'], search_strings=['first_query', 'second_query'])
+
+    def pages(query, *args, **kwargs):
+        for page in range(3):
+            mock_slack.request_count += 1
+            yield [{'text': f'{query} secret', 'user': None, 'channel': {'id': None}, 'ts': f'{page}'}]
+
+    mock_slack.iter_page_api_search.side_effect = pages
+
+    findings = []
+    scanner = _make_scanner(mock_slack, findings, budget=RunBudget(max_requests=1), fetch_workers=1)
+    scanner.run(plan_work_units([mock_sig]))
+
+    assert [finding['message'].text for finding in findings] == ['first_query secret']
+    assert list(scanner.truncated) == ['test_signature.messages.first_query']
+    assert list(scanner.skipped) == ['test_signature.messages.second_query']
+    assert scanner.skipped['test_signature.messages.second_query'][1] == 'maximum of 1 requests reached'
+    assert not scanner.completed
+
+
+def test_signature_scanner_max_findings_per_signature():
+    """Findings over the signature's budget are dropped and the unit is reported as truncated."""
+
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'secret'])
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'text': 'secret one', 'user': None, 'channel': {'id': None}, 'ts': '1'},
+        {'text': 'secret two', 'user': None, 'channel': {'id': None}, 'ts': '2'},
+        {'text': 'secret three', 'user': None, 'channel': {'id': None}, 'ts': '3'}
+    ]])
+
+    findings = []
+    scanner = _make_scanner(mock_slack, findings, budget=RunBudget(max_findings_per_signature=2))
+    scanner.run(plan_work_units([mock_sig]))
+
+    assert len(findings) == 2
+    assert scanner.stats[('test_signature', 'messages')]['matches'] == 2
+    assert list(scanner.truncated) == ['test_signature.messages.test_query']
+    assert not scanner.unit_completed('test_signature.messages.test_query')
+
+
+@pytest.mark.parametrize("severity, expected", [(90, 90), ('70', 70), ('Critical', 100), ('unknown', 0), (None, 0)])
+def test_severity_score(severity, expected):
+    mock_sig = _make_signature('messages')
+    mock_sig.severity = severity
+    assert severity_score(mock_sig) == expected
+
+
+def test_prioritise_work_units():
+    """Units are ordered by severity, then by historical yield, with unknown yields first."""
+
+    signatures = _make_signatures(3)
+    for mock_sig, severity in zip(signatures, ['30', '90', '30']):
+        mock_sig.severity = severity
+    work_units = plan_work_units(signatures)
+
+    by_severity = prioritise_work_units(work_units)
+    assert [unit.signature.id for unit in by_severity[:4]] == ['signature_1'] * 4
+    # Otherwise the planned order is kept
+    assert by_severity[4:] == [unit for unit in work_units if unit.signature.id != 'signature_1']
+
+    yields = {
+        'signature_0.messages.one': 0.0,
+        'signature_0.messages.two': 0.5,
+        'signature_2.messages.one': 2.0
+    }
+    by_yield = prioritise_work_units(work_units, yields)
+    assert [unit.key for unit in by_yield[4:]] == [
+        'signature_0.files.one',
+        'signature_0.files.two',
+        'signature_2.messages.two',
+        'signature_2.files.one',
+        'signature_2.files.two',
+        'signature_2.messages.one',
+        'signature_0.messages.two',
+        'signature_0.messages.one'
+    ]
+
+
+def test_signature_scanner_records_query_yields(tmp_path):
+    """The pages fetched and findings emitted by each unit are added to its yield in the state store."""
+
+    state_store = StateStore(str(tmp_path))
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('messages', patterns=[r'secret'])
+    mock_slack.iter_page_api_search.side_effect = lambda *args, **kwargs: iter([
+        [{'text': 'secret one', 'user': None, 'channel': {'id': None}, 'ts': '1'}],
+        [{'text': 'nothing', 'user': None, 'channel': {'id': None}, 'ts': '2'}]
+    ])
+
+    _make_scanner(mock_slack, [], state_store=state_store).run(plan_work_units([mock_sig]))
+    assert state_store.get_query_yields() == {'test_signature.messages.test_query': 0.5}
+
+
+@patch('slack_watchman.watchman_processor.post')
+def test_signature_scanner_matches_file_content(mock_post):
+    """Text files that match are downloaded, and each distinct match in their content is a finding."""
+
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('files', patterns=[r'AKIA[0-9A-Z]{4}'], search_strings=['.env'])
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'id': 'F1', 'name': 'prod.env', 'filetype': 'text', 'user': 'U123', 'created': 1704067200,
+         'permalink_public': 'https://example.com/file', 'size': 100,
+         'url_private_download': 'https://files.slack.com/prod.env'},
+        {'id': 'F2', 'name': 'image.env', 'filetype': 'png', 'user': 'U123', 'created': 1704067200,
+         'permalink_public': 'https://example.com/image', 'size': 100,
+         'url_private_download': 'https://files.slack.com/image.env'},
+    ]])
+    file_reader = MagicMock(spec=FileContentReader)
+    file_reader.is_archive.return_value = False
+    file_reader.should_read.side_effect = lambda file_dict: file_dict.get('filetype') == 'text'
+    file_reader.iter_chunks.return_value = iter(['KEY=AKIAAAAA', 'AKIAAAAA\nO', '\nOTHER=AKIABBBB'])
+
+    findings = []
+    directory = MagicMock()
+    directory.get_user.return_value = 'MockUser'
+    scanner = _make_scanner(mock_slack, findings, directory=directory, file_reader=file_reader)
+    scanner.run(plan_work_units([mock_sig]))
+
+    file_reader.iter_chunks.assert_called_once()
+    assert sorted(finding.get('match_string') or '' for finding in findings) == ['', '', 'AKIAAAAA', 'AKIABBBB']
+    content_finding = next(finding for finding in findings if finding.get('match_string') == 'AKIABBBB')
+    assert content_finding['watchman_id'] == hashlib.md5('AKIABBBB.F1'.encode()).hexdigest()
+    assert content_finding['file'] == mock_post.create_file_from_dict.return_value
+
+
+def test_signature_scanner_file_content_download_error():
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('files', patterns=[r'secret'], search_strings=['.txt'])
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'id': 'F1', 'name': 'notes.txt', 'filetype': 'text', 'created': 1704067200,
+         'permalink_public': 'https://example.com/file', 'url_private_download': 'https://files.slack.com/f'},
+    ]])
+    file_reader = MagicMock(spec=FileContentReader)
+    file_reader.is_archive.return_value = False
+    file_reader.iter_chunks.side_effect = requests.exceptions.ConnectionError('reset')
+
+    findings = []
+    scanner = _make_scanner(mock_slack, findings, file_reader=file_reader)
+    scanner.run(plan_work_units([mock_sig]))
+
+    # The file still matched by name
+    assert len(findings) == 1
+    assert 'match_string' not in findings[0]
+    assert scanner.unit_completed(plan_work_units([mock_sig])[0].key)
+
+
+def test_signature_scanner_matches_archive_content():
+    mock_slack = MagicMock(spec=SlackClient)
+    mock_sig = _make_signature('files', patterns=[r'AKIA[0-9A-Z]{4}'], search_strings=['.zip'])
+    mock_slack.iter_page_api_search.return_value = iter([[
+        {'id': 'F1', 'name': 'config.zip', 'filetype': 'zip', 'created': 1704067200,
+         'permalink_public': 'https://example.com/file', 'url_private_download': 'https://files.slack.com/f'},
+    ]])
+    file_reader = MagicMock(spec=FileContentReader)
+    file_reader.is_archive.return_value = True
+    file_reader.iter_chunks.return_value = iter([])
+    file_reader.scan_archive.return_value = (['AKIAAAAA'], 'more than 1000 members')
+
+    findings = []
+    logger = MagicMock()
+    scanner = SignatureScanner(mock_slack, logger, verbose=False, timeframe='7d',
+                               on_finding=lambda unit, finding: findings.append(finding),
+                               directory=MagicMock(), file_reader=file_reader,
+                               all_matches=True)
+    scanner.run(plan_work_units([mock_sig]))
+
+    assert [finding.get('match_string') for finding in findings] == [None, 'AKIAAAAA']
+    assert file_reader.scan_archive.call_args.args[1] == 'test_signature'
+    # --all-matches is passed through, so every match in an archive member is reported
+    assert file_reader.scan_archive.call_args.args[-1] is True
+    assert any(call.args[0] == 'WARNING' and 'more than 1000 members' in call.args[1]
+               for call in logger.log.call_args_list)